@@ -1,18 +1,50 @@
 # -*- coding: utf-8 -*-
 from dotenv import load_dotenv
 import os
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, get_args
+import base64
+import hashlib
+import csv
+import io
+import json
+import re
+import unicodedata
+import tempfile
 import uuid
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
+from pathlib import Path
 from enum import Enum
 import locale
-from fastapi import FastAPI, APIRouter, HTTPException
+import math
+import asyncio
+import bisect
+import heapq
+import logging
+import threading
+import time
+import warnings
+from collections import OrderedDict, deque
+from itertools import islice
+import numpy as np
+import typer
+from fastapi import FastAPI, APIRouter, Header, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
+from starlette.routing import Match
 from motor.motor_asyncio import AsyncIOMotorClient
-from pydantic import BaseModel, Field
+from pymongo import ASCENDING, DESCENDING, IndexModel, InsertOne, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+from pydantic import BaseModel, Field, ValidationError
+
+try:
+    import orjson
+except ImportError:  # opcional: sem ele a serialização rápida usa o módulo json
+    orjson = None
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 try:
     locale.setlocale(locale.LC_ALL, 'pt_BR.UTF-8')
 except locale.Error:
@@ -21,24 +53,696 @@ except locale.Error:
     except locale.Error:
         print("Locale 'pt_BR.UTF-8' and 'C.UTF-8' not supported.")
 
-MONGO_URI = os.getenv("MONGO_URI")
+# Métricas
+# Latência por rota (histograma), contagem de requisições e requisições em
+# andamento, além do tempo de cada comando do Mongo por coleção/operação,
+# documentos devolvidos e espera por conexão no pool. Tudo fica em memória e é
+# servido no formato texto do Prometheus em /api/metrics. METRICS_ENABLED=0
+# desliga a coleta.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_label_value(value)}"' for key, value in pairs) + "}"
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class MetricsRegistry:
+    """Contadores, gauges e histogramas em memória, no formato texto do Prometheus.
+
+    As séries são identificadas por (nome, labels), com labels numa tupla de
+    pares (chave, valor). Os listeners do pymongo rodam nas threads do Motor,
+    por isso as atualizações passam por um lock.
+    """
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._descriptions = {}
+        self._values = {}
+        self._histograms = {}
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._descriptions[name] = (kind, help_text)
+
+    def inc(self, name: str, labels: tuple = (), amount: float = 1):
+        key = (name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, name: str, labels: tuple, value: float):
+        with self._lock:
+            self._values[(name, labels)] = value
+
+    def observe(self, name: str, labels: tuple, value: float):
+        key = (name, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # Contagens por faixa (não acumuladas), soma e total
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def value(self, name: str, labels: tuple = ()) -> float:
+        return self._values.get((name, labels), 0)
+
+    def total(self, name: str) -> float:
+        """Soma de todas as séries de uma métrica (ex.: conexões em uso em todos os servidores)"""
+        with self._lock:
+            return sum(value for (metric, _), value in self._values.items() if metric == name)
+
+    def render(self) -> str:
+        with self._lock:
+            values = sorted(self._values.items())
+            histograms = sorted((key, (list(h[0]), h[1], h[2])) for key, h in self._histograms.items())
+
+        series = {}
+        for (name, labels), value in values:
+            series.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+        for (name, labels), (counts, total, count) in histograms:
+            lines = series.setdefault(name, [])
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {repr(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        output = []
+        for name in sorted(series):
+            kind, help_text = self._descriptions.get(name, ("untyped", name))
+            output.append(f"# HELP {name} {help_text}")
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(series[name])
+        return "\n".join(output) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._histograms.clear()
+
+metrics = MetricsRegistry()
+metrics.describe("http_requests_total", "counter", "Requisições HTTP atendidas, por rota e status")
+metrics.describe("http_request_duration_seconds", "histogram", "Latência das requisições HTTP, por rota")
+metrics.describe("http_requests_in_flight", "gauge", "Requisições HTTP em andamento, por rota")
+metrics.describe("mongodb_command_duration_seconds", "histogram", "Duração dos comandos do Mongo, por coleção e operação")
+metrics.describe("mongodb_command_failures_total", "counter", "Comandos do Mongo que falharam, por coleção e operação")
+metrics.describe("mongodb_documents_returned_total", "counter", "Documentos devolvidos por find/aggregate/getMore, por coleção")
+metrics.describe("mongodb_pool_wait_seconds", "histogram", "Espera para obter uma conexão do pool")
+metrics.describe("mongodb_pool_checkout_failures_total", "counter", "Falhas ao obter uma conexão do pool, por motivo")
+metrics.describe("mongodb_pool_connections", "gauge", "Conexões abertas no pool, por servidor")
+metrics.describe("mongodb_pool_connections_in_use", "gauge", "Conexões do pool em uso, por servidor")
+metrics.describe("mongodb_pool_waiting", "gauge", "Operações aguardando uma conexão livre do pool")
+metrics.describe("mongodb_pool_max_connections", "gauge", "Tamanho máximo do pool de conexões (MONGO_MAX_POOL_SIZE)")
+metrics.describe("admission_in_flight", "gauge", "Requisições admitidas em andamento, por limitador")
+metrics.describe("admission_queue_depth", "gauge", "Requisições aguardando admissão, por limitador")
+metrics.describe("admission_rejected_total", "counter", "Requisições recusadas pelo controle de admissão, por limitador e motivo")
+metrics.describe("sse_subscribers", "gauge", "Assinantes conectados a /api/events")
+metrics.describe("sse_events_total", "counter", "Eventos publicados em /api/events, por tipo")
+metrics.describe("sse_resyncs_total", "counter", "Assinantes que ficaram para trás e receberam resync")
+
+def resolve_route_template(scope) -> str:
+    """Rota declarada (ex.: /api/clients/{client_id}) que atende a requisição.
+
+    Usar o template, e não o caminho, mantém a cardinalidade das métricas
+    limitada ao número de rotas. O resultado fica guardado no scope para os
+    demais middlewares.
+    """
+    template = scope.get("route_template")
+    if template is not None:
+        return template
+    partial = None
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            template = route.path
+            break
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    scope["route_template"] = template = template or partial or "desconhecida"
+    return template
+
+class MetricsMiddleware:
+    """Middleware ASGI que mede cada requisição HTTP sem passar pelo BaseHTTPMiddleware"""
+
+    def __init__(self, app, registry: MetricsRegistry = None):
+        self.app = app
+        self.registry = registry or metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        labels = (("method", scope["method"]), ("route", resolve_route_template(scope)))
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        self.registry.inc("http_requests_in_flight", labels)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.registry.observe("http_request_duration_seconds", labels, time.perf_counter() - started)
+            self.registry.inc("http_requests_total", labels + (("status", str(status_code)),))
+            self.registry.inc("http_requests_in_flight", labels, -1)
+
+# Controle de admissão
+# Cada requisição pertence a uma classe de prioridade, com seu próprio limite
+# de concorrência e fila: escritas (critica) e leituras rápidas (interativa)
+# não disputam vagas com exportações e relatórios pesados (pesada). Rotas
+# podem ter ainda um limite próprio. Acima do limite a requisição espera na
+# fila, em ordem de chegada, até o tempo máximo da classe (503 ao estourar);
+# com a fila cheia é recusada na hora (429). As duas respostas trazem
+# Retry-After estimado pelo tempo médio de atendimento. Limites, filas e
+# classes são configuráveis por variáveis de ambiente; ocupação e filas
+# aparecem em /api/metrics e /api/admin/admission.
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+ADMISSION_CLASS_DEFAULTS = {
+    # classe: (concorrência, fila, espera máxima em segundos)
+    "critica": (64, 256, 10.0),
+    "interativa": (32, 128, 5.0),
+    "pesada": (4, 16, 30.0),
+}
+# Rotas fora do controle: sondas, métricas e streams de longa duração (o
+# download de um job só lê o arquivo pronto, mas pode ocupar a vaga por
+# minutos num cliente lento)
+ADMISSION_EXEMPT = {
+    "GET /api/health/live", "GET /api/health/ready", "GET /api/metrics",
+    "GET /api/events", "GET /api/admin/admission", "GET /api/export/jobs/{job_id}/download",
+}
+# Sem entrada aqui, GET é "interativa" e os demais métodos, "critica"
+ADMISSION_ROUTE_CLASSES = {
+    "GET /api/export/transactions": "pesada",
+    "GET /api/export/clients": "pesada",
+    "GET /api/export/dashboard": "pesada",
+    # O relatório mensal lê o rollup (uma consulta pequena), não as transações
+    "GET /api/reports/monthly": "interativa",
+    "GET /api/reports/series": "pesada",
+    "GET /api/reports/segments": "pesada",
+    "GET /api/admin/indexes": "pesada",
+    "GET /api/admin/rollups/verify": "pesada",
+    "POST /api/admin/rollups/rebuild": "pesada",
+    "GET /api/admin/receivables/verify": "pesada",
+    "POST /api/admin/receivables/rebuild": "pesada",
+    "GET /api/admin/client-values/verify": "pesada",
+    "POST /api/admin/client-values/rebuild": "pesada",
+}
+ADMISSION_ROUTE_LIMITS = {
+    "GET /api/export/transactions": 2,
+    "GET /api/export/clients": 2,
+}
+
+def parse_route_settings(value: str, convert) -> dict:
+    """`"GET /api/x=valor;POST /api/y=valor"` -> {"GET /api/x": valor, ...}"""
+    settings = {}
+    for item in filter(None, (part.strip() for part in value.split(";"))):
+        route, _, setting = item.rpartition("=")
+        settings[route.strip()] = convert(setting.strip())
+    return settings
+
+ADMISSION_ROUTE_CLASSES.update(parse_route_settings(os.getenv("ADMISSION_ROUTE_CLASSES", ""), str))
+ADMISSION_ROUTE_LIMITS.update(parse_route_settings(os.getenv("ADMISSION_ROUTE_LIMITS", ""), int))
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionLimiter:
+    """Limite de concorrência com fila FIFO limitada e espera máxima"""
+
+    def __init__(self, name: str, concurrency: int, queue_size: int, timeout: float,
+                 registry: MetricsRegistry = None):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.registry = registry or metrics
+        self.active = 0
+        self.admitted = 0
+        self.rejected = {"fila_cheia": 0, "tempo_esgotado": 0}
+        # Média móvel do tempo de atendimento, base do Retry-After
+        self.service_seconds = 1.0
+        self._waiters = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> int:
+        backlog = (self.waiting + 1) / max(self.concurrency, 1)
+        return max(1, math.ceil(self.service_seconds * backlog))
+
+    def _publish(self):
+        labels = (("limiter", self.name),)
+        self.registry.set("admission_in_flight", labels, self.active)
+        self.registry.set("admission_queue_depth", labels, self.waiting)
+
+    def _reject(self, status_code: int, reason: str):
+        self.rejected[reason] += 1
+        self.registry.inc("admission_rejected_total", (("limiter", self.name), ("reason", reason)))
+        return AdmissionRejected(status_code, reason, self.retry_after())
+
+    async def acquire(self):
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+        elif self.waiting >= self.queue_size:
+            raise self._reject(429, "fila_cheia")
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            self._publish()
+            try:
+                # A vaga é repassada por release() já contada em `active`
+                await asyncio.wait_for(waiter, self.timeout)
+            except asyncio.TimeoutError:
+                self._discard(waiter)
+                raise self._reject(503, "tempo_esgotado")
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self.release()
+                else:
+                    self._discard(waiter)
+                raise
+        self.admitted += 1
+        self._publish()
+
+    def _discard(self, waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+        self._publish()
+
+    def release(self, elapsed: Optional[float] = None):
+        if elapsed is not None:
+            self.service_seconds = 0.8 * self.service_seconds + 0.2 * elapsed
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._publish()
+                return
+        self.active -= 1
+        self._publish()
+
+    def status(self) -> dict:
+        return {
+            "concorrencia": self.concurrency,
+            "em_andamento": self.active,
+            "fila": self.waiting,
+            "fila_maxima": self.queue_size,
+            "espera_maxima_s": self.timeout,
+            "admitidas": self.admitted,
+            "recusadas": dict(self.rejected),
+            "tempo_medio_s": round(self.service_seconds, 3),
+        }
+
+class AdmissionController:
+    """Limitadores por classe de prioridade e por rota"""
+
+    def __init__(self, registry: MetricsRegistry = None):
+        self.classes = {}
+        for name, (concurrency, queue_size, timeout) in ADMISSION_CLASS_DEFAULTS.items():
+            prefix = f"ADMISSION_{name.upper()}"
+            self.classes[name] = AdmissionLimiter(
+                name,
+                int(os.getenv(f"{prefix}_CONCURRENCY", str(concurrency))),
+                int(os.getenv(f"{prefix}_QUEUE", str(queue_size))),
+                float(os.getenv(f"{prefix}_TIMEOUT", str(timeout))),
+                registry,
+            )
+        heavy = self.classes["pesada"]
+        self.routes = {
+            route: AdmissionLimiter(route, limit, heavy.queue_size, heavy.timeout, registry)
+            for route, limit in ADMISSION_ROUTE_LIMITS.items()
+        }
+
+    def limiters(self, method: str, template: str) -> List[AdmissionLimiter]:
+        key = f"{method} {template}"
+        if key in ADMISSION_EXEMPT or method == "OPTIONS":
+            return []
+        priority = ADMISSION_ROUTE_CLASSES.get(key) or ("interativa" if method in ("GET", "HEAD") else "critica")
+        # O limite da rota vem primeiro: quem espera por ele não ocupa vaga da classe
+        return [self.routes[key], self.classes[priority]] if key in self.routes else [self.classes[priority]]
+
+    def status(self) -> dict:
+        return {
+            "classes": {name: limiter.status() for name, limiter in self.classes.items()},
+            "rotas": {route: limiter.status() for route, limiter in self.routes.items()},
+        }
+
+admission = AdmissionController()
+
+class AdmissionMiddleware:
+    """Middleware ASGI que aplica o controle de admissão antes de chegar à rota"""
+
+    def __init__(self, app, controller: AdmissionController = None):
+        self.app = app
+        self.controller = controller or admission
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        acquired = []
+        try:
+            for limiter in self.controller.limiters(scope["method"], resolve_route_template(scope)):
+                await limiter.acquire()
+                acquired.append(limiter)
+        except AdmissionRejected as rejected:
+            for limiter in acquired:
+                limiter.release()
+            detail = ("Servidor ocupado, tente novamente em instantes" if rejected.status_code == 503
+                      else "Muitas requisições, tente novamente em instantes")
+            response = JSONResponse({"detail": detail}, status_code=rejected.status_code,
+                                    headers={"Retry-After": str(rejected.retry_after)})
+            await response(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            elapsed = time.perf_counter() - started
+            for limiter in reversed(acquired):
+                limiter.release(elapsed)
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Tempo, falhas e documentos devolvidos de cada comando enviado ao Mongo"""
+
+    CURSOR_BATCHES = {"find": "firstBatch", "aggregate": "firstBatch", "getMore": "nextBatch"}
+
+    def __init__(self, registry: MetricsRegistry = None):
+        self.registry = registry or metrics
+        # Coleção de cada comando em andamento; o evento de término não traz o comando
+        self._collections = {}
+
+    def started(self, event):
+        name = event.command_name
+        collection = event.command.get("collection" if name == "getMore" else name)
+        self._collections[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else "-"
+
+    def _finished(self, event) -> tuple:
+        collection = self._collections.pop((event.connection_id, event.request_id), "-")
+        labels = (("collection", collection), ("command", event.command_name))
+        self.registry.observe("mongodb_command_duration_seconds", labels, event.duration_micros / 1_000_000)
+        return labels
+
+    def succeeded(self, event):
+        labels = self._finished(event)
+        batch = self.CURSOR_BATCHES.get(event.command_name)
+        if batch:
+            documents = (event.reply.get("cursor") or {}).get(batch) or ()
+            self.registry.inc("mongodb_documents_returned_total", labels, len(documents))
+
+    def failed(self, event):
+        self.registry.inc("mongodb_command_failures_total", self._finished(event))
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """Conexões abertas/em uso e espera por conexão no pool do Mongo.
+
+    O check-out de uma conexão começa e termina na mesma thread, então o
+    instante de início fica num threading.local.
+    """
+
+    def __init__(self, registry: MetricsRegistry = None):
+        self.registry = registry or metrics
+        self._local = threading.local()
+
+    @staticmethod
+    def _server(event) -> tuple:
+        host, port = event.address
+        return (("server", f"{host}:{port}"),)
+
+    def _waited(self):
+        started = getattr(self._local, "started", None)
+        if started is not None:
+            self.registry.observe("mongodb_pool_wait_seconds", (), time.perf_counter() - started)
+            self._local.started = None
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+        self.registry.inc("mongodb_pool_waiting")
+
+    def connection_checked_out(self, event):
+        self._waited()
+        self.registry.inc("mongodb_pool_waiting", (), -1)
+        self.registry.inc("mongodb_pool_connections_in_use", self._server(event))
+
+    def connection_check_out_failed(self, event):
+        self._waited()
+        self.registry.inc("mongodb_pool_waiting", (), -1)
+        self.registry.inc("mongodb_pool_checkout_failures_total", (("reason", str(event.reason)),))
+
+    def connection_checked_in(self, event):
+        self.registry.inc("mongodb_pool_connections_in_use", self._server(event), -1)
+
+    def connection_created(self, event):
+        self.registry.inc("mongodb_pool_connections", self._server(event))
+
+    def connection_closed(self, event):
+        self.registry.inc("mongodb_pool_connections", self._server(event), -1)
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+# Log de consultas lentas
+# Modo de diagnóstico: todo find/aggregate que passa de SLOW_QUERY_MS
+# (0 = desligado) é guardado num buffer circular com a forma da consulta
+# (valores trocados pelo tipo), o plano vencedor do explain() e se houve
+# COLLSCAN. O explain roda no event loop, fora do caminho da requisição, e no
+# máximo uma vez a cada SLOW_QUERY_EXPLAIN_INTERVAL segundos por forma.
+# Os planos ficam num LRU de até SLOW_QUERY_PLAN_CACHE_SIZE formas.
+SLOW_QUERY_COMMANDS = {"find", "aggregate"}
+# Campos de sessão/transporte que não fazem parte da consulta
+COMMAND_TRANSPORT_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction"}
+
+def query_shape(value):
+    """Estrutura da consulta com os valores literais trocados pelo nome do tipo"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if all(not isinstance(item, (dict, list, tuple)) for item in value):
+            # Listas de valores ($in, $nin...) viram os tipos presentes
+            return sorted({type(item).__name__ for item in value})
+        return [query_shape(item) for item in value]
+    return type(value).__name__
+
+def find_query_planner(explain: dict) -> Optional[dict]:
+    """queryPlanner do explain, que no aggregate pode estar dentro do estágio $cursor"""
+    if not isinstance(explain, dict):
+        return None
+    if "queryPlanner" in explain:
+        return explain["queryPlanner"]
+    for item in explain.values():
+        for candidate in item if isinstance(item, list) else [item]:
+            planner = find_query_planner(candidate)
+            if planner:
+                return planner
+    return None
+
+def plan_stages(plan) -> set:
+    if isinstance(plan, dict):
+        stages = {plan["stage"]} if "stage" in plan else set()
+        for item in plan.values():
+            stages |= plan_stages(item)
+        return stages
+    if isinstance(plan, list):
+        return set().union(*(plan_stages(item) for item in plan)) if plan else set()
+    return set()
+
+class SlowQueryLog(monitoring.CommandListener):
+    """Buffer circular das consultas lentas, alimentado pelos eventos de comando do pymongo"""
+
+    def __init__(self, threshold_ms: float, max_entries: int = 100, explain_interval: float = 60,
+                 max_plans: int = 500):
+        self.threshold_ms = threshold_ms
+        self.explain_interval = explain_interval
+        self.max_plans = max_plans
+        self.entries = deque(maxlen=max_entries)
+        self.loop = None
+        self._commands = {}
+        # Planos por forma de consulta: LRU limitado a max_plans, e entradas
+        # mais velhas que explain_interval saem a cada inserção
+        self._plans = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms > 0
+
+    def bind(self, loop):
+        """Event loop onde os explain() são executados"""
+        self.loop = loop
+
+    def started(self, event):
+        if self.enabled and event.command_name in SLOW_QUERY_COMMANDS:
+            self._commands[(event.connection_id, event.request_id)] = (event.database_name, event.command)
+
+    def succeeded(self, event):
+        started = self._commands.pop((event.connection_id, event.request_id), None)
+        duration_ms = event.duration_micros / 1000
+        if started is None or duration_ms < self.threshold_ms:
+            return
+        database, command = started
+        command = {key: value for key, value in command.items()
+                   if not key.startswith("$") and key not in COMMAND_TRANSPORT_FIELDS}
+        sample = {
+            "registrado_em": datetime.utcnow().isoformat(),
+            "comando": event.command_name,
+            "colecao": command.get(event.command_name),
+            "duracao_ms": round(duration_ms, 3),
+            "forma": query_shape({key: value for key, value in command.items()
+                                  if key in ("filter", "sort", "projection", "pipeline", "hint")}),
+            "plano_vencedor": None,
+            "collscan": None,
+        }
+        if self.loop is None or self.loop.is_closed():
+            self.entries.append(sample)
+            return
+        self.loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self.capture_plan(database, command, sample)))
+
+    def failed(self, event):
+        self._commands.pop((event.connection_id, event.request_id), None)
+
+    async def capture_plan(self, database: str, command: dict, sample: dict):
+        key = json.dumps([sample["comando"], sample["colecao"], sample["forma"]], sort_keys=True)
+        cached = self._plans.get(key)
+        if cached and time.monotonic() - cached[0] < self.explain_interval:
+            self._plans.move_to_end(key)
+            plan = cached[1]
+        else:
+            try:
+                explain = await client[database].command({"explain": command, "verbosity": "queryPlanner"})
+                planner = find_query_planner(explain) or {}
+                plan = {"plano_vencedor": planner.get("winningPlan"),
+                        "collscan": "COLLSCAN" in plan_stages(planner.get("winningPlan"))}
+            except PyMongoError as e:
+                plan = {"erro_explain": str(e)}
+            self._store_plan(key, plan)
+        sample.update(plan)
+        self.entries.append(sample)
+
+    def _store_plan(self, key: str, plan: dict):
+        now = time.monotonic()
+        for expired in [k for k, (stored_at, _) in self._plans.items() if now - stored_at >= self.explain_interval]:
+            del self._plans[expired]
+        self._plans[key] = (now, plan)
+        self._plans.move_to_end(key)
+        while len(self._plans) > self.max_plans:
+            self._plans.popitem(last=False)
+
+    def samples(self) -> List[dict]:
+        return list(reversed(self.entries))
+
+    def clear(self):
+        self.entries.clear()
+        self._plans.clear()
+
+slow_queries = SlowQueryLog(
+    threshold_ms=float(os.getenv("SLOW_QUERY_MS", "0")),
+    max_entries=int(os.getenv("SLOW_QUERY_BUFFER_SIZE", "100")),
+    explain_interval=float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "60")),
+    max_plans=int(os.getenv("SLOW_QUERY_PLAN_CACHE_SIZE", "500")),
+)
+
+# Conexão com o Mongo
+# Cada worker do gunicorn tem o seu pool, então o tamanho e os timeouts vêm do
+# ambiente (MONGO_MAX_POOL_SIZE etc.) para que workers x pool caibam no limite
+# de conexões do servidor. Na inicialização, MONGO_WARMUP_CONNECTIONS conexões
+# são abertas antes da primeira requisição. O listener do pool fica sempre
+# ativo: é dele que /api/health/ready tira a saturação do pool.
+MONGO_URI = os.getenv("MONGO_URI") or os.getenv("MONGO_URL")
 DB_NAME = os.getenv("DB_NAME")
 
-client = AsyncIOMotorClient(MONGO_URI)
+# Variável de ambiente -> (opção do MongoClient, conversão, padrão)
+MONGO_CLIENT_SETTINGS = {
+    "MONGO_MAX_POOL_SIZE": ("maxPoolSize", int, 25),
+    "MONGO_MIN_POOL_SIZE": ("minPoolSize", int, 0),
+    "MONGO_MAX_CONNECTING": ("maxConnecting", int, None),
+    "MONGO_MAX_IDLE_TIME_MS": ("maxIdleTimeMS", int, None),
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": ("waitQueueTimeoutMS", int, 5000),
+    "MONGO_CONNECT_TIMEOUT_MS": ("connectTimeoutMS", int, 5000),
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": ("serverSelectionTimeoutMS", int, 5000),
+    "MONGO_SOCKET_TIMEOUT_MS": ("socketTimeoutMS", int, None),
+    # Lista separada por vírgulas: zstd, snappy e/ou zlib
+    "MONGO_COMPRESSORS": ("compressors", str, None),
+}
+MONGO_WARMUP_CONNECTIONS = int(os.getenv("MONGO_WARMUP_CONNECTIONS", "4"))
+MONGO_HEALTH_TIMEOUT = float(os.getenv("MONGO_HEALTH_TIMEOUT_MS", "2000")) / 1000
+
+def mongo_client_options() -> dict:
+    options = {}
+    for variable, (option, convert, default) in MONGO_CLIENT_SETTINGS.items():
+        value = os.getenv(variable)
+        value = convert(value) if value not in (None, "") else default
+        if value is not None:
+            options[option] = value
+    return options
+
+MONGO_OPTIONS = mongo_client_options()
+metrics.set("mongodb_pool_max_connections", (), MONGO_OPTIONS["maxPoolSize"])
+
+client = AsyncIOMotorClient(
+    MONGO_URI,
+    event_listeners=([MongoCommandMetrics()] if METRICS_ENABLED else []) + [MongoPoolMetrics(), slow_queries],
+    **MONGO_OPTIONS,
+)
 db = client[DB_NAME]
 
 app = FastAPI(title="API Painel Financeiro Ótica", version="1.0.0")
 
 origins = os.getenv('CORS_ORIGINS', '*').split(',')
 
+# O controle de admissão fica dentro do CORS (as recusas levam os headers de
+# CORS) e das métricas (as recusas são contadas)
+if ADMISSION_ENABLED:
+    app.add_middleware(AdmissionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Accept-Ranges", "Content-Range", "Content-Length",
+                    "Idempotent-Replayed", "Retry-After"],
 )
 
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 api_router = APIRouter(prefix="/api")
 
 # Enums
@@ -104,6 +808,53 @@ class OrigemCliente(str, Enum):
     PASSANDO_RUA = "passando_rua"
     OUTROS = "outros"
 
+class BulkOperationType(str, Enum):
+    CREATE = "create"
+    UPDATE = "update"
+    DELETE = "delete"
+
+class SearchMode(str, Enum):
+    PREFIXO = "prefixo"
+    TOKENS = "tokens"
+
+class ExportFormat(str, Enum):
+    JSON = "json"
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+class SeriesGranularity(str, Enum):
+    DIA = "day"
+    SEMANA = "week"
+    MES = "month"
+    TRIMESTRE = "quarter"
+    ANO = "year"
+
+class SeriesGrouping(str, Enum):
+    CATEGORIA = "categoria"
+    TIPO = "tipo"
+
+class ClientSort(str, Enum):
+    NOME = "nome"
+    VALOR = "valor"
+    ULTIMA_COMPRA = "ultima_compra"
+
+class ExportJobFormat(str, Enum):
+    CSV = "csv"
+    XLSX = "xlsx"
+    JSON = "json"
+    NDJSON = "ndjson"
+
+class ExportResource(str, Enum):
+    TRANSACOES = "transactions"
+    CLIENTES = "clients"
+    DASHBOARD = "dashboard"
+
+class ExportJobStatus(str, Enum):
+    PENDENTE = "pendente"
+    EXECUTANDO = "executando"
+    CONCLUIDO = "concluido"
+    FALHOU = "falhou"
+
 # Models
 class TransactionCreate(BaseModel):
     tipo: Optional[TransactionType] = None
@@ -138,10 +889,16 @@ class ClientCreate(BaseModel):
 class Transaction(TransactionCreate):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    version: int = 1
 
 class Client(ClientCreate):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    version: int = 1
+    # Mantidos pelas escritas de transações (entradas com cliente_id)
+    total_gasto: float = 0.0
+    compras_registradas: int = 0
+    ultima_compra: Optional[date] = None
 
 class TransactionUpdate(BaseModel):
     tipo: Optional[TransactionType] = None
@@ -173,6 +930,25 @@ class ClientUpdate(BaseModel):
     origem_cliente: Optional[OrigemCliente] = None
     observacoes: Optional[str] = None
 
+class BulkOperation(BaseModel):
+    op: BulkOperationType
+    id: Optional[str] = None
+    dados: Optional[Dict[str, Any]] = None
+
+class BulkItemResult(BaseModel):
+    indice: int
+    op: BulkOperationType
+    id: Optional[str] = None
+    sucesso: bool
+    erro: Optional[str] = None
+    # Status HTTP equivalente ao da rota individual (409 = conflito de versão)
+    status: Optional[int] = None
+
+class BulkResult(BaseModel):
+    sucesso: int
+    falhas: int
+    resultados: List[BulkItemResult]
+
 class MonthlyReport(BaseModel):
     mes: int
     ano: int
@@ -181,233 +957,3637 @@ class MonthlyReport(BaseModel):
     faturamento_liquido: float
     transacoes_count: int
 
-# --- ROTAS DA API ---
+class ExportJobCreate(BaseModel):
+    recurso: ExportResource
+    formato: ExportJobFormat = ExportJobFormat.CSV
 
-@api_router.get("/")
-async def root():
-    return {"message": "Dashboard Financeiro - Ótica API"}
+class ExportJob(ExportJobCreate):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    status: ExportJobStatus = ExportJobStatus.PENDENTE
+    linhas_processadas: int = 0
+    total_estimado: Optional[int] = None
+    progresso: float = 0.0
+    tamanho_bytes: Optional[int] = None
+    erro: Optional[str] = None
+    criado_em: datetime = Field(default_factory=datetime.utcnow)
+    concluido_em: Optional[datetime] = None
+    expira_em: Optional[datetime] = None
+    download_url: Optional[str] = None
 
-# Routes - Transações
-@api_router.post("/transactions", response_model=Transaction)
-async def create_transaction(transaction: TransactionCreate):
-    """Criar nova transação financeira"""
-    transaction_obj = Transaction(**transaction.dict(exclude_unset=True))
-    transaction_data = transaction_obj.dict()
-    if transaction_data.get('data'):
-        transaction_data['data'] = transaction_data['data'].isoformat()
-    await db.transactions.insert_one(transaction_data)
-    return transaction_obj
+# Índices
+# Especificação declarativa dos índices de cada coleção. Cada índice espelha
+# um formato real de consulta das rotas abaixo (filtro + ordenação).
+INDEX_SPECS = {
+    "transactions": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # get_transactions: filtro por período + ordenação (data, id) da paginação por cursor
+        IndexModel([("data", DESCENDING), ("id", DESCENDING)], name="data_id_desc"),
+        # Busca por cliente (q / cliente_nome): prefixo da chave normalizada ou por palavra
+        IndexModel([("cliente_nome_busca", ASCENDING), ("data", DESCENDING)], name="cliente_nome_busca_data"),
+        IndexModel([("cliente_nome_tokens", ASCENDING)], name="cliente_nome_tokens"),
+        # Relatórios mensal e do dashboard: igualdade em ano/mes
+        IndexModel([("ano", ASCENDING), ("mes", ASCENDING)], name="ano_mes"),
+        # Histórico de compras do cliente, do mais recente para o mais antigo
+        IndexModel([("cliente_id", ASCENDING), ("data", DESCENDING), ("id", DESCENDING)], name="cliente_id_data_id"),
+    ],
+    "clients": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # get_clients sem filtro: ordenação (nome, id) da paginação por cursor
+        IndexModel([("nome", ASCENDING), ("id", ASCENDING)], name="nome_id"),
+        # get_clients por status + ordenação por nome; contagem de inadimplentes
+        IndexModel([("status", ASCENDING), ("nome", ASCENDING), ("id", ASCENDING)], name="status_nome_id"),
+        # Busca por nome (q): prefixo da chave normalizada ou por palavra
+        IndexModel([("nome_busca", ASCENDING), ("id", ASCENDING)], name="nome_busca_id"),
+        IndexModel([("nome_tokens", ASCENDING)], name="nome_tokens"),
+        # get_clients ordenado por valor (ordenar=valor) ou pela última compra
+        IndexModel([("total_gasto", DESCENDING), ("id", DESCENDING)], name="total_gasto_id"),
+        IndexModel([("ultima_compra", DESCENDING), ("id", DESCENDING)], name="ultima_compra_id"),
+    ],
+    "transaction_rollups": [
+        IndexModel([("dia", ASCENDING), ("categoria", ASCENDING)], name="dia_categoria_unique", unique=True),
+        IndexModel([("ano", ASCENDING), ("mes", ASCENDING)], name="ano_mes"),
+    ],
+    # Chaves de idempotência (o _id é "<coleção>:<chave>"); o TTL remove as vencidas
+    "idempotency_keys": [
+        IndexModel([("expira_em", ASCENDING)], name="expira_em_ttl", expireAfterSeconds=0),
+    ],
+    # Estado dos jobs de exportação; o TTL remove os vencidos e os abandonados
+    "export_jobs": [
+        IndexModel([("criado_em", DESCENDING)], name="criado_em_desc"),
+        IndexModel([("remover_em", ASCENDING)], name="remover_em_ttl", expireAfterSeconds=0),
+    ],
+    # Usada apenas com REPORT_CACHE_BACKEND=mongo; o TTL remove entradas expiradas
+    "report_cache": [
+        IndexModel([("expira_em", ASCENDING)], name="expira_em_ttl", expireAfterSeconds=0),
+    ],
+}
 
-@api_router.get("/transactions", response_model=List[Transaction])
-async def get_transactions(
-    data_inicio: Optional[date] = None, 
-    data_fim: Optional[date] = None, 
-    cliente_nome: Optional[str] = None,
-    skip: int = 0, 
-    limit: int = 100
-):
-    """Listar transações com filtros por data e nome do cliente."""
-    query = {}
-    if cliente_nome:
-        query["cliente_nome"] = {"$regex": cliente_nome, "$options": "i"}
+async def ensure_indexes():
+    """Cria os índices declarados em INDEX_SPECS (operação idempotente)"""
+    for collection_name, models in INDEX_SPECS.items():
+        try:
+            await db[collection_name].create_indexes(models)
+        except OperationFailure as e:
+            # Índice existente com mesmo nome e opções diferentes: não derruba a API
+            logger.warning("Falha ao criar índices de %s: %s", collection_name, e)
 
-    if data_inicio or data_fim:
-        query["data"] = {}
-        if data_inicio:
-            query["data"]["$gte"] = data_inicio.isoformat()
-        if data_fim:
-            query["data"]["$lte"] = data_fim.isoformat()
+async def index_report():
+    """Compara os índices existentes com INDEX_SPECS e aponta faltantes e sem uso"""
+    report = {}
+    for collection_name, models in INDEX_SPECS.items():
+        collection = db[collection_name]
+        declared = [m.document["name"] for m in models]
+        existing = await collection.index_information()
+        usage = {}
+        try:
+            async for stat in collection.aggregate([{"$indexStats": {}}]):
+                usage[stat["name"]] = {
+                    "operacoes": stat["accesses"]["ops"],
+                    "desde": stat["accesses"]["since"].isoformat(),
+                }
+        except OperationFailure as e:
+            logger.warning("$indexStats indisponível para %s: %s", collection_name, e)
+        report[collection_name] = {
+            "declarados": declared,
+            "faltando": [name for name in declared if name not in existing],
+            "nao_declarados": [name for name in existing if name != "_id_" and name not in declared],
+            "sem_uso": [name for name, stat in usage.items() if name != "_id_" and stat["operacoes"] == 0],
+            "uso": usage,
+        }
+    return report
 
-    transactions_from_db = await db.transactions.find(query).skip(skip).limit(limit).sort("data", -1).to_list(limit)
-    
-    for t in transactions_from_db:
-        if t.get('data') and isinstance(t['data'], str):
-            t['data'] = date.fromisoformat(t['data'])
-    
-    return [Transaction(**t) for t in transactions_from_db]
+# Datas das transações
+# `data` é persistida como data BSON (meia-noite UTC), acompanhada das chaves
+# `ano` e `mes` usadas pelos relatórios.
+def transaction_date_fields(value: Optional[date]) -> dict:
+    """Campos persistidos para a data de uma transação"""
+    if value is None:
+        return {"data": None, "ano": None, "mes": None}
+    return {"data": datetime(value.year, value.month, value.day), "ano": value.year, "mes": value.month}
 
-@api_router.delete("/transactions/{transaction_id}")
-async def delete_transaction(transaction_id: str):
-    """Deletar transação"""
-    result = await db.transactions.delete_one({"id": transaction_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Transação não encontrada")
-    return {"message": "Transação deletada com sucesso"}
+def client_from_db(doc: dict) -> "Client":
+    """Modelo do cliente a partir do documento (data_ultimo_pagamento é gravada como texto ISO)"""
+    if doc.get('data_ultimo_pagamento') and isinstance(doc['data_ultimo_pagamento'], str):
+        doc['data_ultimo_pagamento'] = date.fromisoformat(doc['data_ultimo_pagamento'])
+    return Client(**doc)
 
-@api_router.put("/transactions/{transaction_id}", response_model=Transaction)
-async def update_transaction(transaction_id: str, transaction_update: TransactionUpdate):
-    """Atualizar transação"""
-    update_data = transaction_update.dict(exclude_unset=True)
-    if not update_data:
-        raise HTTPException(status_code=400, detail="Nenhum campo para atualizar")
-    
-    if update_data.get('data'):
-        update_data['data'] = update_data['data'].isoformat()
-    
-    await db.transactions.update_one({"id": transaction_id}, {"$set": update_data})
-    
-    updated_transaction = await db.transactions.find_one({"id": transaction_id})
-    if not updated_transaction:
-        raise HTTPException(status_code=404, detail="Transação não encontrada após atualização")
+def transaction_from_db(doc: dict) -> dict:
+    """Converte a data armazenada (data BSON ou texto ISO legado) para `date`"""
+    value = doc.get('data')
+    if isinstance(value, datetime):
+        doc['data'] = value.date()
+    elif value and isinstance(value, str):
+        doc['data'] = date.fromisoformat(value[:10])
+    return doc
 
-    if updated_transaction.get('data') and isinstance(updated_transaction['data'], str):
-        updated_transaction['data'] = date.fromisoformat(updated_transaction['data'])
-        
-    return Transaction(**updated_transaction)
+# Consolidados diários (rollups)
+# `transaction_rollups` guarda, por dia e categoria, os totais de entradas,
+# saídas e a quantidade de transações. As rotas de escrita aplicam deltas com
+# $inc (valor antigo sai, valor novo entra) e os relatórios leem apenas essas
+# linhas em vez de reagregar a coleção de transações.
+ROLLUP_FIELDS = ("entradas", "saidas", "count")
 
-# Routes - Relatórios
-@api_router.get("/reports/monthly")
-async def get_monthly_reports(ano: Optional[int] = None):
-    """Relatório mensal de entradas e saídas"""
-    if not ano:
-        ano = datetime.now().year
-    
+def rollup_contribution(doc: Optional[dict]) -> Optional[tuple]:
+    """Chave (dia, categoria) e totais com que uma transação armazenada contribui"""
+    if not doc or not isinstance(doc.get("data"), datetime):
+        return None
+    valor = doc.get("valor") or 0
+    tipo = doc.get("tipo")
+    totals = {
+        "entradas": valor if tipo == TransactionType.ENTRADA else 0,
+        "saidas": valor if tipo == TransactionType.SAIDA else 0,
+        "count": 1,
+    }
+    return (doc["data"], doc.get("categoria")), totals
+
+async def apply_rollup_deltas(changes: List[tuple]):
+    """Para cada par (antigo, novo), retira a contribuição do antigo e soma a do novo"""
+    deltas = {}
+    for old_doc, new_doc in changes:
+        for doc, sign in ((old_doc, -1), (new_doc, 1)):
+            contribution = rollup_contribution(doc)
+            if contribution is None:
+                continue
+            key, totals = contribution
+            delta = deltas.setdefault(key, dict.fromkeys(ROLLUP_FIELDS, 0))
+            for field in ROLLUP_FIELDS:
+                delta[field] += sign * totals[field]
+    operations = [
+        UpdateOne(
+            {"dia": dia, "categoria": categoria},
+            {"$inc": delta, "$setOnInsert": {"ano": dia.year, "mes": dia.month}},
+            upsert=True,
+        )
+        for (dia, categoria), delta in deltas.items()
+        if any(delta.values())
+    ]
+    if operations:
+        await db.transaction_rollups.bulk_write(operations, ordered=False)
+
+async def expected_rollups(closed_years: List[int]) -> dict:
+    """Recalcula os rollups a partir da coleção de transações (anos fechados à parte)"""
     pipeline = [
-        {"$match": {"data": {"$regex": f"^{ano}"}}},
-        {"$addFields": {"date_obj": {"$dateFromString": {"dateString": "$data"}}}},
+        {"$match": {"data": {"$type": "date"}, "ano": {"$nin": closed_years}}},
         {"$group": {
-            "_id": {"$month": "$date_obj"},
+            "_id": {"dia": "$data", "categoria": "$categoria"},
             "entradas": {"$sum": {"$cond": [{"$eq": ["$tipo", "entrada"]}, "$valor", 0]}},
             "saidas": {"$sum": {"$cond": [{"$eq": ["$tipo", "saida"]}, "$valor", 0]}},
-            "total_transacoes": {"$sum": 1}
+            "count": {"$sum": 1},
         }},
-        {"$sort": {"_id": 1}}
     ]
-    result = await db.transactions.aggregate(pipeline).to_list(12)
-    
-    monthly_data = []
-    for item in result:
-        monthly_data.append({
-            "mes": item["_id"], "ano": ano,
-            "total_entradas": round(item["entradas"], 2),
-            "total_saidas": round(item["saidas"], 2),
-            "faturamento_liquido": round(item["entradas"] - item["saidas"], 2),
-            "transacoes_count": item["total_transacoes"]
-        })
-    return monthly_data
+    expected = {}
+    async for item in db.transactions.aggregate(pipeline, allowDiskUse=True):
+        key = (item["_id"]["dia"], item["_id"].get("categoria"))
+        expected[key] = {field: item[field] for field in ROLLUP_FIELDS}
+    return expected
+
+async def reconcile_rollups(fix: bool = False) -> dict:
+    """Compara os rollups com as transações e, se fix=True, corrige as divergências.
+
+    Os rollups dos anos fechados (arquivados) não mudam mais e ficam de fora.
+    """
+    closed_years = list(await archive_catalog.refresh(force=True))
+    expected = await expected_rollups(closed_years)
+    stored = {}
+    async for row in db.transaction_rollups.find({"ano": {"$nin": closed_years}}, {"_id": 0}):
+        stored[(row["dia"], row.get("categoria"))] = {field: row.get(field, 0) for field in ROLLUP_FIELDS}
+
+    empty = dict.fromkeys(ROLLUP_FIELDS, 0)
+    divergent = []
+    for key in set(expected) | set(stored):
+        want, have = expected.get(key, empty), stored.get(key, empty)
+        if any(round(want[f] - have[f], 2) != 0 for f in ROLLUP_FIELDS):
+            divergent.append((key, want, have))
+
+    if fix and divergent:
+        operations = [
+            UpdateOne(
+                {"dia": dia, "categoria": categoria},
+                {"$set": {**want, "ano": dia.year, "mes": dia.month}},
+                upsert=True,
+            )
+            for (dia, categoria), want, _ in divergent
+        ]
+        await db.transaction_rollups.bulk_write(operations, ordered=False)
+        await db.transaction_rollups.delete_many({"count": {"$lte": 0}, "ano": {"$nin": closed_years}})
 
-@api_router.get("/reports/dashboard")
-async def get_dashboard_data():
-    """Dados principais para o dashboard"""
-    current_date = datetime.now()
-    current_month_str = f"{current_date.year}-{current_date.month:02d}"
-    
-    pipeline_current = [
-        {"$match": {"data": {"$regex": f"^{current_month_str}"}}},
-        {"$group": {"_id": "$tipo", "total": {"$sum": "$valor"}}}
-    ]
-    current_month_data = await db.transactions.aggregate(pipeline_current).to_list(2)
-    
-    entradas_mes = next((item['total'] for item in current_month_data if item['_id'] == 'entrada'), 0)
-    saidas_mes = next((item['total'] for item in current_month_data if item['_id'] == 'saida'), 0)
-    
-    inadimplentes_count = await db.clients.count_documents({"status": "inadimplente"})
-    
-    pipeline_valor_devido = [
-        {"$match": {"status": "inadimplente"}},
-        {"$group": {"_id": None, "total": {"$sum": "$valor_devido"}}}
-    ]
-    valor_total_devido_result = await db.clients.aggregate(pipeline_valor_devido).to_list(1)
-    valor_devido = valor_total_devido_result[0]['total'] if valor_total_devido_result else 0
-    
     return {
-        "mes_atual": {
-            "entradas": round(entradas_mes, 2), "saidas": round(saidas_mes, 2),
-            "faturamento_liquido": round(entradas_mes - saidas_mes, 2)
-        },
-        "inadimplentes": {
-            "quantidade": inadimplentes_count, "valor_total_devido": round(valor_devido, 2)
-        }
+        "linhas_esperadas": len(expected),
+        "linhas_armazenadas": len(stored),
+        "divergencias": [
+            {"dia": dia.date().isoformat(), "categoria": categoria, "esperado": want, "armazenado": have}
+            for (dia, categoria), want, have in sorted(divergent, key=lambda d: (d[0][0], d[0][1] or ""))
+        ],
+        "corrigido": bool(fix and divergent),
     }
 
-# Routes - Clientes
-@api_router.post("/clients", response_model=Client)
-async def create_client(client: ClientCreate):
-    """Criar novo cliente"""
-    client_obj = Client(**client.dict(exclude_unset=True))
-    client_data = client_obj.dict()
-    if client_data.get('data_ultimo_pagamento'):
-        client_data['data_ultimo_pagamento'] = client_data['data_ultimo_pagamento'].isoformat()
-    await db.clients.insert_one(client_data)
-    return client_obj
+async def initialize_rollups():
+    """Constrói os rollups a partir de todo o histórico, uma vez.
 
-@api_router.get("/clients", response_model=List[Client])
-async def get_clients(skip: int = 0, limit: int = 100, status: Optional[ClientStatus] = None):
-    """Listar clientes"""
-    query = {}
-    if status:
-        query["status"] = status
-    clients_from_db = await db.clients.find(query).skip(skip).limit(limit).sort("nome", 1).to_list(limit)
-    for c in clients_from_db:
-        if c.get('data_ultimo_pagamento') and isinstance(c['data_ultimo_pagamento'], str):
-            c['data_ultimo_pagamento'] = date.fromisoformat(c['data_ultimo_pagamento'])
-    return [Client(**c) for c in clients_from_db]
+    A coleção não vazia não prova nada: escritas feitas antes desta migração já
+    criam linhas com deltas. O fim da construção fica marcado em `migrations`.
+    """
+    if await migration_done("transaction-rollups"):
+        return 0
+    result = await reconcile_rollups(fix=True)
+    await mark_migration_done("transaction-rollups")
+    return len(result["divergencias"])
 
-@api_router.put("/clients/{client_id}", response_model=Client)
-async def update_client(client_id: str, client_update: ClientUpdate):
-    """Atualizar cliente"""
-    update_data = client_update.dict(exclude_unset=True)
-    if not update_data:
-        raise HTTPException(status_code=400, detail="Nenhum campo para atualizar")
-        
-    if update_data.get('data_ultimo_pagamento'):
-        update_data['data_ultimo_pagamento'] = update_data['data_ultimo_pagamento'].isoformat()
-        
-    await db.clients.update_one({"id": client_id}, {"$set": update_data})
+# Arquivo de transações por ano
+# Anos fechados saem de `transactions` (que fica só com os anos em uso) para
+# uma coleção por ano, `transactions_<ano>`, por um job que roda com a API no
+# ar. O catálogo `transaction_archives` tem um documento por ano com o estado
+# ("arquivando" ou "arquivado") e, ao final, o relatório mensal do ano
+# calculado a partir da coleção arquivada, gravado uma vez e nunca alterado.
+# Um ano no catálogo não aceita escritas (409). Cada worker relê o catálogo a
+# cada ARCHIVE_CATALOG_TTL segundos, por isso o job espera
+# ARCHIVE_GRACE_SECONDS depois de fechar o ano antes de mover os documentos,
+# que são copiados e só então removidos, em lotes (o job pode ser retomado).
+# As leituras consultam apenas as partições do período pedido.
+ARCHIVE_COLLECTION_PREFIX = "transactions_"
+ARCHIVE_CATALOG_TTL = float(os.getenv("ARCHIVE_CATALOG_TTL", "30"))
+ARCHIVE_GRACE_SECONDS = float(os.getenv("ARCHIVE_GRACE_SECONDS", str(2 * ARCHIVE_CATALOG_TTL)))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+# Índices da coleção quente que servem às leituras de uma partição arquivada
+ARCHIVE_INDEX_NAMES = ("id_unique", "data_id_desc", "cliente_nome_busca_data", "cliente_nome_tokens", "cliente_id_data_id")
 
-    updated_client = await db.clients.find_one({"id": client_id})
-    if not updated_client:
-        raise HTTPException(status_code=404, detail="Cliente não encontrado após atualização")
+def archive_collection_name(ano: int) -> str:
+    return f"{ARCHIVE_COLLECTION_PREFIX}{ano}"
 
-    if updated_client.get('data_ultimo_pagamento') and isinstance(updated_client['data_ultimo_pagamento'], str):
-        updated_client['data_ultimo_pagamento'] = date.fromisoformat(updated_client['data_ultimo_pagamento'])
-        
-    return Client(**updated_client)
+class ArchiveCatalog:
+    """Anos fechados (arquivados ou em arquivamento), relidos de `transaction_archives`"""
 
-@api_router.delete("/clients/{client_id}")
-async def delete_client(client_id: str):
-    """Deletar cliente"""
-    result = await db.clients.delete_one({"id": client_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Cliente não encontrado")
-    return {"message": "Cliente deletado com sucesso"}
+    def __init__(self, ttl: float = ARCHIVE_CATALOG_TTL):
+        self.ttl = ttl
+        self.years: Dict[int, dict] = {}
+        self._loaded_at: Optional[float] = None
 
-# Routes - Exportação de dados
-@api_router.get("/export/transactions")
-async def export_transactions():
-    """Exportar todas as transações para CSV"""
-    transactions = await db.transactions.find().sort("data", -1).to_list(None)
-    return [Transaction(**t).dict() for t in transactions]
+    async def refresh(self, force: bool = False) -> Dict[int, dict]:
+        if force or self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            self.years = {doc["_id"]: doc async for doc in db.transaction_archives.find({})}
+            self._loaded_at = time.monotonic()
+        return self.years
 
-@api_router.get("/export/clients")
-async def export_clients():
-    """Exportar todos os clientes para CSV"""
-    clients = await db.clients.find().sort("nome", 1).to_list(None)
-    return [Client(**c).dict() for c in clients]
+    def archived(self, ano: int) -> Optional[dict]:
+        """Registro do ano se o arquivamento já terminou"""
+        record = self.years.get(ano)
+        return record if record and record["estado"] == "arquivado" else None
 
-@api_router.get("/export/dashboard")
-async def export_dashboard_data():
-    """Exportar dados completos do dashboard"""
-    dashboard_data = await get_dashboard_data()
-    monthly_data = await get_monthly_reports()
-    client_stats_pipeline = [
+    def closed_year_error(self, doc: Optional[dict]) -> Optional[str]:
+        ano = doc.get("ano") if doc else None
+        if ano in self.years:
+            return f"O ano {ano} está arquivado e não aceita alterações"
+        return None
+
+    def closed_filter(self) -> dict:
+        """Filtro que exclui da coleção quente os anos fechados ainda não movidos"""
+        return {"ano": {"$nin": list(self.years)}} if self.years else {}
+
+    def partitions(self, inicio: Optional[date] = None, fim: Optional[date] = None) -> list:
+        """Coleções com transações do período, da quente para a arquivada mais antiga.
+
+        A quente fica de fora só quando todos os anos do período já foram
+        arquivados; um ano em arquivamento está nas duas.
+        """
+        first, last = (inicio.year if inicio else None), (fim.year if fim else None)
+        years = sorted((ano for ano in self.years
+                        if (first is None or ano >= first) and (last is None or ano <= last)), reverse=True)
+        collections = [db[archive_collection_name(ano)] for ano in years]
+        if first is None or last is None or any(not self.archived(ano) for ano in range(first, last + 1)):
+            collections.insert(0, db.transactions)
+        return collections
+
+    def segments(self, inicio: Optional[date] = None, fim: Optional[date] = None) -> list:
+        """Partições do período na ordem decrescente de `data`, para leitura sequencial.
+
+        Cada segmento é uma lista de (coleção, filtro extra). Os anos fechados
+        dividem a coleção quente em faixas de data; a última faixa inclui as
+        transações sem data, que ficam no fim da ordem decrescente. Um ano em
+        arquivamento tem documentos nas duas coleções, e seu segmento junta a
+        faixa do ano na quente com a partição dele.
+        """
+        first, last = (inicio.year if inicio else None), (fim.year if fim else None)
+
+        def overlaps(low: Optional[int], high: Optional[int]) -> bool:
+            return (last is None or low is None or low <= last) and (first is None or high is None or high >= first)
+
+        def year_range(low: int, high: Optional[int]) -> dict:
+            bounds = {"$gte": datetime(low, 1, 1)}
+            if high is not None:
+                bounds["$lt"] = datetime(high + 1, 1, 1)
+            return {"data": bounds}
+
+        segments = []
+        upper = None  # último ano (inclusive) ainda não coberto na quente
+        for ano in sorted(self.years, reverse=True):
+            if (upper is None or upper > ano) and overlaps(ano + 1, upper):
+                segments.append([(db.transactions, year_range(ano + 1, upper))])
+            if overlaps(ano, ano):
+                archive = (db[archive_collection_name(ano)], {})
+                segments.append([archive] if self.archived(ano) else [(db.transactions, year_range(ano, ano)), archive])
+            upper = ano - 1
+        if upper is None:
+            segments.append([(db.transactions, {})])
+        elif overlaps(None, upper):
+            rest = {"$or": [{"data": {"$lt": datetime(upper + 1, 1, 1)}}, {"data": None}]}
+            segments.append([(db.transactions, rest)])
+        return segments
+
+archive_catalog = ArchiveCatalog()
+
+async def ensure_years_open(*docs: Optional[dict]):
+    """409 se alguma das transações cai num ano fechado"""
+    await archive_catalog.refresh()
+    for doc in docs:
+        error = archive_catalog.closed_year_error(doc)
+        if error:
+            raise HTTPException(status_code=409, detail=error)
+
+async def raise_if_archived(transaction_id: str):
+    """409 quando a transação que não pôde ser alterada pertence a um ano fechado"""
+    closed = list(await archive_catalog.refresh())
+    if not closed:
+        return
+    hot = await db.transactions.find_one({"id": transaction_id, "ano": {"$in": closed}}, {"_id": 1})
+    archived = hot or await find_archived_transactions([transaction_id])
+    if archived:
+        raise HTTPException(status_code=409, detail="Transação de ano arquivado não pode ser alterada")
+
+async def find_archived_transactions(ids: List[str], projection: Optional[dict] = None) -> List[dict]:
+    """Transações dos ids nas partições arquivadas (uma consulta por ano)"""
+    years = await archive_catalog.refresh()
+    if not years or not ids:
+        return []
+    results = await asyncio.gather(*(
+        db[archive_collection_name(ano)].find({"id": {"$in": ids}}, projection).to_list(len(ids))
+        for ano in years
+    ))
+    return [doc for docs in results for doc in docs]
+
+async def archive_monthly_rows(collection, ano: int) -> List[dict]:
+    """Relatório mensal calculado direto das transações de uma partição"""
+    pipeline = [
         {"$group": {
-            "_id": "$tipo_compra", "count": {"$sum": 1},
-            "valor_total_devido": {"$sum": "$valor_devido"},
-            "idade_media": {"$avg": "$idade"}, "renda_media": {"$avg": "$renda_bruta"}
-        }}
+            "_id": "$mes",
+            "entradas": {"$sum": {"$cond": [{"$eq": ["$tipo", "entrada"]}, "$valor", 0]}},
+            "saidas": {"$sum": {"$cond": [{"$eq": ["$tipo", "saida"]}, "$valor", 0]}},
+            "total_transacoes": {"$sum": 1},
+        }},
+        {"$sort": {"_id": 1}},
     ]
-    client_stats = await db.clients.aggregate(client_stats_pipeline).to_list(None)
-    return {
-        "dashboard": dashboard_data, "relatorio_mensal": monthly_data,
-        "estatisticas_clientes": client_stats,
-        "export_timestamp": datetime.utcnow().isoformat()
+    return monthly_report_rows(ano, await collection.aggregate(pipeline).to_list(12))
+
+async def archive_year(ano: int, grace: float = ARCHIVE_GRACE_SECONDS) -> dict:
+    """Move as transações de `ano` para transactions_<ano> e grava o rollup do ano.
+
+    Idempotente: chamado de novo num ano em arquivamento, retoma de onde parou.
+    """
+    if ano >= date.today().year:
+        raise ValueError("Apenas anos já encerrados podem ser arquivados")
+    name = archive_collection_name(ano)
+    record = await db.transaction_archives.find_one({"_id": ano})
+    if record and record["estado"] == "arquivado":
+        return record
+    if record is None:
+        record = {"_id": ano, "estado": "arquivando", "colecao": name, "iniciado_em": datetime.utcnow()}
+        try:
+            await db.transaction_archives.insert_one(record)
+        except DuplicateKeyError:
+            record = await db.transaction_archives.find_one({"_id": ano})
+    # Todos os workers precisam enxergar o ano fechado antes de os documentos saírem
+    waited = (datetime.utcnow() - record["iniciado_em"]).total_seconds()
+    if waited < grace:
+        await asyncio.sleep(grace - waited)
+
+    archive = db[name]
+    await archive.create_indexes([m for m in INDEX_SPECS["transactions"] if m.document["name"] in ARCHIVE_INDEX_NAMES])
+    moved = 0
+    while True:
+        docs = await db.transactions.find({"ano": ano}).sort("_id", 1).limit(ARCHIVE_BATCH_SIZE).to_list(ARCHIVE_BATCH_SIZE)
+        if not docs:
+            break
+        try:
+            await archive.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Já copiados numa execução interrompida antes da remoção
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+        await db.transactions.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+        moved += len(docs)
+        logger.info("Arquivamento de %d: %d transações movidas", ano, moved)
+
+    meses = await archive_monthly_rows(archive, ano)
+    update = {
+        "estado": "arquivado",
+        "arquivado_em": datetime.utcnow(),
+        "transacoes": sum(row["transacoes_count"] for row in meses),
+        "relatorio_mensal": meses,
     }
+    record = await db.transaction_archives.find_one_and_update(
+        {"_id": ano, "estado": "arquivando"}, {"$set": update}, return_document=ReturnDocument.AFTER,
+    ) or await db.transaction_archives.find_one({"_id": ano})
+    await archive_catalog.refresh(force=True)
+    return record
 
-# Fim das Rotas
+archive_tasks: Dict[int, asyncio.Task] = {}
 
-app.include_router(api_router)
+def schedule_archive(ano: int) -> bool:
+    """Inicia o arquivamento em segundo plano; False se já está rodando neste worker"""
+    task = archive_tasks.get(ano)
+    if task and not task.done():
+        return False
 
-@app.on_event("shutdown")
+    async def run():
+        try:
+            await archive_year(ano)
+        except Exception:
+            logger.exception("Arquivamento de %d falhou; pode ser retomado", ano)
+
+    archive_tasks[ano] = asyncio.create_task(run())
+    return True
+
+def archive_summary(record: dict) -> dict:
+    return {
+        "ano": record["_id"],
+        "estado": record["estado"],
+        "colecao": record["colecao"],
+        "transacoes": record.get("transacoes"),
+        "iniciado_em": record.get("iniciado_em"),
+        "arquivado_em": record.get("arquivado_em"),
+    }
+
+# Resumo de recebíveis (inadimplentes)
+# `receivables_summary` guarda um único documento com a quantidade e o valor
+# devido dos inadimplentes, quebrados pelo dia do último pagamento. As escritas
+# de clientes aplicam deltas com $inc nesse documento (atualização atômica) e o
+# dashboard lê só ele; as faixas de atraso (0-30/31-60/61-90/90+ dias) são
+# montadas na leitura, a partir da data de hoje. Uma reconciliação periódica
+# (RECEIVABLES_RECONCILE_INTERVAL segundos) corrige eventuais desvios.
+RECEIVABLES_ID = "inadimplentes"
+RECEIVABLES_FIELDS = ("quantidade", "valor")
+RECEIVABLES_NO_DATE = "sem_data"
+AGING_BUCKETS = ((30, "0-30"), (60, "31-60"), (90, "61-90"), (None, "90+"))
+RECEIVABLES_RECONCILE_INTERVAL = int(os.getenv("RECEIVABLES_RECONCILE_INTERVAL", "3600"))
+
+def payment_day_key(value) -> str:
+    """Chave do dia do último pagamento (data ISO) ou "sem_data" """
+    if isinstance(value, (datetime, date)):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, str) and value:
+        return value[:10]
+    return RECEIVABLES_NO_DATE
+
+def receivable_contribution(doc: Optional[dict]) -> Optional[tuple]:
+    """Dia do último pagamento e valor devido com que um cliente inadimplente contribui"""
+    if not doc or doc.get("status") != ClientStatus.INADIMPLENTE:
+        return None
+    return payment_day_key(doc.get("data_ultimo_pagamento")), doc.get("valor_devido") or 0
+
+async def apply_receivable_deltas(changes: List[tuple]):
+    """Para cada par (antigo, novo), retira a contribuição do antigo e soma a do novo"""
+    increments = {}
+    for old_doc, new_doc in changes:
+        for doc, sign in ((old_doc, -1), (new_doc, 1)):
+            contribution = receivable_contribution(doc)
+            if contribution is None:
+                continue
+            day, valor = contribution
+            for field, amount in (("quantidade", sign), ("valor_total_devido", sign * valor),
+                                  (f"dias.{day}.quantidade", sign), (f"dias.{day}.valor", sign * valor)):
+                increments[field] = increments.get(field, 0) + amount
+    increments = {field: amount for field, amount in increments.items() if amount}
+    if increments:
+        await db.receivables_summary.update_one({"_id": RECEIVABLES_ID}, {"$inc": increments}, upsert=True)
+
+def aging_bucket(day: str, today: date) -> str:
+    if day == RECEIVABLES_NO_DATE:
+        return RECEIVABLES_NO_DATE
+    try:
+        days_late = (today - date.fromisoformat(day)).days
+    except ValueError:
+        return RECEIVABLES_NO_DATE
+    for limit, label in AGING_BUCKETS:
+        if limit is None or days_late <= limit:
+            return label
+
+async def receivables_summary(today: Optional[date] = None) -> dict:
+    """Quantidade, valor devido e faixas de atraso dos inadimplentes (um único documento)"""
+    today = today or date.today()
+    summary = await db.receivables_summary.find_one({"_id": RECEIVABLES_ID})
+    if summary is None:
+        await reconcile_receivables(fix=True)
+        summary = await db.receivables_summary.find_one({"_id": RECEIVABLES_ID}) or {}
+
+    aging = {label: {"quantidade": 0, "valor": 0.0} for _, label in AGING_BUCKETS}
+    aging[RECEIVABLES_NO_DATE] = {"quantidade": 0, "valor": 0.0}
+    for day, totals in (summary.get("dias") or {}).items():
+        if totals.get("quantidade", 0) > 0:
+            bucket = aging[aging_bucket(day, today)]
+            bucket["quantidade"] += totals["quantidade"]
+            bucket["valor"] += totals.get("valor", 0)
+    for bucket in aging.values():
+        bucket["valor"] = round(bucket["valor"], 2)
+
+    quantidade = summary.get("quantidade", 0)
+    return {
+        "quantidade": quantidade,
+        "valor_total_devido": round(summary.get("valor_total_devido", 0), 2) if quantidade else 0,
+        "aging": aging,
+    }
+
+async def expected_receivables() -> dict:
+    """Recalcula o resumo por dia do último pagamento a partir da coleção de clientes"""
+    pipeline = [
+        {"$match": {"status": "inadimplente"}},
+        {"$group": {"_id": "$data_ultimo_pagamento", "quantidade": {"$sum": 1}, "valor": {"$sum": "$valor_devido"}}},
+    ]
+    expected = {}
+    async for item in db.clients.aggregate(pipeline):
+        totals = expected.setdefault(payment_day_key(item["_id"]), dict.fromkeys(RECEIVABLES_FIELDS, 0))
+        for field in RECEIVABLES_FIELDS:
+            totals[field] += item[field] or 0
+    return expected
+
+async def reconcile_receivables(fix: bool = False) -> dict:
+    """Compara o resumo de recebíveis com os clientes e, se fix=True, o reescreve"""
+    expected = await expected_receivables()
+    summary = await db.receivables_summary.find_one({"_id": RECEIVABLES_ID}) or {}
+    stored = {day: {field: totals.get(field, 0) for field in RECEIVABLES_FIELDS}
+              for day, totals in (summary.get("dias") or {}).items()}
+
+    empty = dict.fromkeys(RECEIVABLES_FIELDS, 0)
+    divergent = []
+    for day in set(expected) | set(stored):
+        want, have = expected.get(day, empty), stored.get(day, empty)
+        if any(round(want[f] - have[f], 2) != 0 for f in RECEIVABLES_FIELDS):
+            divergent.append((day, want, have))
+    totals_match = (
+        summary.get("quantidade", 0) == sum(t["quantidade"] for t in expected.values())
+        and round(summary.get("valor_total_devido", 0) - sum(t["valor"] for t in expected.values()), 2) == 0
+    )
+
+    fixed = fix and (bool(divergent) or not totals_match or not summary)
+    if fixed:
+        await db.receivables_summary.replace_one({"_id": RECEIVABLES_ID}, {
+            "quantidade": sum(t["quantidade"] for t in expected.values()),
+            "valor_total_devido": sum(t["valor"] for t in expected.values()),
+            "dias": expected,
+        }, upsert=True)
+
+    return {
+        "dias_esperados": len(expected),
+        "dias_armazenados": len([t for t in stored.values() if t["quantidade"]]),
+        "totais_conferem": totals_match,
+        "divergencias": [
+            {"dia": day, "esperado": want, "armazenado": have}
+            for day, want, have in sorted(divergent)
+        ],
+        "corrigido": fixed,
+    }
+
+async def initialize_receivables():
+    """Constrói o resumo de recebíveis na primeira execução"""
+    if await db.receivables_summary.find_one({"_id": RECEIVABLES_ID}, {"_id": 1}):
+        return 0
+    result = await reconcile_receivables(fix=True)
+    return len(result["divergencias"])
+
+async def reconcile_receivables_periodically():
+    """Job de reconciliação: corrige desvios do resumo a cada RECEIVABLES_RECONCILE_INTERVAL segundos"""
+    while True:
+        await asyncio.sleep(RECEIVABLES_RECONCILE_INTERVAL)
+        try:
+            result = await reconcile_receivables(fix=True)
+            if result["corrigido"]:
+                logger.warning("Resumo de recebíveis corrigido (%d dias divergentes)", len(result["divergencias"]))
+                await report_cache.invalidate_prefix("dashboard:")
+        except PyMongoError as e:
+            logger.error("Reconciliação do resumo de recebíveis falhou: %s", e)
+
+# Séries temporais
+# /reports/series lê os rollups diários numa única agregação: agrupa por dia
+# (granularidades dia e semana) ou por ano/mês (mês, trimestre e ano), com a
+# categoria quando pedida, e marca em qual janela cada linha cai (período
+# pedido e/ou o mesmo período do ano anterior). Os baldes sem movimento são
+# preenchidos com zero aqui.
+SERIES_MAX_POINTS = int(os.getenv("SERIES_MAX_POINTS", "1000"))
+SERIES_TOTAL_FIELDS = ("entradas", "saidas", "transacoes")
+
+def shift_years(day: date, years: int) -> date:
+    """Mesmo dia em outro ano (29/02 vira 28/02)"""
+    try:
+        return day.replace(year=day.year + years)
+    except ValueError:
+        return day.replace(year=day.year + years, day=28)
+
+def series_bucket_start(day: date, granularity: SeriesGranularity) -> date:
+    if granularity == SeriesGranularity.DIA:
+        return day
+    if granularity == SeriesGranularity.SEMANA:
+        return day - timedelta(days=day.weekday())
+    if granularity == SeriesGranularity.MES:
+        return day.replace(day=1)
+    if granularity == SeriesGranularity.TRIMESTRE:
+        return date(day.year, (day.month - 1) // 3 * 3 + 1, 1)
+    return date(day.year, 1, 1)
+
+def series_next_bucket(start: date, granularity: SeriesGranularity) -> date:
+    if granularity == SeriesGranularity.DIA:
+        return start + timedelta(days=1)
+    if granularity == SeriesGranularity.SEMANA:
+        return start + timedelta(days=7)
+    if granularity == SeriesGranularity.ANO:
+        return date(start.year + 1, 1, 1)
+    months = 1 if granularity == SeriesGranularity.MES else 3
+    month_index = start.month - 1 + months
+    return date(start.year + month_index // 12, month_index % 12 + 1, 1)
+
+def series_label(start: date, granularity: SeriesGranularity) -> str:
+    if granularity == SeriesGranularity.DIA:
+        return start.isoformat()
+    if granularity == SeriesGranularity.SEMANA:
+        iso_year, iso_week, _ = start.isocalendar()
+        return f"{iso_year}-W{iso_week:02d}"
+    if granularity == SeriesGranularity.MES:
+        return start.strftime("%Y-%m")
+    if granularity == SeriesGranularity.TRIMESTRE:
+        return f"{start.year}-T{(start.month - 1) // 3 + 1}"
+    return str(start.year)
+
+def series_buckets(inicio: date, fim: date, granularity: SeriesGranularity) -> List[date]:
+    buckets = []
+    start = series_bucket_start(inicio, granularity)
+    while start <= fim:
+        buckets.append(start)
+        if len(buckets) > SERIES_MAX_POINTS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"A série teria mais de {SERIES_MAX_POINTS} pontos; use uma granularidade maior",
+            )
+        start = series_next_bucket(start, granularity)
+    return buckets
+
+def series_totals(entradas: float = 0.0, saidas: float = 0.0, transacoes: int = 0) -> dict:
+    return {"entradas": entradas, "saidas": saidas, "transacoes": transacoes}
+
+def round_series_totals(totals: dict) -> dict:
+    return {
+        "entradas": round(totals["entradas"], 2),
+        "saidas": round(totals["saidas"], 2),
+        "faturamento_liquido": round(totals["entradas"] - totals["saidas"], 2),
+        "transacoes": totals["transacoes"],
+    }
+
+def percent_change(current: float, previous: float) -> Optional[float]:
+    return round((current - previous) / abs(previous) * 100, 1) if previous else None
+
+async def compute_series(inicio: date, fim: date, granularity: SeriesGranularity,
+                         grouping: Optional[SeriesGrouping], compare: bool) -> dict:
+    buckets = series_buckets(inicio, fim, granularity)
+    previous_start, previous_end = shift_years(inicio, -1), shift_years(fim, -1)
+    as_datetime = lambda day: datetime.combine(day, datetime.min.time())
+
+    by_day = granularity in (SeriesGranularity.DIA, SeriesGranularity.SEMANA)
+    group_id = {"dia": "$dia"} if by_day else {"ano": "$ano", "mes": "$mes"}
+    if grouping == SeriesGrouping.CATEGORIA:
+        group_id["categoria"] = "$categoria"
+    group_id["atual"] = {"$gte": ["$dia", as_datetime(inicio)]}
+    if compare:
+        group_id["anterior"] = {"$lte": ["$dia", as_datetime(previous_end)]}
+    pipeline = [
+        {"$match": {"dia": {"$gte": as_datetime(previous_start if compare else inicio), "$lte": as_datetime(fim)}}},
+        {"$group": {
+            "_id": group_id,
+            "entradas": {"$sum": "$entradas"},
+            "saidas": {"$sum": "$saidas"},
+            "transacoes": {"$sum": "$count"},
+        }},
+    ]
+
+    current = {start: series_totals() for start in buckets}
+    previous = {start: series_totals() for start in buckets}
+    groups = {start: {} for start in buckets}
+    async for row in db.transaction_rollups.aggregate(pipeline):
+        key = row["_id"]
+        day = key["dia"].date() if by_day else date(key["ano"], key["mes"], 1)
+        windows = []
+        if key["atual"]:
+            windows.append((current, day))
+        if compare and key.get("anterior"):
+            windows.append((previous, shift_years(day, 1)))
+        for target, target_day in windows:
+            bucket = series_bucket_start(target_day, granularity)
+            if bucket not in target:
+                continue
+            for field in SERIES_TOTAL_FIELDS:
+                target[bucket][field] += row[field]
+            if target is current and grouping == SeriesGrouping.CATEGORIA:
+                group = groups[bucket].setdefault(key.get("categoria") or "sem_categoria", series_totals())
+                for field in SERIES_TOTAL_FIELDS:
+                    group[field] += row[field]
+
+    points = []
+    for index, start in enumerate(buckets):
+        end = series_next_bucket(start, granularity) - timedelta(days=1)
+        point = {
+            "periodo": series_label(start, granularity),
+            "inicio": max(start, inicio).isoformat(),
+            "fim": min(end, fim).isoformat(),
+            **round_series_totals(current[start]),
+        }
+        if grouping == SeriesGrouping.CATEGORIA:
+            point["grupos"] = {name: round_series_totals(totals) for name, totals in sorted(groups[start].items())}
+        elif grouping == SeriesGrouping.TIPO:
+            point["grupos"] = {
+                TransactionType.ENTRADA.value: {"total": point["entradas"]},
+                TransactionType.SAIDA.value: {"total": point["saidas"]},
+            }
+        if compare:
+            point["ano_anterior"] = {
+                **round_series_totals(previous[start]),
+                "variacao_faturamento": percent_change(point["faturamento_liquido"],
+                                                       previous[start]["entradas"] - previous[start]["saidas"]),
+            }
+        points.append(point)
+
+    result = {
+        "inicio": inicio.isoformat(),
+        "fim": fim.isoformat(),
+        "granularidade": granularity.value,
+        "agrupamento": grouping.value if grouping else None,
+        "pontos": points,
+        "totais": round_series_totals({
+            field: sum(totals[field] for totals in current.values()) for field in SERIES_TOTAL_FIELDS
+        }),
+    }
+    if compare:
+        result["periodo_anterior"] = {"inicio": previous_start.isoformat(), "fim": previous_end.isoformat()}
+        result["totais_ano_anterior"] = round_series_totals({
+            field: sum(totals[field] for totals in previous.values()) for field in SERIES_TOTAL_FIELDS
+        })
+    return result
+
+# Cache de relatórios
+# Respostas de /reports/dashboard e /reports/monthly ficam em cache por período
+# ("dashboard:AAAA-MM" e "monthly:AAAA"). As escritas invalidam apenas os
+# períodos que tocam; o TTL é a garantia final contra invalidações perdidas.
+# A invalidação só alcança o cache do processo que fez a escrita: com vários
+# workers (WEB_CONCURRENCY > 1, lido pelo gunicorn e pelo uvicorn) o padrão é
+# o backend "mongo", compartilhado, para nenhum worker servir um relatório
+# velho até o TTL vencer. REPORT_CACHE_BACKEND=memory continua valendo para
+# quem aceita essa defasagem em troca de não ir ao banco.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+class LRUCacheBackend:
+    """Cache em memória do processo, limitado em número de entradas"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    async def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value, ttl: float):
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def delete(self, keys: List[str]):
+        for key in keys:
+            self._entries.pop(key, None)
+
+    async def delete_prefix(self, prefix: str):
+        for key in [k for k in self._entries if k.startswith(prefix)]:
+            del self._entries[key]
+
+    async def clear(self):
+        self._entries.clear()
+
+    def size(self) -> int:
+        return len(self._entries)
+
+class MongoCacheBackend:
+    """Cache compartilhado entre workers, guardado na coleção `report_cache`"""
+
+    def __init__(self, collection_name: str = "report_cache"):
+        self.collection_name = collection_name
+
+    @property
+    def collection(self):
+        return db[self.collection_name]
+
+    async def get(self, key: str):
+        entry = await self.collection.find_one({"_id": key, "expira_em": {"$gt": datetime.utcnow()}})
+        return entry["valor"] if entry else None
+
+    async def set(self, key: str, value, ttl: float):
+        expires_at = datetime.utcnow() + timedelta(seconds=ttl)
+        await self.collection.replace_one({"_id": key}, {"valor": value, "expira_em": expires_at}, upsert=True)
+
+    async def delete(self, keys: List[str]):
+        await self.collection.delete_many({"_id": {"$in": keys}})
+
+    async def delete_prefix(self, prefix: str):
+        await self.collection.delete_many({"_id": {"$regex": f"^{re.escape(prefix)}"}})
+
+    async def clear(self):
+        await self.collection.delete_many({})
+
+    def size(self) -> Optional[int]:
+        return None
+
+class ReportCache:
+    """Cache de relatórios com contadores de acerto/erro e invalidação por chave"""
+
+    def __init__(self, backend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Geração por chave: um cálculo iniciado antes de uma invalidação não
+        # grava seu resultado (possivelmente desatualizado) depois dela.
+        self._generations = {}
+        self._global_generation = 0
+
+    def _generation(self, key: str) -> tuple:
+        return self._global_generation, self._generations.get(key, 0)
+
+    async def get_or_compute(self, key: str, compute):
+        try:
+            value = await self.backend.get(key)
+        except PyMongoError as e:
+            logger.warning("Cache de relatórios indisponível: %s", e)
+            return await compute()
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        generation = self._generation(key)
+        value = await compute()
+        if self._generation(key) == generation:
+            try:
+                await self.backend.set(key, value, self.ttl)
+            except PyMongoError as e:
+                logger.warning("Falha ao gravar no cache de relatórios: %s", e)
+        return value
+
+    async def invalidate(self, keys):
+        keys = list(keys)
+        if not keys:
+            return
+        for key in keys:
+            self._generations[key] = self._generations.get(key, 0) + 1
+        self.invalidations += len(keys)
+        await self.backend.delete(keys)
+
+    async def invalidate_prefix(self, prefix: str):
+        self._global_generation += 1
+        self.invalidations += 1
+        await self.backend.delete_prefix(prefix)
+
+    async def clear(self):
+        self._global_generation += 1
+        self._generations.clear()
+        await self.backend.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "ttl_segundos": self.ttl,
+            "entradas": self.backend.size(),
+            "acertos": self.hits,
+            "erros": self.misses,
+            "taxa_acerto": round(self.hits / total, 4) if total else None,
+            "invalidacoes": self.invalidations,
+        }
+
+def monthly_cache_key(ano: int) -> str:
+    return f"monthly:{ano}"
+
+def dashboard_cache_key(ano: int, mes: int) -> str:
+    return f"dashboard:{ano}-{mes:02d}"
+
+def transaction_report_keys(*docs: Optional[dict]) -> set:
+    """Chaves de relatório afetadas pelas transações armazenadas informadas"""
+    keys = set()
+    for doc in docs:
+        if doc and isinstance(doc.get("data"), datetime):
+            keys.add(monthly_cache_key(doc["data"].year))
+            keys.add(dashboard_cache_key(doc["data"].year, doc["data"].month))
+    return keys
+
+def client_affects_dashboard(*docs: Optional[dict]) -> bool:
+    """Indica se a escrita de clientes altera o bloco de inadimplentes do dashboard"""
+    return any(doc and doc.get("status") == ClientStatus.INADIMPLENTE for doc in docs)
+
+def build_report_cache() -> ReportCache:
+    backend_name = os.getenv("REPORT_CACHE_BACKEND", "mongo" if WEB_CONCURRENCY > 1 else "memory")
+    ttl = float(os.getenv("REPORT_CACHE_TTL", "300"))
+    if backend_name == "mongo":
+        backend = MongoCacheBackend()
+    elif backend_name == "memory":
+        backend = LRUCacheBackend(int(os.getenv("REPORT_CACHE_MAX_ENTRIES", "256")))
+    else:
+        raise ValueError(f"REPORT_CACHE_BACKEND inválido: {backend_name}")
+    return ReportCache(backend, ttl)
+
+report_cache = build_report_cache()
+
+# Cache de documentos por id
+# GET /transactions/{id}, /clients/{id} e as listas com ?ids=a,b,c leem por
+# este cache read-through (LRU em memória do processo); os ids que faltam são
+# buscados numa única consulta com $in. As escritas invalidam os ids que
+# tocam; como cada worker tem o seu cache, DOCUMENT_CACHE_TTL limita por
+# quanto tempo um worker pode servir um documento alterado por outro.
+DOCUMENT_CACHE_MAX_ENTRIES = int(os.getenv("DOCUMENT_CACHE_MAX_ENTRIES", "10000"))
+DOCUMENT_CACHE_TTL = float(os.getenv("DOCUMENT_CACHE_TTL", "30"))
+DOCUMENT_BATCH_MAX_IDS = int(os.getenv("DOCUMENT_BATCH_MAX_IDS", "1000"))
+
+class DocumentCache:
+    """Cache read-through de documentos de uma coleção, por id"""
+
+    def __init__(self, collection_name: str, model, max_entries: int = DOCUMENT_CACHE_MAX_ENTRIES,
+                 ttl: float = DOCUMENT_CACHE_TTL, fallback=None):
+        self.collection_name = collection_name
+        self.model = model
+        # Busca dos ids ausentes da coleção principal (ex.: partições arquivadas)
+        self.fallback = fallback
+        self.backend = LRUCacheBackend(max_entries)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Uma leitura iniciada antes de uma invalidação não grava o que leu
+        self._generation = 0
+
+    async def get_many(self, ids: List[str]) -> Dict[str, dict]:
+        """Documentos encontrados, por id (cópias: quem chama pode alterá-las)"""
+        found, missing = {}, []
+        for doc_id in dict.fromkeys(ids):
+            doc = await self.backend.get(doc_id)
+            if doc is None:
+                missing.append(doc_id)
+            else:
+                found[doc_id] = doc
+        self.hits += len(found)
+        self.misses += len(missing)
+        if missing:
+            generation = self._generation
+            docs = await db[self.collection_name].find(
+                {"id": {"$in": missing}}, fast_projection(self.model)
+            ).to_list(len(missing))
+            if self.fallback and len(docs) < len(missing):
+                fetched = {doc["id"] for doc in docs}
+                docs += await self.fallback([doc_id for doc_id in missing if doc_id not in fetched],
+                                            fast_projection(self.model))
+            for doc in docs:
+                found[doc["id"]] = doc
+                if self._generation == generation:
+                    await self.backend.set(doc["id"], doc, self.ttl)
+        return {doc_id: dict(found[doc_id]) for doc_id in dict.fromkeys(ids) if doc_id in found}
+
+    async def get(self, doc_id: str) -> Optional[dict]:
+        return (await self.get_many([doc_id])).get(doc_id)
+
+    async def invalidate(self, ids):
+        ids = [doc_id for doc_id in ids if doc_id]
+        if not ids:
+            return
+        self._generation += 1
+        self.invalidations += len(ids)
+        await self.backend.delete(ids)
+
+    async def clear(self):
+        self._generation += 1
+        await self.backend.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entradas": self.backend.size(),
+            "capacidade": self.backend.max_entries,
+            "ttl_segundos": self.ttl,
+            "acertos": self.hits,
+            "erros": self.misses,
+            "taxa_acerto": round(self.hits / total, 4) if total else None,
+            "invalidacoes": self.invalidations,
+        }
+
+transaction_cache = DocumentCache("transactions", Transaction, fallback=find_archived_transactions)
+client_cache = DocumentCache("clients", Client)
+
+def parse_ids(ids: str) -> List[str]:
+    """Lista de ids de `?ids=a,b,c` (sem repetições, na ordem pedida)"""
+    parsed = list(dict.fromkeys(doc_id.strip() for doc_id in ids.split(",") if doc_id.strip()))
+    if len(parsed) > DOCUMENT_BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"Máximo de {DOCUMENT_BATCH_MAX_IDS} ids por consulta")
+    return parsed
+
+def changed_ids(changes: List[tuple]) -> set:
+    return {doc["id"] for change in changes for doc in change if doc and doc.get("id")}
+
+# Busca por nome
+# Nomes são gravados também numa forma normalizada (minúsculas, sem acentos),
+# inteira e quebrada em palavras. Buscas viram regex ancoradas no início
+# (^...), que usam o índice, e "Joao" encontra "João".
+def normalize_search(text: Optional[str]) -> str:
+    if not text:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", text)
+    folded = "".join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+    return " ".join(re.sub(r"[^\w\s]", " ", folded).split())
+
+def search_fields(prefix: str, text: Optional[str]) -> dict:
+    """Campos de busca derivados de um nome: <prefix>_busca e <prefix>_tokens"""
+    normalized = normalize_search(text)
+    return {
+        f"{prefix}_busca": normalized or None,
+        f"{prefix}_tokens": sorted(set(normalized.split())),
+    }
+
+def search_filter(prefix: str, q: str, mode: SearchMode) -> dict:
+    """Filtro indexável para o termo q sobre os campos de busca de `prefix`"""
+    normalized = normalize_search(q)
+    if not normalized:
+        return {}
+    if mode == SearchMode.PREFIXO:
+        return {f"{prefix}_busca": {"$regex": f"^{re.escape(normalized)}"}}
+    # Cada palavra do termo precisa ser início de alguma palavra do nome
+    return {"$and": [{f"{prefix}_tokens": {"$regex": f"^{re.escape(token)}"}} for token in normalized.split()]}
+
+# Paginação por cursor (keyset)
+# O cursor é opaco para o cliente: codifica o valor da chave de ordenação e o
+# `id` do último item da página. A próxima página começa logo após esse par,
+# então o custo é o mesmo em qualquer profundidade e inserções concorrentes
+# não deslocam as páginas.
+def encode_cursor(value, doc_id: str) -> str:
+    if isinstance(value, datetime):
+        value = {"d": value.isoformat()}
+    raw = json.dumps([value, doc_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, doc_id = json.loads(raw)
+        if isinstance(value, dict):
+            value = datetime.fromisoformat(value["d"])
+        return value, doc_id
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+def keyset_filter(field: str, direction: int, value, doc_id: str) -> dict:
+    """Filtro dos documentos posteriores a (value, doc_id) na ordenação (field, id)"""
+    # No MongoDB, null vem antes de qualquer valor: fica no fim da ordem
+    # decrescente e no começo da crescente.
+    op = "$lt" if direction == DESCENDING else "$gt"
+    if value is None:
+        if direction == DESCENDING:
+            return {field: None, "id": {op: doc_id}}
+        return {"$or": [{field: None, "id": {op: doc_id}}, {field: {"$ne": None}}]}
+    conditions = [{field: {op: value}}, {field: value, "id": {op: doc_id}}]
+    if direction == DESCENDING:
+        conditions.append({field: None})
+    return {"$or": conditions}
+
+async def keyset_page(collection, query: dict, field: str, direction: int,
+                      cursor: Optional[str], skip: int, limit: int, projection: Optional[dict] = None) -> tuple:
+    """Busca uma página ordenada por (field, id) e devolve (documentos, próximo cursor)"""
+    if cursor:
+        after = keyset_filter(field, direction, *decode_cursor(cursor))
+        query = {"$and": [query, after]} if query else after
+    docs = await collection.find(query, projection).sort([(field, direction), ("id", direction)]).skip(skip).limit(limit).to_list(limit)
+    next_cursor = None
+    if limit and len(docs) == limit:
+        next_cursor = encode_cursor(docs[-1].get(field), docs[-1]["id"])
+    return docs, next_cursor
+
+def keyset_sort_key(field: str):
+    # Mesma ordem do Mongo: nulos antes de qualquer valor
+    def key(doc):
+        value = doc.get(field)
+        return (True, value, doc["id"]) if value is not None else (False, 0, doc["id"])
+    return key
+
+def merge_query(query: dict, extra: dict) -> dict:
+    if not extra:
+        return query
+    return {"$and": [query, extra]} if query else extra
+
+def unique_ids(docs):
+    """Descarta o documento repetido (mesmo id em seguida) de uma intercalação ordenada"""
+    last_id = object()
+    for doc in docs:
+        if doc["id"] != last_id:
+            yield doc
+        last_id = doc["id"]
+
+async def partitioned_keyset_page(segments: list, query: dict, field: str, direction: int,
+                                  cursor: Optional[str], skip: int, limit: int,
+                                  projection: Optional[dict] = None) -> tuple:
+    """keyset_page sobre os segmentos de ArchiveCatalog.segments, lidos em ordem até completar a página"""
+    ordered = segments if direction == DESCENDING else segments[::-1]
+    wanted = skip + limit if limit else 0
+    docs = []
+    for segment in ordered:
+        remaining = wanted - len(docs) if wanted else 0
+        pages = await asyncio.gather(*(
+            keyset_page(collection, merge_query(query, extra), field, direction, cursor, 0, remaining, projection)
+            for collection, extra in segment
+        ))
+        if len(pages) == 1:
+            docs.extend(pages[0][0])
+        else:
+            merged = heapq.merge(*(page for page, _ in pages), key=keyset_sort_key(field), reverse=direction == DESCENDING)
+            docs.extend(islice(unique_ids(merged), remaining or None))
+        if wanted and len(docs) >= wanted:
+            break
+    docs = docs[skip:wanted or None]
+    next_cursor = None
+    if limit and len(docs) == limit:
+        next_cursor = encode_cursor(docs[-1].get(field), docs[-1]["id"])
+    return docs, next_cursor
+
+# Serialização rápida
+# As listagens e exportações JSON podem codificar os documentos do Mongo
+# diretamente, sem construir um modelo Pydantic por documento nem revalidá-lo
+# contra o response_model, e usar o orjson quando instalado. O resultado é
+# byte a byte igual ao caminho com modelos (ver tests/test_fast_serialization.py);
+# FAST_SERIALIZATION=0 volta ao caminho com modelos.
+FAST_SERIALIZATION = os.getenv("FAST_SERIALIZATION", "1") == "1"
+# Mesmas opções usadas pelo JSONResponse do FastAPI
+FAST_JSON_OPTIONS = {"ensure_ascii": False, "allow_nan": False, "indent": None, "separators": (",", ":")}
+
+def _encode_float(value):
+    return float(value)
+
+def _encode_int(value):
+    return int(value)
+
+def _encode_date(value):
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return date.fromisoformat(value[:10]).isoformat()
+
+def _json_default(value):
+    # datetime: o orjson já escreve no mesmo formato que isoformat()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Tipo não serializável: {type(value).__name__}")
+
+_fast_fields_cache = {}
+
+def fast_fields(model) -> tuple:
+    """Campos do modelo em ordem com seus defaults, e os que precisam de conversão.
+
+    Enums e datetimes vindos do Mongo já saem no formato final; floats e
+    inteiros só são convertidos quando o tipo armazenado difere; datas
+    aceitam data BSON ou texto ISO.
+    """
+    fields = _fast_fields_cache.get(model)
+    if fields is None:
+        defaults, converters = [], []
+        for name, field in model.model_fields.items():
+            args = [arg for arg in get_args(field.annotation) if arg is not type(None)]
+            kind = args[0] if args else field.annotation
+            default = None if field.default_factory else field.get_default()
+            if isinstance(default, Enum):
+                default = default.value
+            defaults.append((name, default))
+            if kind is float:
+                converters.append((name, float, _encode_float))
+            elif kind is int:
+                converters.append((name, int, _encode_int))
+            elif kind is date:
+                converters.append((name, None, _encode_date))
+        fields = _fast_fields_cache[model] = (defaults, converters)
+    return fields
+
+def fast_projection(model) -> dict:
+    """Projeção com apenas os campos que o modelo de resposta usa"""
+    return {"_id": 0, **{name: 1 for name in model.model_fields}}
+
+def encode_document(model, doc: dict) -> dict:
+    """Equivalente a model(**doc) serializado em modo JSON, sem validação"""
+    defaults, converters = fast_fields(model)
+    encoded = {name: doc.get(name, default) for name, default in defaults}
+    for name, expected_type, converter in converters:
+        value = encoded[name]
+        if value is None or type(value) is expected_type:
+            continue
+        if expected_type is None and type(value) is str and len(value) == 10:
+            continue
+        encoded[name] = converter(value)
+    return encoded
+
+def _floats_portable(model, encoded_docs: List[dict]) -> bool:
+    """Indica se o orjson escreve os floats exatamente como o módulo json.
+
+    O json usa "1e+16"/"1e-05" e o orjson "1e16"/"1e-5"; fora dessa faixa
+    (nunca atingida por valores monetários) usamos o módulo json.
+    """
+    names = [name for name, expected_type, _ in fast_fields(model)[1] if expected_type is float]
+    return all(
+        not value or 1e-4 <= abs(value) < 1e16
+        for doc in encoded_docs for value in (doc[name] for name in names)
+    )
+
+def encode_documents_json(model, docs: List[dict]) -> bytes:
+    """Lista JSON compacta em UTF-8 dos documentos (orjson quando disponível)"""
+    encoded = [encode_document(model, doc) for doc in docs]
+    if orjson is not None and _floats_portable(model, encoded):
+        return orjson.dumps(encoded)
+    return json.dumps(encoded, default=_json_default, **FAST_JSON_OPTIONS).encode("utf-8")
+
+def fast_json_response(model, docs: List[dict], headers: Optional[dict] = None) -> Response:
+    return Response(content=encode_documents_json(model, docs), media_type="application/json", headers=headers)
+
+# Exportação em streaming
+# As exportações percorrem o cursor do Motor em lotes de EXPORT_BATCH_SIZE e
+# enviam cada lote assim que é lido: a memória usada não depende do tamanho
+# da coleção e o primeiro byte sai logo após o primeiro lote.
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+
+EXPORT_MEDIA_TYPES = {
+    ExportFormat.JSON: "application/json",
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.CSV: "text/csv; charset=utf-8",
+}
+
+def csv_delimiter() -> str:
+    """Separador de campos compatível com o separador decimal do locale (pt_BR usa ';')"""
+    return ";" if locale.localeconv()["decimal_point"] == "," else ","
+
+def csv_value(value) -> str:
+    """Formata um valor para CSV segundo as convenções do locale configurado"""
+    if value is None:
+        return ""
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, bool):
+        return "Sim" if value else "Não"
+    if isinstance(value, float):
+        return locale.format_string("%.2f", value)
+    if isinstance(value, datetime):
+        return value.strftime("%x %X")
+    if isinstance(value, date):
+        return value.strftime("%x")
+    return str(value)
+
+async def stream_export(cursor, model, prepare, export_format: ExportFormat):
+    """Gera o corpo da exportação lote a lote a partir de um cursor"""
+    cursor.batch_size(EXPORT_BATCH_SIZE)
+    fields = list(model.model_fields)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=csv_delimiter(), lineterminator="\r\n")
+    pending = 0
+    first = True
+
+    if export_format == ExportFormat.JSON:
+        buffer.write("[")
+    elif export_format == ExportFormat.CSV:
+        writer.writerow(fields)
+
+    async for doc in cursor:
+        if export_format == ExportFormat.CSV:
+            obj = model(**prepare(doc))
+            writer.writerow([csv_value(getattr(obj, field)) for field in fields])
+            row = None
+        elif FAST_SERIALIZATION:
+            row = encode_documents_json(model, [doc])[1:-1].decode("utf-8")
+        else:
+            row = json.dumps(model(**prepare(doc)).model_dump(mode="json"), **FAST_JSON_OPTIONS)
+        if export_format == ExportFormat.NDJSON:
+            buffer.write(row)
+            buffer.write("\n")
+        elif export_format == ExportFormat.JSON:
+            if not first:
+                buffer.write(",")
+            buffer.write(row)
+        first = False
+        pending += 1
+        if pending >= EXPORT_BATCH_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    if export_format == ExportFormat.JSON:
+        buffer.write("]")
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def export_response(cursor, model, prepare, export_format: ExportFormat, filename: str) -> StreamingResponse:
+    headers = {}
+    if export_format != ExportFormat.JSON:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}.{export_format.value}"'
+    return StreamingResponse(
+        stream_export(cursor, model, prepare, export_format),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers=headers,
+    )
+
+# Exportações em segundo plano
+# Exportações grandes viram jobs: a requisição só enfileira (POST
+# /export/jobs) e um pool limitado de EXPORT_JOB_WORKERS tarefas grava o
+# arquivo em disco, lote a lote, numa thread (CSV/JSON/NDJSON reaproveitam
+# stream_export; XLSX usa o modo write-only do openpyxl). O download aceita
+# Range para ser retomado, e os arquivos são apagados EXPORT_JOB_TTL segundos
+# depois de prontos.
+# O estado dos jobs fica na coleção `export_jobs` (com TTL), para que
+# qualquer worker responda à consulta e ao download; o arquivo fica em
+# EXPORT_JOBS_DIR, que precisa ser compartilhado entre os workers (mesma
+# máquina ou volume comum). Cada processo só mexe nos arquivos dos seus jobs
+# ou nos que passaram da validade, julgada pela idade do arquivo.
+EXPORT_JOBS_DIR = os.getenv("EXPORT_JOBS_DIR", os.path.join(tempfile.gettempdir(), "painel_exports"))
+EXPORT_JOB_WORKERS = int(os.getenv("EXPORT_JOB_WORKERS", "2"))
+EXPORT_JOB_QUEUE_SIZE = int(os.getenv("EXPORT_JOB_QUEUE_SIZE", "20"))
+EXPORT_JOB_TTL = int(os.getenv("EXPORT_JOB_TTL", "3600"))
+# Um job pendente ou em execução sem progresso por esse tempo foi abandonado
+# (worker encerrado no meio); seu registro e o arquivo parcial são removidos
+EXPORT_JOB_STALE_SECONDS = int(os.getenv("EXPORT_JOB_STALE_SECONDS", "3600"))
+EXPORT_JOB_PROGRESS_INTERVAL = 1.0
+EXPORT_JOB_FILE_PATTERN = re.compile(r"[0-9a-f-]{36}\.(csv|xlsx|json|ndjson)(\.part)?")
+EXPORT_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Limite de linhas de uma planilha do Excel, descontado o cabeçalho
+XLSX_MAX_ROWS = 1_048_575
+
+EXPORT_JOB_MEDIA_TYPES = {
+    **{ExportJobFormat(f.value): media_type for f, media_type in EXPORT_MEDIA_TYPES.items()},
+    ExportJobFormat.XLSX: "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+def xlsx_value(value):
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str, ensure_ascii=False)
+    return value
+
+class XlsxWriter:
+    """Planilha write-only do openpyxl; passa para uma nova aba ao atingir o limite de linhas"""
+
+    def __init__(self, path: str):
+        from openpyxl import Workbook
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+        self.sheet = None
+
+    def add_sheet(self, title: str, header: List[str]):
+        self.title = title
+        self.header = header
+        self.sheet_number = 1
+        self._new_sheet()
+
+    def _new_sheet(self):
+        suffix = f" ({self.sheet_number})" if self.sheet_number > 1 else ""
+        self.sheet = self.workbook.create_sheet(title=(self.title[:31 - len(suffix)] + suffix))
+        self.sheet.append(self.header)
+        self.rows_in_sheet = 0
+
+    def append_rows(self, rows: List[list]):
+        for row in rows:
+            if self.rows_in_sheet >= XLSX_MAX_ROWS:
+                self.sheet_number += 1
+                self._new_sheet()
+            self.sheet.append([xlsx_value(value) for value in row])
+            self.rows_in_sheet += 1
+
+    def save(self):
+        self.workbook.save(self.path)
+
+class CountingCursor:
+    """Envolve um cursor do Motor contando os documentos lidos (progresso do job)"""
+
+    def __init__(self, cursor, on_batch, batch_size: int = EXPORT_BATCH_SIZE):
+        self.cursor = cursor
+        self.on_batch = on_batch
+        self.batch_size_value = batch_size
+        self.count = 0
+
+    def batch_size(self, size: int):
+        self.batch_size_value = size
+        self.cursor.batch_size(size)
+        return self
+
+    async def __aiter__(self):
+        async for doc in self.cursor:
+            self.count += 1
+            if self.count % self.batch_size_value == 0:
+                await self.on_batch(self.count)
+            yield doc
+        await self.on_batch(self.count)
+
+class PartitionedCursor:
+    """Percorre os segmentos de ArchiveCatalog.segments em ordem, na mesma ordenação de cada um"""
+
+    def __init__(self, segments: list, query: dict, projection: dict, field: str, direction: int):
+        sort = [(field, direction), ("id", direction)]
+        ordered = segments if direction == DESCENDING else segments[::-1]
+        self.segments = [
+            [collection.find(merge_query(query, extra), projection).sort(sort) for collection, extra in segment]
+            for segment in ordered
+        ]
+        self.key = keyset_sort_key(field)
+        self.reverse = direction == DESCENDING
+
+    def batch_size(self, size: int):
+        for cursors in self.segments:
+            for cursor in cursors:
+                cursor.batch_size(size)
+        return self
+
+    async def __aiter__(self):
+        for cursors in self.segments:
+            if len(cursors) == 1:
+                async for doc in cursors[0]:
+                    yield doc
+                continue
+            # Ano em arquivamento: intercala as coleções e pula o documento já copiado
+            heads = [await anext(cursor, None) for cursor in cursors]
+            last_id = object()
+            while any(head is not None for head in heads):
+                pending = [i for i, head in enumerate(heads) if head is not None]
+                i = (max if self.reverse else min)(pending, key=lambda i: self.key(heads[i]))
+                doc, heads[i] = heads[i], await anext(cursors[i], None)
+                if doc["id"] != last_id:
+                    yield doc
+                last_id = doc["id"]
+
+async def export_source(resource: ExportResource) -> tuple:
+    """(coleções, cursor, modelo, preparo, nome da aba) de uma exportação de linhas"""
+    if resource == ExportResource.TRANSACOES:
+        await archive_catalog.refresh()
+        collections = archive_catalog.partitions()
+        cursor = PartitionedCursor(archive_catalog.segments(), {}, fast_projection(Transaction), "data", DESCENDING)
+        return collections, cursor, Transaction, transaction_from_db, "Transações"
+    cursor = db.clients.find({}, fast_projection(Client)).sort("nome", 1)
+    return [db.clients], cursor, Client, lambda c: c, "Clientes"
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[tuple]:
+    """Intervalo (início, fim inclusivo) de um header `Range: bytes=...`; None = arquivo inteiro"""
+    if not range_header:
+        return None
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None  # múltiplos intervalos não são suportados: envia o arquivo inteiro
+    start_text, _, end_text = spec.strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = min(int(end_text), size - 1) if end_text else size - 1
+        else:
+            start, end = max(size - int(end_text), 0), size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, detail="Intervalo não satisfatório",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+async def read_file_range(path: str, start: int, end: int):
+    with open(path, "rb") as handle:
+        handle.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await asyncio.to_thread(handle.read, min(EXPORT_DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+class ExportJobCancelled(Exception):
+    """O registro do job sumiu (cancelado em outro worker ou expirado)"""
+
+class ExportJobManager:
+    """Fila limitada de jobs de exportação, pool de workers e coleta dos arquivos expirados"""
+
+    def __init__(self, directory: str = EXPORT_JOBS_DIR, workers: int = EXPORT_JOB_WORKERS,
+                 queue_size: int = EXPORT_JOB_QUEUE_SIZE, ttl: int = EXPORT_JOB_TTL,
+                 stale_seconds: int = EXPORT_JOB_STALE_SECONDS, collection_name: str = "export_jobs"):
+        self.directory = directory
+        self.workers = workers
+        self.queue_size = queue_size
+        self.ttl = ttl
+        self.stale_seconds = stale_seconds
+        self.collection_name = collection_name
+        # Identifica os jobs deste processo no registro compartilhado
+        self.owner = f"{os.uname().nodename}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # Jobs pendentes ou em execução neste processo
+        self.jobs: Dict[str, ExportJob] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+
+    @property
+    def collection(self):
+        return db[self.collection_name]
+
+    def start(self):
+        if self._tasks:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._collect_loop()))
+
+    async def stop(self):
+        # Jobs que não vão terminar neste processo: quem consultar vê a falha
+        unfinished = list(self.jobs.values())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        for job in unfinished:
+            job.status = ExportJobStatus.FALHOU
+            job.erro = "Servidor reiniciado antes do fim da exportação"
+            try:
+                await self._finish(job)
+            except (ExportJobCancelled, PyMongoError):
+                pass
+            self._remove_files(job)
+        self.jobs.clear()
+
+    def path(self, job: ExportJob) -> str:
+        return os.path.join(self.directory, f"{job.id}.{job.formato.value}")
+
+    def _document(self, job: ExportJob) -> dict:
+        # Concluído: sai junto com o arquivo; em andamento: sai se parar de progredir
+        remove_at = job.expira_em or datetime.utcnow() + timedelta(seconds=self.stale_seconds)
+        return {**job.dict(), "_id": job.id, "worker": self.owner, "remover_em": remove_at}
+
+    async def _save(self, job: ExportJob):
+        result = await self.collection.replace_one({"_id": job.id}, self._document(job))
+        if result.matched_count == 0:
+            raise ExportJobCancelled(job.id)
+
+    async def submit(self, request: ExportJobCreate) -> ExportJob:
+        if request.recurso == ExportResource.DASHBOARD and request.formato not in (ExportJobFormat.JSON, ExportJobFormat.XLSX):
+            raise HTTPException(status_code=400, detail="O dashboard é exportado apenas em JSON ou XLSX")
+        if self._queue is None:
+            raise HTTPException(status_code=503, detail="Exportações indisponíveis: workers não iniciados")
+        job = ExportJob(**request.dict())
+        if self._queue.full():
+            raise self._queue_full()
+        await self.collection.insert_one(self._document(job))
+        self.jobs[job.id] = job
+        try:
+            # Outra requisição pode ter ocupado a última vaga durante o insert
+            self._queue.put_nowait(job.id)
+        except asyncio.QueueFull:
+            self.jobs.pop(job.id, None)
+            await self.collection.delete_one({"_id": job.id})
+            raise self._queue_full()
+        return job
+
+    @staticmethod
+    def _queue_full() -> HTTPException:
+        return HTTPException(status_code=429, detail="Fila de exportações cheia, tente novamente em instantes",
+                             headers={"Retry-After": "30"})
+
+    async def get(self, job_id: str) -> ExportJob:
+        doc = await self.collection.find_one({"_id": job_id})
+        if doc is None or doc.get("expira_em") and doc["expira_em"] <= datetime.utcnow():
+            raise HTTPException(status_code=404, detail="Job de exportação não encontrado")
+        return ExportJob(**doc)
+
+    async def list_jobs(self) -> List[ExportJob]:
+        now = datetime.utcnow()
+        query = {"$or": [{"expira_em": None}, {"expira_em": {"$gt": now}}]}
+        return [ExportJob(**doc) async for doc in self.collection.find(query).sort("criado_em", DESCENDING)]
+
+    async def cancel(self, job_id: str):
+        job = await self.get(job_id)
+        # Sem o registro, o worker dono do job para no próximo lote
+        await self.collection.delete_one({"_id": job_id})
+        task = self._running.get(job_id)
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        self.jobs.pop(job_id, None)
+        if job.status != ExportJobStatus.EXECUTANDO or task:
+            self._remove_files(job)
+
+    def _remove_files(self, job: ExportJob):
+        for path in (self.path(job), self.path(job) + ".part"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self.jobs.get(job_id)
+            if job is None:  # cancelado enquanto estava na fila
+                continue
+            task = asyncio.create_task(self._run(job))
+            self._running[job_id] = task
+            try:
+                await asyncio.gather(task, return_exceptions=True)
+            finally:
+                self._running.pop(job_id, None)
+                self.jobs.pop(job_id, None)
+
+    async def _run(self, job: ExportJob):
+        job.status = ExportJobStatus.EXECUTANDO
+        partial = self.path(job) + ".part"
+        try:
+            await self._save(job)
+            if job.recurso == ExportResource.DASHBOARD:
+                await self._write_dashboard(job, partial)
+            else:
+                await self._write_rows(job, partial)
+            os.replace(partial, self.path(job))
+        except (asyncio.CancelledError, ExportJobCancelled):
+            self._remove_files(job)
+            raise
+        except Exception as e:
+            logger.exception("Falha no job de exportação %s", job.id)
+            job.status = ExportJobStatus.FALHOU
+            job.erro = str(e)
+            if os.path.exists(partial):
+                os.remove(partial)
+        else:
+            job.status = ExportJobStatus.CONCLUIDO
+            job.progresso = 100.0
+            job.tamanho_bytes = os.path.getsize(self.path(job))
+            job.download_url = f"/api/export/jobs/{job.id}/download"
+        try:
+            await self._finish(job)
+        except ExportJobCancelled:
+            self._remove_files(job)
+
+    async def _finish(self, job: ExportJob):
+        job.concluido_em = datetime.utcnow()
+        job.expira_em = job.concluido_em + timedelta(seconds=self.ttl)
+        await self._save(job)
+
+    def _progress(self, job: ExportJob):
+        last_saved = 0.0
+
+        async def update(count: int):
+            nonlocal last_saved
+            job.linhas_processadas = count
+            if job.total_estimado:
+                job.progresso = round(min(count / job.total_estimado * 100, 99.9), 1)
+            # Grava o progresso no máximo uma vez por intervalo; o registro
+            # apagado (cancelamento em outro worker) interrompe o job aqui
+            if time.monotonic() - last_saved >= EXPORT_JOB_PROGRESS_INTERVAL:
+                last_saved = time.monotonic()
+                await self._save(job)
+        return update
+
+    async def _write_rows(self, job: ExportJob, path: str):
+        collections, cursor, model, prepare, title = await export_source(job.recurso)
+        job.total_estimado = sum(await asyncio.gather(*(c.estimated_document_count() for c in collections)))
+        counting = CountingCursor(cursor, self._progress(job))
+
+        if job.formato != ExportJobFormat.XLSX:
+            with open(path, "wb") as handle:
+                async for chunk in stream_export(counting, model, prepare, ExportFormat(job.formato.value)):
+                    await asyncio.to_thread(handle.write, chunk.encode("utf-8"))
+            return
+
+        fields = list(model.model_fields)
+        writer = XlsxWriter(path)
+        writer.add_sheet(title, fields)
+        rows = []
+        async for doc in counting.batch_size(EXPORT_BATCH_SIZE):
+            obj = model(**prepare(doc))
+            rows.append([getattr(obj, field) for field in fields])
+            if len(rows) >= EXPORT_BATCH_SIZE:
+                await asyncio.to_thread(writer.append_rows, rows)
+                rows = []
+        await asyncio.to_thread(writer.append_rows, rows)
+        await asyncio.to_thread(writer.save)
+
+    async def _write_dashboard(self, job: ExportJob, path: str):
+        data = await export_dashboard_data()
+        if job.formato == ExportJobFormat.JSON:
+            content = json.dumps(data, default=str, ensure_ascii=False).encode("utf-8")
+            await asyncio.to_thread(Path(path).write_bytes, content)
+            return
+
+        def write():
+            writer = XlsxWriter(path)
+            for name, value in data.items():
+                if isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+                    header = list(dict.fromkeys(key for item in value for key in item))
+                    writer.add_sheet(name, header)
+                    writer.append_rows([[item.get(key) for key in header] for item in value])
+                elif isinstance(value, dict):
+                    writer.add_sheet(name, ["campo", "valor"])
+                    writer.append_rows([[key, item] for key, item in value.items()])
+                else:
+                    writer.add_sheet(name, [name])
+                    writer.append_rows([[value]])
+            writer.save()
+
+        await asyncio.to_thread(write)
+
+    async def collect_expired(self) -> int:
+        """Remove jobs vencidos e arquivos velhos demais para pertencer a um job válido.
+
+        Vale para todos os workers: um arquivo só é apagado pelo registro
+        vencido ou pela idade (pronto há mais de `ttl`; parcial sem escrita há
+        mais de `stale_seconds`), nunca por não ser deste processo.
+        """
+        now = datetime.utcnow()
+        removed = 0
+        async for doc in self.collection.find({"expira_em": {"$lte": now}}):
+            job = ExportJob(**doc)
+            self._remove_files(job)
+            await self.collection.delete_one({"_id": job.id, "expira_em": {"$lte": now}})
+            removed += 1
+        if not os.path.isdir(self.directory):
+            return removed
+        now_ts = time.time()
+        for name in os.listdir(self.directory):
+            if not EXPORT_JOB_FILE_PATTERN.fullmatch(name) or name.split(".")[0] in self.jobs:
+                continue
+            path = os.path.join(self.directory, name)
+            max_age = self.stale_seconds if name.endswith(".part") else self.ttl
+            try:
+                if now_ts - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass  # removido por outro worker
+        return removed
+
+    async def _collect_loop(self):
+        while True:
+            await asyncio.sleep(min(60, max(self.ttl, 1)))
+            try:
+                await self.collect_expired()
+            except PyMongoError as e:
+                logger.warning("Coleta dos jobs de exportação falhou: %s", e)
+
+export_jobs = ExportJobManager()
+
+# Concorrência otimista
+# Cada documento tem um `version` (ausente = 1 nos documentos antigos) que é
+# incrementado em toda atualização. Com o header If-Match, a escrita só é
+# aplicada se a versão ainda for a informada; caso contrário a API responde 409.
+def parse_if_match(if_match: Optional[str]) -> Optional[List[int]]:
+    """Versões aceitas pelo header If-Match (None = qualquer versão)"""
+    if not if_match or if_match.strip() == "*":
+        return None
+    versions = []
+    for tag in if_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        try:
+            versions.append(int(tag.strip('"')))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"If-Match inválido: {tag}")
+    return versions
+
+def version_filter(doc_id: str, versions: Optional[List[int]]) -> dict:
+    query = {"id": doc_id}
+    if versions is not None:
+        # Documentos sem `version` equivalem à versão 1
+        query["version"] = {"$in": versions + [None] if 1 in versions else versions}
+    return query
+
+def versioned_update(update_data: dict) -> list:
+    """Pipeline de atualização: aplica update_data e incrementa `version` atomicamente"""
+    fields = {field: {"$literal": value} for field, value in update_data.items()}
+    fields["version"] = {"$add": [{"$ifNull": ["$version", 1]}, 1]}
+    return [{"$set": fields}]
+
+def apply_versioned_update(previous: dict, update_data: dict) -> dict:
+    """Documento resultante de versioned_update aplicado sobre `previous`"""
+    return {**previous, **update_data, "version": previous.get("version", 1) + 1}
+
+def set_etag(response: Optional[Response], doc: dict):
+    if response is not None:
+        response.headers["ETag"] = f'"{doc.get("version", 1)}"'
+
+async def raise_write_conflict(collection, doc_id: str, versions: Optional[List[int]], not_found_detail: str):
+    """Diferencia documento inexistente (404) de versão desatualizada (409)"""
+    if versions is not None:
+        current = await collection.find_one({"id": doc_id}, {"version": 1})
+        if current:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Conflito de versão: versão atual é {current.get('version', 1)}",
+            )
+    raise HTTPException(status_code=404, detail=not_found_detail)
+
+async def find_one_and_update_versioned(collection, doc_id: str, update_data: dict,
+                                        if_match: Optional[str], not_found_detail: str,
+                                        query: Optional[dict] = None) -> tuple:
+    """Atualização em uma única ida ao banco; devolve (documento anterior, novo)"""
+    versions = parse_if_match(if_match)
+    previous = await collection.find_one_and_update(
+        {**version_filter(doc_id, versions), **(query or {})}, versioned_update(update_data),
+        return_document=ReturnDocument.BEFORE,
+    )
+    if not previous:
+        await raise_write_conflict(collection, doc_id, versions, not_found_detail)
+    return previous, apply_versioned_update(previous, update_data)
+
+async def find_one_and_delete_versioned(collection, doc_id: str, if_match: Optional[str],
+                                        not_found_detail: str, query: Optional[dict] = None) -> dict:
+    versions = parse_if_match(if_match)
+    deleted = await collection.find_one_and_delete({**version_filter(doc_id, versions), **(query or {})})
+    if not deleted:
+        await raise_write_conflict(collection, doc_id, versions, not_found_detail)
+    return deleted
+
+# Segmentação de clientes
+# k-means vetorizado (NumPy) sobre o perfil dos clientes. Os documentos são
+# lidos em lotes e codificados numa matriz "bruta" (numéricos com NaN quando
+# ausentes e enums em one-hot), de onde saem as features do modelo
+# (escolaridade, frequência e tipo de compra como ordinais; origem em one-hot),
+# padronizadas. O modelo ajustado e a atribuição de cada cliente ficam em
+# memória; as escritas de clientes reatribuem só o cliente alterado ao centro
+# mais próximo e, passado SEGMENT_REFIT_RATIO de alterações, um novo ajuste
+# roda em segundo plano, fora do caminho das requisições.
+SEGMENT_CLUSTERS = int(os.getenv("SEGMENT_CLUSTERS", "5"))
+SEGMENT_MAX_CLUSTERS = int(os.getenv("SEGMENT_MAX_CLUSTERS", "20"))
+SEGMENT_BATCH_SIZE = int(os.getenv("SEGMENT_BATCH_SIZE", "5000"))
+SEGMENT_REFIT_RATIO = float(os.getenv("SEGMENT_REFIT_RATIO", "0.1"))
+SEGMENT_NUMERIC_FIELDS = ["renda_bruta", "idade", "numero_filhos", "tem_cartao_credito"]
+# Enums em ordem crescente; os três primeiros entram no modelo como ordinais
+SEGMENT_ENUM_FIELDS = {
+    "escolaridade": [Escolaridade.FUNDAMENTAL, Escolaridade.MEDIO, Escolaridade.TECNICO,
+                     Escolaridade.SUPERIOR, Escolaridade.POS_GRADUACAO],
+    "frequencia_compra": list(FrequenciaCompra),
+    "tipo_compra": list(TipoCompra),
+    "origem_cliente": list(OrigemCliente),
+}
+SEGMENT_ORDINAL_FIELDS = ["escolaridade", "frequencia_compra", "tipo_compra"]
+SEGMENT_PROJECTION = {"_id": 0, "id": 1, **{field: 1 for field in SEGMENT_NUMERIC_FIELDS + list(SEGMENT_ENUM_FIELDS)}}
+
+def _segment_columns() -> dict:
+    """Fatia de colunas da matriz bruta ocupada por cada campo"""
+    columns, start = {}, 0
+    for field in SEGMENT_NUMERIC_FIELDS:
+        columns[field] = slice(start, start + 1)
+        start += 1
+    for field, values in SEGMENT_ENUM_FIELDS.items():
+        columns[field] = slice(start, start + len(values))
+        start += len(values)
+    return columns
+
+SEGMENT_COLUMNS = _segment_columns()
+SEGMENT_WIDTH = max(column.stop for column in SEGMENT_COLUMNS.values())
+
+def segment_fields_changed(previous: Optional[dict], new: Optional[dict]) -> bool:
+    if previous is None or new is None:
+        return True
+    return any(previous.get(field) != new.get(field) for field in SEGMENT_PROJECTION if field != "_id")
+
+def segment_rows(docs: List[dict]) -> np.ndarray:
+    """Matriz bruta (um cliente por linha) de um lote de documentos"""
+    rows = np.zeros((len(docs), SEGMENT_WIDTH))
+    for field in SEGMENT_NUMERIC_FIELDS:
+        values = [doc.get(field) for doc in docs]
+        rows[:, SEGMENT_COLUMNS[field].start] = [np.nan if v is None else float(v) for v in values]
+    for field, values in SEGMENT_ENUM_FIELDS.items():
+        positions = {value.value: i for i, value in enumerate(values)}
+        index = np.array([positions.get(doc.get(field), -1) for doc in docs], dtype=np.int64)
+        present = index >= 0
+        rows[np.flatnonzero(present), SEGMENT_COLUMNS[field].start + index[present]] = 1
+    return rows
+
+def segment_features(raw: np.ndarray) -> np.ndarray:
+    """Features do modelo: numéricos, ordinais em [0, 1] (NaN se ausentes) e origem em one-hot"""
+    parts = [raw[:, :len(SEGMENT_NUMERIC_FIELDS)]]
+    for field in SEGMENT_ORDINAL_FIELDS:
+        block = raw[:, SEGMENT_COLUMNS[field]]
+        ordinal = block @ np.linspace(0, 1, block.shape[1])
+        parts.append(np.where(block.sum(axis=1) > 0, ordinal, np.nan)[:, None])
+    parts.append(raw[:, SEGMENT_COLUMNS["origem_cliente"]])
+    return np.hstack(parts)
+
+def kmeans(points: np.ndarray, k: int, rng: np.random.Generator, max_iter: int = 100, tol: float = 1e-6) -> tuple:
+    """k-means (inicialização k-means++ e iterações de Lloyd) -> (centros, rótulos, inércia, iterações)"""
+    n = len(points)
+    centers = np.empty((k, points.shape[1]))
+    centers[0] = points[rng.integers(n)]
+    closest = ((points - centers[0]) ** 2).sum(axis=1)
+    for i in range(1, k):
+        total = closest.sum()
+        choice = rng.choice(n, p=closest / total) if total > 0 else rng.integers(n)
+        centers[i] = points[choice]
+        closest = np.minimum(closest, ((points - centers[i]) ** 2).sum(axis=1))
+
+    squared_norms = (points ** 2).sum(axis=1)
+    for iteration in range(1, max_iter + 1):
+        distances = squared_norms[:, None] - 2 * points @ centers.T + (centers ** 2).sum(axis=1)
+        labels = distances.argmin(axis=1)
+        sizes = np.bincount(labels, minlength=k)
+        sums = np.stack([np.bincount(labels, weights=points[:, j], minlength=k)
+                         for j in range(points.shape[1])], axis=1)
+        # Um centro que ficou sem pontos permanece onde estava
+        moved = np.where(sizes[:, None] > 0, sums / np.maximum(sizes, 1)[:, None], centers)
+        shift = ((moved - centers) ** 2).sum()
+        centers = moved
+        if shift <= tol:
+            break
+    distances = squared_norms[:, None] - 2 * points @ centers.T + (centers ** 2).sum(axis=1)
+    labels = distances.argmin(axis=1)
+    inertia = float(np.maximum(distances[np.arange(n), labels], 0).sum())
+    return centers, labels, inertia, iteration
+
+class SegmentationModel:
+    """Modelo ajustado, atribuição por cliente e acumuladores por segmento para os perfis"""
+
+    def __init__(self, k: int, centers: np.ndarray, fill: np.ndarray, mean: np.ndarray, std: np.ndarray):
+        self.k = k
+        self.centers = centers
+        self.fill = fill
+        self.mean = mean
+        self.std = std
+        self.members = {}
+        self.sizes = np.zeros(k)
+        self.sums = np.zeros((k, SEGMENT_WIDTH))
+        self.counts = np.zeros((k, SEGMENT_WIDTH))
+        self.changes = 0
+        self.inertia = 0.0
+        self.iterations = 0
+        self.fitted_at = datetime.utcnow()
+        self.fit_seconds = 0.0
+
+    @classmethod
+    def fit(cls, ids: List[str], raw: np.ndarray, k: int, seed: int = 0) -> "SegmentationModel":
+        started = time.perf_counter()
+        k = max(1, min(k, len(ids)))
+        features = segment_features(raw)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # coluna toda ausente
+            fill = np.nan_to_num(np.nanmean(features, axis=0)) if len(ids) else np.zeros(features.shape[1])
+        filled = np.where(np.isnan(features), fill, features)
+        mean = filled.mean(axis=0) if len(ids) else fill
+        std = filled.std(axis=0) if len(ids) else np.ones_like(fill)
+        std[std == 0] = 1
+        model = cls(k, np.zeros((k, features.shape[1])), fill, mean, std)
+        if len(ids):
+            centers, labels, model.inertia, model.iterations = kmeans((filled - mean) / std, k, np.random.default_rng(seed))
+            # Segmentos numerados do maior para o menor
+            order = np.argsort(-np.bincount(labels, minlength=k), kind="stable")
+            model.centers = centers[order]
+            labels = np.argsort(order)[labels]
+            model.members = dict(zip(ids, zip(labels.tolist(), raw)))
+            model.sizes = np.bincount(labels, minlength=k).astype(float)
+            values, present = np.nan_to_num(raw), (~np.isnan(raw)).astype(float)
+            for column in range(SEGMENT_WIDTH):
+                model.sums[:, column] = np.bincount(labels, weights=values[:, column], minlength=k)
+                model.counts[:, column] = np.bincount(labels, weights=present[:, column], minlength=k)
+        model.fit_seconds = round(time.perf_counter() - started, 3)
+        return model
+
+    def predict(self, raw: np.ndarray) -> np.ndarray:
+        features = segment_features(raw)
+        points = (np.where(np.isnan(features), self.fill, features) - self.mean) / self.std
+        distances = ((points[:, None, :] - self.centers[None, :, :]) ** 2).sum(axis=2)
+        return distances.argmin(axis=1)
+
+    def _add(self, doc_id: str, label: int, row: np.ndarray, sign: int = 1):
+        self.sizes[label] += sign
+        self.sums[label] += sign * np.nan_to_num(row)
+        self.counts[label] += sign * ~np.isnan(row)
+        if sign > 0:
+            self.members[doc_id] = (label, row)
+
+    def apply_change(self, previous: Optional[dict], new: Optional[dict]):
+        """Reatribui um cliente criado, alterado (anterior, novo) ou removido (novo = None)"""
+        doc_id = (new or previous or {}).get("id")
+        member = self.members.pop(doc_id, None)
+        if member:
+            self._add(doc_id, member[0], member[1], sign=-1)
+        if new is not None:
+            row = segment_rows([new])[0]
+            self._add(doc_id, int(self.predict(row[None, :])[0]), row)
+        self.changes += 1
+
+    def segment_of(self, doc_id: str) -> Optional[int]:
+        member = self.members.get(doc_id)
+        return member[0] if member else None
+
+    def profiles(self) -> List[dict]:
+        total = self.sizes.sum()
+        profiles = []
+        for label in range(self.k):
+            size = self.sizes[label]
+            profile = {
+                "segmento": label,
+                "clientes": int(size),
+                "percentual_clientes": round(float(size / total * 100), 1) if total else 0.0,
+            }
+            for field, key in (("renda_bruta", "renda_bruta_media"), ("idade", "idade_media"),
+                               ("numero_filhos", "numero_filhos_medio"), ("tem_cartao_credito", "percentual_cartao_credito")):
+                column = SEGMENT_COLUMNS[field].start
+                count = self.counts[label, column]
+                value = self.sums[label, column] / count if count else None
+                if value is not None and field == "tem_cartao_credito":
+                    value *= 100
+                profile[key] = round(float(value), 2) if value is not None else None
+            predominant = {}
+            for field, values in SEGMENT_ENUM_FIELDS.items():
+                shares = self.sums[label, SEGMENT_COLUMNS[field]] / size * 100 if size else np.zeros(len(values))
+                profile[field] = {value.value: round(float(share), 1) for value, share in zip(values, shares)}
+                predominant[field] = values[int(shares.argmax())].value if shares.any() else None
+            profile["predominante"] = predominant
+            profiles.append(profile)
+        return profiles
+
+class CustomerSegmentation:
+    """Dono do modelo atual: ajustes em segundo plano e atualizações incrementais"""
+
+    def __init__(self, refit_ratio: float = SEGMENT_REFIT_RATIO, min_changes: int = 100):
+        self.model: Optional[SegmentationModel] = None
+        self.refit_ratio = refit_ratio
+        self.min_changes = min_changes
+        self.requested_k = SEGMENT_CLUSTERS
+        self.last_error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+        # Alterações que chegam durante um ajuste são reaplicadas no modelo novo
+        self._pending: Optional[List[tuple]] = None
+
+    @property
+    def fitting(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def load_rows(self) -> tuple:
+        ids, blocks, batch = [], [], []
+        async for doc in db.clients.find({}, SEGMENT_PROJECTION).batch_size(SEGMENT_BATCH_SIZE):
+            batch.append(doc)
+            if len(batch) >= SEGMENT_BATCH_SIZE:
+                ids.extend(d.get("id") for d in batch)
+                blocks.append(segment_rows(batch))
+                batch = []
+        if batch:
+            ids.extend(d.get("id") for d in batch)
+            blocks.append(segment_rows(batch))
+        return ids, np.vstack(blocks) if blocks else np.zeros((0, SEGMENT_WIDTH))
+
+    async def fit(self, k: int):
+        self._pending = []
+        try:
+            ids, raw = await self.load_rows()
+            model = await asyncio.to_thread(SegmentationModel.fit, ids, raw, k)
+            for previous, new in self._pending:
+                model.apply_change(previous, new)
+            self.model = model
+            self.last_error = None
+        except Exception as e:
+            logger.exception("Falha ao ajustar a segmentação de clientes")
+            self.last_error = str(e)
+        finally:
+            self._pending = None
+
+    def schedule_fit(self, k: Optional[int] = None) -> bool:
+        """Inicia um ajuste em segundo plano, se nenhum estiver em andamento"""
+        self.requested_k = k or self.requested_k
+        if self.fitting:
+            return False
+        self._task = asyncio.create_task(self.fit(self.requested_k))
+        return True
+
+    def clients_changed(self, changes: List[tuple]):
+        changes = [change for change in changes if segment_fields_changed(*change)]
+        if not changes:
+            return
+        if self._pending is not None:
+            self._pending.extend(changes)
+        if self.model is None:
+            return
+        for previous, new in changes:
+            self.model.apply_change(previous, new)
+        if self.model.changes >= max(self.min_changes, self.refit_ratio * len(self.model.members)):
+            self.schedule_fit()
+
+    def status(self) -> dict:
+        model = self.model
+        return {
+            "status": "pronto" if model else ("calculando" if self.fitting else "vazio"),
+            "recalculando": self.fitting,
+            "erro": self.last_error,
+            "k": model.k if model else self.requested_k,
+            "clientes": len(model.members) if model else 0,
+            "inercia": round(model.inertia, 3) if model else None,
+            "iteracoes": model.iterations if model else None,
+            "ajustado_em": model.fitted_at.isoformat() if model else None,
+            "duracao_ajuste_s": model.fit_seconds if model else None,
+            "alteracoes_desde_ajuste": model.changes if model else 0,
+        }
+
+segmentation = CustomerSegmentation()
+
+# Valor do cliente (lifetime value)
+# Cada entrada com cliente_id soma em `total_gasto` e `compras_registradas` do
+# cliente e pode avançar `ultima_compra`. As escritas de transações aplicam os
+# deltas com $inc/$max; quando uma compra sai (remoção ou alteração), a última
+# compra dos clientes afetados é relida pelo índice (cliente_id, data).
+CLIENT_SORTS = {
+    ClientSort.NOME: ("nome", ASCENDING),
+    ClientSort.VALOR: ("total_gasto", DESCENDING),
+    ClientSort.ULTIMA_COMPRA: ("ultima_compra", DESCENDING),
+}
+
+def client_value_contribution(doc: Optional[dict]) -> Optional[tuple]:
+    """Cliente, valor e data com que uma transação armazenada contribui (só entradas)"""
+    if not doc or doc.get("tipo") != TransactionType.ENTRADA or not doc.get("cliente_id"):
+        return None
+    return doc["cliente_id"], doc.get("valor") or 0, doc.get("data")
+
+async def latest_purchases(cliente_ids: List[str]) -> dict:
+    def pipeline(ids):
+        return [
+            {"$match": {"cliente_id": {"$in": ids}, "tipo": TransactionType.ENTRADA.value}},
+            {"$group": {"_id": "$cliente_id", "ultima_compra": {"$max": "$data"}}},
+        ]
+    latest = {item["_id"]: item["ultima_compra"] async for item in db.transactions.aggregate(pipeline(cliente_ids))}
+    # Sem compra nos anos em uso, a última pode estar num ano arquivado
+    missing = [cliente_id for cliente_id in cliente_ids if latest.get(cliente_id) is None]
+    if missing and await archive_catalog.refresh():
+        for ano in sorted(archive_catalog.years, reverse=True):
+            async for item in db[archive_collection_name(ano)].aggregate(pipeline(missing)):
+                latest[item["_id"]] = item["ultima_compra"]
+            missing = [cliente_id for cliente_id in missing if latest.get(cliente_id) is None]
+            if not missing:
+                break
+    return latest
+
+async def apply_client_value_deltas(changes: List[tuple]):
+    """Para cada par (antigo, novo), retira a compra do antigo e soma a do novo no cliente"""
+    deltas, latest, removed = {}, {}, set()
+    for old_doc, new_doc in changes:
+        for doc, sign in ((old_doc, -1), (new_doc, 1)):
+            contribution = client_value_contribution(doc)
+            if contribution is None:
+                continue
+            cliente_id, valor, data = contribution
+            delta = deltas.setdefault(cliente_id, [0, 0])
+            delta[0] += sign * valor
+            delta[1] += sign
+            if sign < 0:
+                removed.add(cliente_id)
+            elif isinstance(data, datetime) and (cliente_id not in latest or data > latest[cliente_id]):
+                latest[cliente_id] = data
+
+    operations = []
+    for cliente_id, (valor, count) in deltas.items():
+        update = {}
+        if valor or count:
+            update["$inc"] = {"total_gasto": valor, "compras_registradas": count}
+        if cliente_id in latest and cliente_id not in removed:
+            update["$max"] = {"ultima_compra": latest[cliente_id]}
+        if update:
+            operations.append(UpdateOne({"id": cliente_id}, update))
+    if removed:
+        current = await latest_purchases(sorted(removed))
+        operations.extend(UpdateOne({"id": cliente_id}, {"$set": {"ultima_compra": current.get(cliente_id)}})
+                          for cliente_id in removed)
+    if operations:
+        await db.clients.bulk_write(operations, ordered=False)
+        await client_cache.invalidate(deltas)
+
+CLIENT_VALUE_FIELDS = ("total_gasto", "compras_registradas", "ultima_compra")
+
+async def expected_client_values() -> dict:
+    """Total gasto, compras e última compra por cliente, recalculados de todas as partições"""
+    pipeline = [
+        {"$match": {"tipo": TransactionType.ENTRADA.value, "cliente_id": {"$ne": None}}},
+        {"$group": {
+            "_id": "$cliente_id",
+            "total_gasto": {"$sum": "$valor"},
+            "compras_registradas": {"$sum": 1},
+            "ultima_compra": {"$max": "$data"},
+        }},
+    ]
+    expected = {}
+    for collection in archive_catalog.partitions():
+        async for item in collection.aggregate(pipeline, allowDiskUse=True):
+            current = expected.setdefault(item.pop("_id"), {"total_gasto": 0.0, "compras_registradas": 0, "ultima_compra": None})
+            current["total_gasto"] += item["total_gasto"]
+            current["compras_registradas"] += item["compras_registradas"]
+            if current["ultima_compra"] is None or (item["ultima_compra"] and item["ultima_compra"] > current["ultima_compra"]):
+                current["ultima_compra"] = item["ultima_compra"]
+    return expected
+
+async def reconcile_client_values(fix: bool = False) -> dict:
+    """Compara os valores dos clientes com as transações e, se fix=True, corrige as divergências.
+
+    Com um ano em arquivamento as transações dele podem estar nas duas
+    coleções; a conferência espera o arquivamento terminar.
+    """
+    years = await archive_catalog.refresh(force=True)
+    if any(not archive_catalog.archived(ano) for ano in years):
+        return {"clientes": 0, "divergencias": [], "corrigido": False, "arquivamento_em_andamento": True}
+    expected = await expected_client_values()
+    empty = {"total_gasto": 0.0, "compras_registradas": 0, "ultima_compra": None}
+    divergent = []
+    clients_count = 0
+    projection = {"_id": 0, "id": 1, **dict.fromkeys(CLIENT_VALUE_FIELDS, 1)}
+    async for doc in db.clients.find({}, projection):
+        clients_count += 1
+        want = expected.get(doc["id"], empty)
+        have = {field: doc.get(field) for field in CLIENT_VALUE_FIELDS}
+        if (have["total_gasto"] is None or round(want["total_gasto"] - have["total_gasto"], 2) != 0
+                or have["compras_registradas"] != want["compras_registradas"]
+                or have["ultima_compra"] != want["ultima_compra"] or "ultima_compra" not in doc):
+            divergent.append((doc["id"], want, have))
+
+    if fix and divergent:
+        operations = [UpdateOne({"id": cliente_id}, {"$set": want}) for cliente_id, want, _ in divergent]
+        for start in range(0, len(operations), 1000):
+            await db.clients.bulk_write(operations[start:start + 1000], ordered=False)
+        await client_cache.invalidate([cliente_id for cliente_id, _, _ in divergent])
+
+    return {
+        "clientes": clients_count,
+        "divergencias": [
+            {"cliente_id": cliente_id, "esperado": want, "armazenado": have}
+            for cliente_id, want, have in sorted(divergent, key=lambda d: d[0])
+        ],
+        "corrigido": bool(fix and divergent),
+        "arquivamento_em_andamento": False,
+    }
+
+# Eventos de alteração (SSE)
+# As escritas publicam eventos tipados num barramento em memória e /api/events
+# os entrega por Server-Sent Events, para a interface aplicar as alterações
+# sem recarregar tudo. Cada evento é codificado uma única vez e o mesmo frame
+# vai para a fila limitada de cada assinante; um assinante ocioso custa só a
+# fila e a tarefa parada esperando por ela. Quem fica para trás (fila cheia)
+# perde os eventos pendentes e recebe um `resync`, sinal para recarregar.
+# Com EVENTS_SOURCE=change_stream os eventos vêm dos change streams do Mongo
+# (e enxergam as escritas de todos os workers) em vez das rotas deste processo.
+# Com "local" e vários workers cada stream só vê as escritas do seu worker; a
+# interface recarrega após as próprias escritas e usa o stream para as alheias.
+EVENTS_SOURCE = os.getenv("EVENTS_SOURCE", "local")
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+EVENTS_HISTORY_SIZE = int(os.getenv("EVENTS_HISTORY_SIZE", "1000"))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+EVENTS_DASHBOARD_DEBOUNCE = float(os.getenv("EVENTS_DASHBOARD_DEBOUNCE", "0.25"))
+EVENTS_RETRY_MS = int(os.getenv("EVENTS_RETRY_MS", "5000"))
+
+class EventBus:
+    """Barramento de eventos em memória com fan-out para filas limitadas"""
+
+    def __init__(self, queue_size: int = EVENTS_QUEUE_SIZE, history_size: int = EVENTS_HISTORY_SIZE):
+        self.queue_size = queue_size
+        # Ids são "<execução>-<sequência>": um Last-Event-ID de outro processo
+        # (ou de antes de um reinício) não é confundido com os daqui
+        self.run_id = uuid.uuid4().hex[:8]
+        self.sequence = 0
+        self.history = deque(maxlen=history_size)
+        self.subscribers = set()
+        self._dashboard_task: Optional[asyncio.Task] = None
+
+    def frame(self, event_type: str, data: dict, advance: bool = True) -> bytes:
+        # Um resync não avança a sequência: leva o id do último evento, e quem
+        # recarregar a partir dele retoma do ponto certo numa reconexão
+        if advance:
+            self.sequence += 1
+        payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+        return f"id: {self.run_id}-{self.sequence}\nevent: {event_type}\ndata: {payload}\n\n".encode()
+
+    def publish(self, event_type: str, data: dict):
+        frame = self.frame(event_type, data)
+        self.history.append((self.sequence, frame))
+        metrics.inc("sse_events_total", (("type", event_type),))
+        for queue in self.subscribers:
+            self._deliver(queue, frame)
+
+    def skip(self):
+        """Alteração não codificada (ninguém ouvindo): quem reconectar recebe resync"""
+        self.sequence += 1
+        self.history.clear()
+
+    def _deliver(self, queue: asyncio.Queue, frame: bytes):
+        try:
+            queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(self.frame("resync", {"motivo": "fila_cheia"}, advance=False))
+            metrics.inc("sse_resyncs_total")
+
+    def subscribe(self, last_event_id: Optional[str] = None) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        if last_event_id:
+            for frame in self._missed(last_event_id):
+                self._deliver(queue, frame)
+        self.subscribers.add(queue)
+        metrics.set("sse_subscribers", (), len(self.subscribers))
+        return queue
+
+    def _missed(self, last_event_id: str) -> List[bytes]:
+        """Eventos posteriores a Last-Event-ID, ou um resync se não estão mais no histórico"""
+        run_id, _, sequence = last_event_id.partition("-")
+        if run_id == self.run_id and sequence.isdigit():
+            sequence = int(sequence)
+            if sequence >= self.sequence:
+                return []
+            if self.history and self.history[0][0] <= sequence + 1:
+                return [frame for seq, frame in self.history if seq > sequence]
+        return [self.frame("resync", {"motivo": "historico_indisponivel"}, advance=False)]
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+        metrics.set("sse_subscribers", (), len(self.subscribers))
+
+    def close(self):
+        """Encerra os streams abertos (None é o sinal de fim para cada assinante)"""
+        for queue in self.subscribers:
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+    def schedule_dashboard(self):
+        """Publica os novos totais do dashboard logo após uma rajada de escritas"""
+        if not self.subscribers or self._dashboard_task and not self._dashboard_task.done():
+            return
+        self._dashboard_task = asyncio.create_task(self._publish_dashboard())
+
+    async def _publish_dashboard(self):
+        await asyncio.sleep(EVENTS_DASHBOARD_DEBOUNCE)
+        try:
+            # Calculado direto dos rollups: o cache pode ser de outro worker
+            dashboard = await compute_dashboard_data(datetime.now())
+        except PyMongoError as e:
+            logger.warning("Não foi possível calcular o dashboard para os eventos: %s", e)
+            return
+        self.publish("dashboard", dashboard)
+
+events = EventBus()
+
+def transaction_json(doc: dict) -> dict:
+    """Transação como a API a devolve em JSON"""
+    return Transaction(**transaction_from_db(dict(doc))).model_dump(mode="json")
+
+def client_json(doc: dict) -> dict:
+    """Cliente como a API o devolve em JSON"""
+    return client_from_db(dict(doc)).model_dump(mode="json")
+
+def publish_changes(resource: str, changes: List[tuple], to_data):
+    """Publica `<recurso>.created|updated|deleted` para cada (documento antigo, novo)"""
+    if not events.subscribers:
+        events.skip()
+        return
+    for old_doc, new_doc in changes:
+        if old_doc is None:
+            events.publish(f"{resource}.created", {"atual": to_data(new_doc)})
+        elif new_doc is None:
+            events.publish(f"{resource}.deleted", {"id": old_doc["id"], "anterior": to_data(old_doc)})
+        else:
+            events.publish(f"{resource}.updated", {"atual": to_data(new_doc), "anterior": to_data(old_doc)})
+
+CHANGE_STREAM_RESOURCES = {
+    "transactions": ("transaction", transaction_json),
+    "clients": ("client", client_json),
+}
+
+async def watch_change_streams():
+    """Alimenta o barramento com os change streams de transações e clientes.
+
+    O documento anterior só vem quando a coleção tem changeStreamPreAndPostImages
+    habilitado; sem ele, exclusões viram um `resync`.
+    """
+    pipeline = [{"$match": {"ns.coll": {"$in": list(CHANGE_STREAM_RESOURCES)}}}]
+    resume_token = None
+    while True:
+        try:
+            async with db.watch(pipeline, full_document="updateLookup",
+                                full_document_before_change="whenAvailable",
+                                resume_after=resume_token) as stream:
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    publish_stream_change(change)
+        except asyncio.CancelledError:
+            raise
+        except PyMongoError as e:
+            logger.error("Change stream interrompido, retomando em 5s: %s", e)
+            events.publish("resync", {"motivo": "change_stream"})
+            await asyncio.sleep(5)
+
+def publish_stream_change(change: dict):
+    resource, to_data = CHANGE_STREAM_RESOURCES[change["ns"]["coll"]]
+    operation = change["operationType"]
+    old_doc = change.get("fullDocumentBeforeChange")
+    new_doc = change.get("fullDocument")
+    if operation == "insert":
+        events.publish(f"{resource}.created", {"atual": to_data(new_doc)})
+    elif operation in ("update", "replace") and new_doc:
+        events.publish(f"{resource}.updated", {
+            "atual": to_data(new_doc), "anterior": to_data(old_doc) if old_doc else None,
+        })
+    elif operation == "delete" and old_doc:
+        events.publish(f"{resource}.deleted", {"id": old_doc["id"], "anterior": to_data(old_doc)})
+    else:
+        events.publish("resync", {"motivo": operation})
+        return
+    events.schedule_dashboard()
+
+# Efeitos colaterais das escritas
+async def after_transaction_writes(changes: List[tuple]):
+    """Atualiza rollups, valor dos clientes e cache após escritas; cada item é (documento antigo, novo)"""
+    if not changes:
+        return
+    await asyncio.gather(apply_rollup_deltas(changes), apply_client_value_deltas(changes))
+    await transaction_cache.invalidate(changed_ids(changes))
+    await report_cache.invalidate(transaction_report_keys(*(doc for change in changes for doc in change)))
+    if EVENTS_SOURCE == "local":
+        publish_changes("transaction", changes, transaction_json)
+        events.schedule_dashboard()
+
+async def after_client_writes(changes: List[tuple]):
+    """Atualiza o resumo de recebíveis, o cache do dashboard e a segmentação após escritas de clientes"""
+    if not changes:
+        return
+    await client_cache.invalidate(changed_ids(changes))
+    if any(client_affects_dashboard(*change) for change in changes):
+        await apply_receivable_deltas(changes)
+        await report_cache.invalidate_prefix("dashboard:")
+        if EVENTS_SOURCE == "local":
+            events.schedule_dashboard()
+    segmentation.clients_changed(changes)
+    if EVENTS_SOURCE == "local":
+        publish_changes("client", changes, client_json)
+
+def build_transaction_doc(transaction: TransactionCreate) -> tuple:
+    """Cria o modelo da nova transação e o documento a ser persistido"""
+    transaction_obj = Transaction(**transaction.dict(exclude_unset=True))
+    transaction_data = transaction_obj.dict()
+    transaction_data.update(transaction_date_fields(transaction_data.get('data')))
+    transaction_data.update(search_fields("cliente_nome", transaction_data.get('cliente_nome')))
+    return transaction_obj, transaction_data
+
+def prepare_transaction_update(transaction_update: TransactionUpdate) -> dict:
+    update_data = transaction_update.dict(exclude_unset=True)
+    if 'data' in update_data:
+        update_data.update(transaction_date_fields(update_data['data']))
+    if 'cliente_nome' in update_data:
+        update_data.update(search_fields("cliente_nome", update_data['cliente_nome']))
+    return update_data
+
+def build_client_doc(client: ClientCreate) -> tuple:
+    """Cria o modelo do novo cliente e o documento a ser persistido"""
+    client_obj = Client(**client.dict(exclude_unset=True))
+    client_data = client_obj.dict()
+    if client_data.get('data_ultimo_pagamento'):
+        client_data['data_ultimo_pagamento'] = client_data['data_ultimo_pagamento'].isoformat()
+    client_data.update(search_fields("nome", client_data.get('nome')))
+    return client_obj, client_data
+
+def prepare_client_update(client_update: ClientUpdate) -> dict:
+    update_data = client_update.dict(exclude_unset=True)
+    if update_data.get('data_ultimo_pagamento'):
+        update_data['data_ultimo_pagamento'] = update_data['data_ultimo_pagamento'].isoformat()
+    if 'nome' in update_data:
+        update_data.update(search_fields("nome", update_data['nome']))
+    return update_data
+
+# Operações em lote
+BULK_MAX_OPERATIONS = int(os.getenv("BULK_MAX_OPERATIONS", "1000"))
+# Alterações e remoções de um lote em andamento ao mesmo tempo
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "16"))
+
+def validation_message(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(p) for p in e['loc']) or 'dados'}: {e['msg']}" for e in error.errors())
+
+async def execute_bulk(collection, operacoes: List[BulkOperation], create_model, update_model,
+                       build_doc, prepare_update, reject=None) -> tuple:
+    """Valida e executa um lote, com resultado por item.
+
+    As inclusões vão num único bulk_write não ordenado. Alterações e remoções
+    usam find_one_and_* guardados pela versão lida no início do lote (como o
+    If-Match das rotas individuais): um item que não casa porque o documento
+    mudou no meio do caminho falha com 409 e não gera delta. Devolve o
+    BulkResult e a lista de pares (documento antigo, novo) das operações
+    aplicadas, para os efeitos colaterais de cada coleção.
+    `reject(antigo, novo)` pode recusar um item com uma mensagem de erro.
+    """
+    if len(operacoes) > BULK_MAX_OPERATIONS:
+        raise HTTPException(status_code=413, detail=f"Máximo de {BULK_MAX_OPERATIONS} operações por lote")
+
+    results = [BulkItemResult(indice=i, op=item.op, id=item.id, sucesso=False) for i, item in enumerate(operacoes)]
+    existing_ids = [item.id for item in operacoes if item.op != BulkOperationType.CREATE and item.id]
+    # Estado anterior dos documentos alterados/removidos, em uma única consulta
+    previous = {}
+    if existing_ids:
+        async for doc in collection.find({"id": {"$in": existing_ids}}):
+            previous[doc["id"]] = doc
+
+    def fail(result: BulkItemResult, erro: str, status: int):
+        result.erro, result.status = erro, status
+
+    inserts, pending_inserts, updates, seen_ids = [], [], [], set()
+    for i, item in enumerate(operacoes):
+        result = results[i]
+        try:
+            if item.op == BulkOperationType.CREATE:
+                _, new_doc = build_doc(create_model(**(item.dados or {})))
+                result.id = new_doc["id"]
+                erro = reject and reject(None, new_doc)
+                if erro:
+                    fail(result, erro, 409)
+                    continue
+                inserts.append(InsertOne(new_doc))
+                pending_inserts.append((i, new_doc))
+                continue
+            if not item.id:
+                fail(result, "Campo 'id' obrigatório", 400)
+                continue
+            if item.id in seen_ids:
+                fail(result, "Id repetido no mesmo lote", 400)
+                continue
+            seen_ids.add(item.id)
+            old_doc = previous.get(item.id)
+            if old_doc is None:
+                fail(result, "Documento não encontrado", 404)
+                continue
+            if item.op == BulkOperationType.DELETE:
+                update_data, new_doc = None, None
+            else:
+                update_data = prepare_update(update_model(**(item.dados or {})))
+                if not update_data:
+                    fail(result, "Nenhum campo para atualizar", 400)
+                    continue
+                new_doc = apply_versioned_update(old_doc, update_data)
+            erro = reject and reject(old_doc, new_doc)
+            if erro:
+                fail(result, erro, 409)
+                continue
+            updates.append((i, old_doc, update_data))
+        except ValidationError as e:
+            fail(result, validation_message(e), 422)
+
+    applied = {}
+    failed_inserts = {}
+    if inserts:
+        try:
+            await collection.bulk_write(inserts, ordered=False)
+        except BulkWriteError as e:
+            failed_inserts = {err["index"]: err.get("errmsg", "Erro de escrita") for err in e.details.get("writeErrors", [])}
+    for write_index, (i, new_doc) in enumerate(pending_inserts):
+        if write_index in failed_inserts:
+            fail(results[i], failed_inserts[write_index], 409)
+        else:
+            applied[i] = (None, new_doc)
+
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def apply_update(i: int, old_doc: dict, update_data: Optional[dict]):
+        query = version_filter(old_doc["id"], [old_doc.get("version", 1)])
+        async with semaphore:
+            try:
+                if update_data is None:
+                    current = await collection.find_one_and_delete(query)
+                    changed = current and (current, None)
+                else:
+                    current = await collection.find_one_and_update(
+                        query, versioned_update(update_data), return_document=ReturnDocument.BEFORE,
+                    )
+                    changed = current and (current, apply_versioned_update(current, update_data))
+            except PyMongoError as e:
+                fail(results[i], str(e), 500)
+                return
+        if changed:
+            applied[i] = changed
+        else:
+            fail(results[i], "Conflito de versão: o documento foi alterado durante o lote", 409)
+
+    await asyncio.gather(*(apply_update(i, old_doc, update_data) for i, old_doc, update_data in updates))
+
+    changes = []
+    for i in sorted(applied):
+        results[i].sucesso = True
+        changes.append(applied[i])
+
+    succeeded = len(applied)
+    return BulkResult(sucesso=succeeded, falhas=len(results) - succeeded, resultados=results), changes
+
+# Migrações
+# Migrações que constroem dados derivados de uma só vez (e não têm um filtro
+# "documentos ainda no formato antigo") registram a conclusão em `migrations`.
+async def migration_done(name: str) -> bool:
+    return await db.migrations.find_one({"_id": name}, {"_id": 1}) is not None
+
+async def mark_migration_done(name: str):
+    await db.migrations.update_one({"_id": name}, {"$set": {"concluida_em": datetime.utcnow()}}, upsert=True)
+
+async def migrate_in_batches(collection, query: dict, projection: dict, transform, batch_size: int = 1000) -> int:
+    """Percorre os documentos de `query` em ordem de _id e aplica as UpdateOne de `transform`"""
+    last_id = None
+    migrated = 0
+    while True:
+        batch_query = query if last_id is None else {"$and": [query, {"_id": {"$gt": last_id}}]}
+        docs = await collection.find(batch_query, projection).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not docs:
+            break
+        last_id = docs[-1]["_id"]
+        operations = [op for op in map(transform, docs) if op is not None]
+        if operations:
+            result = await collection.bulk_write(operations, ordered=False)
+            migrated += result.modified_count
+    return migrated
+
+async def migrate_transaction_dates():
+    """Converte `data` em texto ISO para data BSON e preenche ano/mes, em lotes"""
+    def transform(doc):
+        try:
+            value = transaction_from_db(dict(doc))['data']
+        except ValueError:
+            logger.warning("Transação %s com data inválida: %r", doc["_id"], doc["data"])
+            return None
+        # O filtro pela data original evita sobrescrever uma edição concorrente
+        return UpdateOne({"_id": doc["_id"], "data": doc["data"]}, {"$set": transaction_date_fields(value)})
+
+    query = {"$or": [{"data": {"$type": "string"}}, {"data": {"$type": "date"}, "ano": {"$exists": False}}]}
+    return await migrate_in_batches(db.transactions, query, {"data": 1}, transform)
+
+async def migrate_search_keys():
+    """Preenche as chaves de busca normalizadas de transações e clientes"""
+    migrated = 0
+    for collection, field in ((db.transactions, "cliente_nome"), (db.clients, "nome")):
+        def transform(doc, field=field):
+            return UpdateOne({"_id": doc["_id"], field: doc.get(field)}, {"$set": search_fields(field, doc.get(field))})
+        query = {f"{field}_tokens": {"$exists": False}}
+        migrated += await migrate_in_batches(collection, query, {field: 1}, transform)
+    return migrated
+
+async def migrate_client_values():
+    """Calcula total gasto, compras e última compra de todos os clientes, uma vez.
+
+    Compras feitas antes desta migração já criam os campos com $inc, então o
+    cálculo vale para todos os clientes e a conclusão fica em `migrations`.
+    """
+    if await migration_done("client-values"):
+        return 0
+    result = await reconcile_client_values(fix=True)
+    if result["arquivamento_em_andamento"]:
+        return 0  # tenta de novo na próxima execução
+    await mark_migration_done("client-values")
+    return len(result["divergencias"])
+
+MIGRATIONS = {
+    "transaction-dates": migrate_transaction_dates,
+    # Depende das datas já migradas para data BSON
+    "transaction-rollups": initialize_rollups,
+    "search-keys": migrate_search_keys,
+    "receivables-summary": initialize_receivables,
+    # Depende das datas já migradas para data BSON
+    "client-values": migrate_client_values,
+}
+
+async def run_migrations():
+    """Executa todas as migrações (idempotentes) com a API já no ar"""
+    for name, migration in MIGRATIONS.items():
+        try:
+            migrated = await migration()
+            if migrated:
+                logger.info("Migração %s: %d documentos atualizados", name, migrated)
+                await report_cache.clear()
+                await transaction_cache.clear()
+                await client_cache.clear()
+        except PyMongoError as e:
+            logger.error("Migração %s falhou: %s", name, e)
+
+# Saúde e aquecimento do pool
+async def warm_up_pool(connections: int = MONGO_WARMUP_CONNECTIONS) -> int:
+    """Abre conexões antes da primeira requisição com pings simultâneos (um por conexão)"""
+    connections = min(connections, MONGO_OPTIONS["maxPoolSize"])
+    if connections <= 0:
+        return 0
+    await asyncio.gather(*(client.admin.command("ping") for _ in range(connections)))
+    return connections
+
+def pool_status() -> dict:
+    """Uso do pool deste worker; saturação alta ou espera frequente pedem mais conexões ou workers"""
+    max_size = MONGO_OPTIONS["maxPoolSize"]
+    in_use = int(metrics.total("mongodb_pool_connections_in_use"))
+    return {
+        "tamanho_maximo": max_size,
+        "abertas": int(metrics.total("mongodb_pool_connections")),
+        "em_uso": in_use,
+        "aguardando": int(metrics.total("mongodb_pool_waiting")),
+        "saturacao": round(in_use / max_size, 3) if max_size else None,
+        "esperas_sem_conexao": int(metrics.total("mongodb_pool_checkout_failures_total")),
+    }
+
+async def ping_mongo() -> dict:
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(client.admin.command("ping"), timeout=MONGO_HEALTH_TIMEOUT)
+    except (PyMongoError, asyncio.TimeoutError) as e:
+        return {"ok": False, "erro": str(e) or type(e).__name__}
+    return {"ok": True, "latencia_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+# Idempotência das criações
+# Com o header Idempotency-Key, POST /transactions e POST /clients reservam a
+# chave em `idempotency_keys` (o _id único impede duas reservas) antes de
+# gravar, e guardam a resposta ao concluir. Uma repetição com a mesma chave
+# devolve a resposta original sem tocar na coleção; com outro corpo, 422.
+# Enquanto a primeira tentativa está em andamento, a repetição recebe 409; se
+# ela parou no meio (reserva vencida), o id reservado diz se o documento chegou
+# a ser gravado: se sim, a chave é concluída com ele, senão é retomada.
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "60"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+IDEMPOTENT_RESOURCES = {
+    "transactions": transaction_json,
+    "clients": client_json,
+}
+
+def request_fingerprint(body: BaseModel) -> str:
+    payload = json.dumps(body.dict(exclude_unset=True), sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+async def claim_idempotency_key(collection_name: str, key: str, fingerprint: str, resource_id: str) -> Optional[dict]:
+    """Reserva a chave para esta criação; devolve o registro concluído quando é uma repetição"""
+    record_id = f"{collection_name}:{key}"
+    now = datetime.utcnow()
+    locked_until = now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)
+    try:
+        await db.idempotency_keys.insert_one({
+            "_id": record_id, "status": "em_andamento", "hash": fingerprint, "recurso_id": resource_id,
+            "criado_em": now, "bloqueado_ate": locked_until, "expira_em": now + timedelta(seconds=IDEMPOTENCY_TTL),
+        })
+        return None
+    except DuplicateKeyError:
+        record = await db.idempotency_keys.find_one({"_id": record_id})
+    if record is None:
+        # Liberada (a tentativa anterior falhou) entre o insert e a leitura
+        return await claim_idempotency_key(collection_name, key, fingerprint, resource_id)
+    if record["hash"] != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key já usada com outro corpo de requisição")
+    if record["status"] == "concluida":
+        return record
+    if record["bloqueado_ate"] > now:
+        raise HTTPException(status_code=409, detail="Requisição com esta Idempotency-Key em andamento",
+                            headers={"Retry-After": "1"})
+    doc = await db[collection_name].find_one({"id": record["recurso_id"]}, {"_id": 0})
+    if doc is not None:
+        return await complete_idempotency_key(collection_name, key, doc)
+    taken = await db.idempotency_keys.find_one_and_update(
+        {"_id": record_id, "status": "em_andamento", "bloqueado_ate": record["bloqueado_ate"]},
+        {"$set": {"recurso_id": resource_id, "bloqueado_ate": locked_until}},
+    )
+    if taken is None:
+        raise HTTPException(status_code=409, detail="Requisição com esta Idempotency-Key em andamento",
+                            headers={"Retry-After": "1"})
+    return None
+
+async def complete_idempotency_key(collection_name: str, key: str, doc: dict) -> dict:
+    record = {
+        "status": "concluida",
+        "resposta": IDEMPOTENT_RESOURCES[collection_name](doc),
+        "etag": f'"{doc.get("version", 1)}"',
+        "expira_em": datetime.utcnow() + timedelta(seconds=IDEMPOTENCY_TTL),
+    }
+    await db.idempotency_keys.update_one({"_id": f"{collection_name}:{key}"}, {"$set": record})
+    return record
+
+async def insert_idempotent(collection_name: str, idempotency_key: Optional[str], body: BaseModel,
+                            doc: dict, after_writes) -> Optional[JSONResponse]:
+    """Grava o documento criado; com Idempotency-Key repetida, devolve a resposta original"""
+    if idempotency_key is None:
+        await db[collection_name].insert_one(doc)
+        await after_writes([(None, doc)])
+        return None
+    if not idempotency_key or len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key deve ter de 1 a {IDEMPOTENCY_KEY_MAX_LENGTH} caracteres")
+    record = await claim_idempotency_key(collection_name, idempotency_key, request_fingerprint(body), doc["id"])
+    if record is not None:
+        return JSONResponse(record["resposta"], headers={"ETag": record["etag"], "Idempotent-Replayed": "true"})
+    try:
+        await db[collection_name].insert_one(doc)
+    except BaseException:
+        await db.idempotency_keys.delete_one({"_id": f"{collection_name}:{idempotency_key}", "status": "em_andamento"})
+        raise
+    await after_writes([(None, doc)])
+    await complete_idempotency_key(collection_name, idempotency_key, doc)
+    return None
+
+# --- ROTAS DA API ---
+
+@api_router.get("/")
+async def root():
+    return {"message": "Dashboard Financeiro - Ótica API"}
+
+# Routes - Transações
+@api_router.post("/transactions", response_model=Transaction)
+async def create_transaction(
+    transaction: TransactionCreate,
+    idempotency_key: Optional[str] = Header(None),
+    response: Response = None,
+):
+    """Criar nova transação financeira (com Idempotency-Key, repetições devolvem a original)"""
+    transaction_obj, transaction_data = build_transaction_doc(transaction)
+    await ensure_years_open(transaction_data)
+    replay = await insert_idempotent("transactions", idempotency_key, transaction, transaction_data,
+                                     after_transaction_writes)
+    if replay is not None:
+        return replay
+    set_etag(response, transaction_data)
+    return transaction_obj
+
+@api_router.post("/transactions/bulk", response_model=BulkResult)
+async def bulk_transactions(operacoes: List[BulkOperation]):
+    """Criar, atualizar e deletar transações em lote (resultado por item)"""
+    await archive_catalog.refresh()
+    result, changes = await execute_bulk(
+        db.transactions, operacoes, TransactionCreate, TransactionUpdate,
+        build_transaction_doc, prepare_transaction_update,
+        reject=lambda old, new: archive_catalog.closed_year_error(old) or archive_catalog.closed_year_error(new),
+    )
+    await after_transaction_writes(changes)
+    return result
+
+@api_router.get("/transactions", response_model=List[Transaction])
+async def get_transactions(
+    data_inicio: Optional[date] = None, 
+    data_fim: Optional[date] = None, 
+    cliente_nome: Optional[str] = None,
+    skip: int = 0, 
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    q: Optional[str] = None,
+    modo: SearchMode = SearchMode.PREFIXO,
+    ids: Optional[str] = None,
+    response: Response = None,
+):
+    """Listar transações com filtros por data e nome do cliente.
+
+    `q` busca pelo início do nome do cliente (ou por palavra, com modo=tokens),
+    sem diferenciar maiúsculas nem acentos; `cliente_nome` equivale a q com
+    modo=tokens. A paginação por `cursor` (valor de X-Next-Cursor da página
+    anterior) tem custo constante; `skip` continua aceito por compatibilidade.
+    Com `ids=a,b,c`, devolve essas transações (na ordem pedida) e ignora os
+    demais filtros. Anos arquivados são consultados só quando o período os inclui.
+    """
+    if ids is not None:
+        found = await transaction_cache.get_many(parse_ids(ids))
+        transactions_from_db = list(found.values())
+        if FAST_SERIALIZATION:
+            return fast_json_response(Transaction, transactions_from_db)
+        return [Transaction(**transaction_from_db(t)) for t in transactions_from_db]
+
+    query = {}
+    if q:
+        query.update(search_filter("cliente_nome", q, modo))
+    elif cliente_nome:
+        query.update(search_filter("cliente_nome", cliente_nome, SearchMode.TOKENS))
+
+    if data_inicio or data_fim:
+        query["data"] = {}
+        if data_inicio:
+            query["data"]["$gte"] = transaction_date_fields(data_inicio)["data"]
+        if data_fim:
+            query["data"]["$lte"] = transaction_date_fields(data_fim)["data"]
+
+    await archive_catalog.refresh()
+    transactions_from_db, next_cursor = await partitioned_keyset_page(
+        archive_catalog.segments(data_inicio, data_fim), query, "data", DESCENDING,
+        cursor, skip, limit, fast_projection(Transaction),
+    )
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    if FAST_SERIALIZATION:
+        return fast_json_response(Transaction, transactions_from_db, headers)
+    response.headers.update(headers)
+    
+    return [Transaction(**transaction_from_db(t)) for t in transactions_from_db]
+
+@api_router.get("/transactions/{transaction_id}", response_model=Transaction)
+async def get_transaction(transaction_id: str, response: Response = None):
+    """Buscar uma transação pelo id (com ETag da versão)"""
+    transaction = await transaction_cache.get(transaction_id)
+    if transaction is None:
+        raise HTTPException(status_code=404, detail="Transação não encontrada")
+    set_etag(response, transaction)
+    return Transaction(**transaction_from_db(transaction))
+
+@api_router.delete("/transactions/{transaction_id}")
+async def delete_transaction(transaction_id: str, if_match: Optional[str] = Header(None)):
+    """Deletar transação (com If-Match, apenas se a versão não mudou)"""
+    await archive_catalog.refresh()
+    try:
+        deleted_transaction = await find_one_and_delete_versioned(
+            db.transactions, transaction_id, if_match, "Transação não encontrada", archive_catalog.closed_filter()
+        )
+    except HTTPException:
+        await raise_if_archived(transaction_id)
+        raise
+    await after_transaction_writes([(deleted_transaction, None)])
+    return {"message": "Transação deletada com sucesso"}
+
+@api_router.put("/transactions/{transaction_id}", response_model=Transaction)
+async def update_transaction(
+    transaction_id: str,
+    transaction_update: TransactionUpdate,
+    if_match: Optional[str] = Header(None),
+    response: Response = None,
+):
+    """Atualizar transação (com If-Match, apenas se a versão não mudou)"""
+    update_data = prepare_transaction_update(transaction_update)
+    if not update_data:
+        raise HTTPException(status_code=400, detail="Nenhum campo para atualizar")
+    # Nem a transação nem a nova data podem estar num ano arquivado
+    await ensure_years_open(update_data)
+
+    # O documento anterior é necessário para retirar sua contribuição dos rollups;
+    # o novo é exatamente o anterior com a atualização aplicada.
+    try:
+        previous_transaction, updated_transaction = await find_one_and_update_versioned(
+            db.transactions, transaction_id, update_data, if_match, "Transação não encontrada",
+            archive_catalog.closed_filter(),
+        )
+    except HTTPException:
+        await raise_if_archived(transaction_id)
+        raise
+    await after_transaction_writes([(previous_transaction, updated_transaction)])
+
+    set_etag(response, updated_transaction)
+    return Transaction(**transaction_from_db(updated_transaction))
+
+# Routes - Relatórios
+@api_router.get("/reports/monthly")
+async def get_monthly_reports(ano: Optional[int] = None):
+    """Relatório mensal de entradas e saídas (anos arquivados: rollup gravado no arquivamento)"""
+    if not ano:
+        ano = datetime.now().year
+    await archive_catalog.refresh()
+    archived = archive_catalog.archived(ano)
+    if archived:
+        return archived["relatorio_mensal"]
+    return await report_cache.get_or_compute(monthly_cache_key(ano), lambda: compute_monthly_reports(ano))
+
+async def compute_monthly_reports(ano: int):
+    pipeline = [
+        {"$match": {"ano": ano}},
+        {"$group": {
+            "_id": "$mes",
+            "entradas": {"$sum": "$entradas"},
+            "saidas": {"$sum": "$saidas"},
+            "total_transacoes": {"$sum": "$count"}
+        }},
+        {"$match": {"total_transacoes": {"$gt": 0}}},
+        {"$sort": {"_id": 1}}
+    ]
+    result = await db.transaction_rollups.aggregate(pipeline).to_list(12)
+    return monthly_report_rows(ano, result)
+
+def monthly_report_rows(ano: int, items: List[dict]) -> List[dict]:
+    """Linhas do relatório mensal a partir dos totais agrupados por mês"""
+    monthly_data = []
+    for item in items:
+        monthly_data.append({
+            "mes": item["_id"], "ano": ano,
+            "total_entradas": round(item["entradas"], 2),
+            "total_saidas": round(item["saidas"], 2),
+            "faturamento_liquido": round(item["entradas"] - item["saidas"], 2),
+            "transacoes_count": item["total_transacoes"]
+        })
+    return monthly_data
+
+@api_router.get("/reports/series")
+async def get_series(
+    inicio: Optional[date] = None,
+    fim: Optional[date] = None,
+    granularidade: SeriesGranularity = SeriesGranularity.MES,
+    agrupar_por: Optional[SeriesGrouping] = None,
+    comparar: bool = False,
+):
+    """Série de entradas/saídas entre `inicio` e `fim` (padrão: ano corrente até hoje).
+
+    Períodos sem movimento vêm zerados; com `comparar=true` cada ponto traz
+    também o mesmo período do ano anterior.
+    """
+    fim = fim or date.today()
+    inicio = inicio or fim.replace(month=1, day=1)
+    if inicio > fim:
+        raise HTTPException(status_code=400, detail="inicio deve ser anterior ou igual a fim")
+    return await compute_series(inicio, fim, granularidade, agrupar_por, comparar)
+
+@api_router.get("/reports/dashboard")
+async def get_dashboard_data():
+    """Dados principais para o dashboard"""
+    current_date = datetime.now()
+    return await report_cache.get_or_compute(
+        dashboard_cache_key(current_date.year, current_date.month),
+        lambda: compute_dashboard_data(current_date),
+    )
+
+async def compute_dashboard_data(current_date: datetime):
+    pipeline_current = [
+        {"$match": {"ano": current_date.year, "mes": current_date.month}},
+        {"$group": {"_id": None, "entradas": {"$sum": "$entradas"}, "saidas": {"$sum": "$saidas"}}}
+    ]
+    # Inadimplentes vêm do resumo mantido pelas escritas de clientes
+    current_month_data, inadimplentes = await asyncio.gather(
+        db.transaction_rollups.aggregate(pipeline_current).to_list(1),
+        receivables_summary(current_date.date()),
+    )
+    
+    entradas_mes = current_month_data[0]['entradas'] if current_month_data else 0
+    saidas_mes = current_month_data[0]['saidas'] if current_month_data else 0
+    
+    return {
+        "mes_atual": {
+            "entradas": round(entradas_mes, 2), "saidas": round(saidas_mes, 2),
+            "faturamento_liquido": round(entradas_mes - saidas_mes, 2)
+        },
+        "inadimplentes": inadimplentes,
+    }
+
+@api_router.get("/reports/bootstrap")
+async def get_bootstrap_data(ano: Optional[int] = None, limit_transacoes: int = 100, limit_clientes: int = 100):
+    """Todos os dados da primeira tela em uma única resposta (consultas concorrentes)"""
+    await archive_catalog.refresh()
+    (dashboard_data, monthly_data, (transactions, transactions_cursor), (clients, clients_cursor)) = await asyncio.gather(
+        get_dashboard_data(),
+        get_monthly_reports(ano),
+        # Mesma página de GET /transactions: segue para os anos arquivados quando necessário
+        partitioned_keyset_page(archive_catalog.segments(), {}, "data", DESCENDING, None, 0, limit_transacoes),
+        keyset_page(db.clients, {}, "nome", ASCENDING, None, 0, limit_clientes),
+    )
+    return {
+        "dashboard": dashboard_data,
+        "relatorio_mensal": monthly_data,
+        "transacoes": {
+            "itens": [Transaction(**transaction_from_db(t)) for t in transactions],
+            "next_cursor": transactions_cursor,
+        },
+        "clientes": {
+            "itens": [Client(**c) for c in clients],
+            "next_cursor": clients_cursor,
+        },
+    }
+
+@api_router.get("/reports/segments")
+async def get_customer_segments(
+    k: Optional[int] = Query(None, ge=2, le=SEGMENT_MAX_CLUSTERS),
+    response: Response = None,
+):
+    """Perfis dos segmentos de clientes (k-means).
+
+    Sem modelo pronto para o `k` pedido, o ajuste é iniciado em segundo plano e
+    a resposta é 202; basta consultar de novo.
+    """
+    k = k or segmentation.requested_k
+    model = segmentation.model
+    if model is None or model.k != k and len(model.members) > model.k:
+        segmentation.schedule_fit(k)
+        response.status_code = 202
+        return segmentation.status()
+    return {**segmentation.status(), "segmentos": model.profiles()}
+
+@api_router.post("/reports/segments/refit", status_code=202)
+async def refit_customer_segments(k: Optional[int] = Query(None, ge=2, le=SEGMENT_MAX_CLUSTERS)):
+    """Força um novo ajuste da segmentação em segundo plano"""
+    segmentation.schedule_fit(k)
+    return segmentation.status()
+
+@api_router.get("/reports/receivables")
+async def get_receivables():
+    """Inadimplentes: quantidade, valor devido e faixas de atraso pelo último pagamento"""
+    return await receivables_summary()
+
+# Routes - Clientes
+@api_router.post("/clients", response_model=Client)
+async def create_client(
+    client: ClientCreate,
+    idempotency_key: Optional[str] = Header(None),
+    response: Response = None,
+):
+    """Criar novo cliente (com Idempotency-Key, repetições devolvem o original)"""
+    client_obj, client_data = build_client_doc(client)
+    replay = await insert_idempotent("clients", idempotency_key, client, client_data, after_client_writes)
+    if replay is not None:
+        return replay
+    set_etag(response, client_data)
+    return client_obj
+
+@api_router.get("/clients", response_model=List[Client])
+async def get_clients(
+    skip: int = 0,
+    limit: int = 100,
+    status: Optional[ClientStatus] = None,
+    cursor: Optional[str] = None,
+    q: Optional[str] = None,
+    modo: SearchMode = SearchMode.PREFIXO,
+    nome: Optional[str] = None,
+    ordenar: ClientSort = ClientSort.NOME,
+    ids: Optional[str] = None,
+    response: Response = None,
+):
+    """Listar clientes (paginação por `cursor` ou, por compatibilidade, `skip`).
+
+    `q` busca pelo início do nome (ou por palavra, com modo=tokens), sem
+    diferenciar maiúsculas nem acentos; `nome`, enviado pelo frontend, equivale
+    a q com modo=tokens. `ordenar=valor` lista dos que mais gastaram para os
+    que menos gastaram; `ordenar=ultima_compra`, pela compra mais recente.
+    Com `ids=a,b,c`, devolve esses clientes (na ordem pedida) e ignora os
+    demais filtros.
+    """
+    if ids is not None:
+        found = await client_cache.get_many(parse_ids(ids))
+        clients_from_db = list(found.values())
+        if FAST_SERIALIZATION:
+            return fast_json_response(Client, clients_from_db)
+        return [client_from_db(c) for c in clients_from_db]
+
+    query = {}
+    if status:
+        query["status"] = status
+    if q:
+        query.update(search_filter("nome", q, modo))
+    elif nome:
+        query.update(search_filter("nome", nome, SearchMode.TOKENS))
+    sort_field, sort_direction = CLIENT_SORTS[ordenar]
+    clients_from_db, next_cursor = await keyset_page(
+        db.clients, query, sort_field, sort_direction, cursor, skip, limit, fast_projection(Client)
+    )
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    if FAST_SERIALIZATION:
+        return fast_json_response(Client, clients_from_db, headers)
+    response.headers.update(headers)
+    return [client_from_db(c) for c in clients_from_db]
+
+@api_router.get("/clients/{client_id}/transactions", response_model=List[Transaction])
+async def get_client_transactions(
+    client_id: str,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    response: Response = None,
+):
+    """Histórico de transações do cliente, da mais recente para a mais antiga (paginação por `cursor`)"""
+    if not await db.clients.find_one({"id": client_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Cliente não encontrado")
+    await archive_catalog.refresh()
+    transactions_from_db, next_cursor = await partitioned_keyset_page(
+        archive_catalog.segments(), {"cliente_id": client_id}, "data", DESCENDING, cursor, skip, limit,
+        fast_projection(Transaction),
+    )
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    if FAST_SERIALIZATION:
+        return fast_json_response(Transaction, transactions_from_db, headers)
+    response.headers.update(headers)
+    return [Transaction(**transaction_from_db(t)) for t in transactions_from_db]
+
+@api_router.post("/clients/bulk", response_model=BulkResult)
+async def bulk_clients(operacoes: List[BulkOperation]):
+    """Criar, atualizar e deletar clientes em lote (resultado por item)"""
+    result, changes = await execute_bulk(
+        db.clients, operacoes, ClientCreate, ClientUpdate, build_client_doc, prepare_client_update,
+    )
+    await after_client_writes(changes)
+    return result
+
+@api_router.get("/clients/{client_id}", response_model=Client)
+async def get_client(client_id: str, response: Response = None):
+    """Buscar um cliente pelo id (com ETag da versão)"""
+    client_doc = await client_cache.get(client_id)
+    if client_doc is None:
+        raise HTTPException(status_code=404, detail="Cliente não encontrado")
+    set_etag(response, client_doc)
+    return client_from_db(client_doc)
+
+@api_router.get("/clients/{client_id}/segment")
+async def get_client_segment(client_id: str):
+    """Segmento atribuído ao cliente pelo modelo atual"""
+    segmento = segmentation.model.segment_of(client_id) if segmentation.model else None
+    if segmento is None:
+        raise HTTPException(status_code=404, detail="Cliente sem segmento atribuído")
+    return {"cliente_id": client_id, "segmento": segmento}
+
+@api_router.put("/clients/{client_id}", response_model=Client)
+async def update_client(
+    client_id: str,
+    client_update: ClientUpdate,
+    if_match: Optional[str] = Header(None),
+    response: Response = None,
+):
+    """Atualizar cliente (com If-Match, apenas se a versão não mudou)"""
+    update_data = prepare_client_update(client_update)
+    if not update_data:
+        raise HTTPException(status_code=400, detail="Nenhum campo para atualizar")
+        
+    previous_client, updated_client = await find_one_and_update_versioned(
+        db.clients, client_id, update_data, if_match, "Cliente não encontrado"
+    )
+    await after_client_writes([(previous_client, updated_client)])
+
+    set_etag(response, updated_client)
+    return client_from_db(updated_client)
+
+@api_router.delete("/clients/{client_id}")
+async def delete_client(client_id: str, if_match: Optional[str] = Header(None)):
+    """Deletar cliente (com If-Match, apenas se a versão não mudou)"""
+    deleted_client = await find_one_and_delete_versioned(db.clients, client_id, if_match, "Cliente não encontrado")
+    await after_client_writes([(deleted_client, None)])
+    return {"message": "Cliente deletado com sucesso"}
+
+# Routes - Exportação de dados
+@api_router.get("/export/transactions")
+async def export_transactions(formato: ExportFormat = Query(ExportFormat.JSON, alias="format")):
+    """Exportar todas as transações (JSON, NDJSON ou CSV) em streaming"""
+    _, cursor, _, _, _ = await export_source(ExportResource.TRANSACOES)
+    return export_response(cursor, Transaction, transaction_from_db, formato, "transacoes")
+
+@api_router.get("/export/clients")
+async def export_clients(formato: ExportFormat = Query(ExportFormat.JSON, alias="format")):
+    """Exportar todos os clientes (JSON, NDJSON ou CSV) em streaming"""
+    cursor = db.clients.find({}, fast_projection(Client)).sort("nome", 1)
+    return export_response(cursor, Client, lambda c: c, formato, "clientes")
+
+@api_router.get("/export/dashboard")
+async def export_dashboard_data():
+    """Exportar dados completos do dashboard"""
+    client_stats_pipeline = [
+        {"$group": {
+            "_id": "$tipo_compra", "count": {"$sum": 1},
+            "valor_total_devido": {"$sum": "$valor_devido"},
+            "idade_media": {"$avg": "$idade"}, "renda_media": {"$avg": "$renda_bruta"}
+        }}
+    ]
+    dashboard_data, monthly_data, client_stats = await asyncio.gather(
+        get_dashboard_data(),
+        get_monthly_reports(),
+        db.clients.aggregate(client_stats_pipeline).to_list(None),
+    )
+    return {
+        "dashboard": dashboard_data, "relatorio_mensal": monthly_data,
+        "estatisticas_clientes": client_stats,
+        "export_timestamp": datetime.utcnow().isoformat()
+    }
+
+@api_router.post("/export/jobs", response_model=ExportJob, status_code=202)
+async def create_export_job(job: ExportJobCreate):
+    """Enfileira uma exportação em arquivo (CSV, XLSX, JSON ou NDJSON)"""
+    return await export_jobs.submit(job)
+
+@api_router.get("/export/jobs", response_model=List[ExportJob])
+async def list_export_jobs():
+    """Jobs de exportação ainda disponíveis, do mais recente para o mais antigo"""
+    return await export_jobs.list_jobs()
+
+@api_router.get("/export/jobs/{job_id}", response_model=ExportJob)
+async def get_export_job(job_id: str):
+    """Situação e progresso de um job de exportação"""
+    return await export_jobs.get(job_id)
+
+@api_router.get("/export/jobs/{job_id}/download")
+async def download_export_job(job_id: str, request: Request):
+    """Baixa o arquivo de um job concluído; aceita Range para retomar o download"""
+    job = await export_jobs.get(job_id)
+    if job.status != ExportJobStatus.CONCLUIDO:
+        raise HTTPException(status_code=409, detail=f"Job de exportação {job.status.value}")
+
+    size = job.tamanho_bytes
+    etag = f'"{job.id}-{size}"'
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Content-Disposition": f'attachment; filename="{job.recurso.value}.{job.formato.value}"',
+    }
+    if_range = request.headers.get("if-range")
+    byte_range = parse_range(request.headers.get("range"), size) if not if_range or if_range == etag else None
+    start, end = byte_range or (0, size - 1)
+    headers["Content-Length"] = str(end - start + 1)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return StreamingResponse(
+        read_file_range(export_jobs.path(job), start, end),
+        status_code=206 if byte_range else 200,
+        media_type=EXPORT_JOB_MEDIA_TYPES[job.formato],
+        headers=headers,
+    )
+
+@api_router.delete("/export/jobs/{job_id}")
+async def delete_export_job(job_id: str):
+    """Cancela o job (se ainda em andamento) e apaga o arquivo"""
+    await export_jobs.cancel(job_id)
+    return {"message": "Job de exportação removido"}
+
+# Routes - Saúde
+@api_router.get("/health/live")
+async def health_live():
+    """Liveness: o processo responde. Não consulta o Mongo, para que uma queda
+    do banco não faça o orquestrador reiniciar todos os workers."""
+    return {"status": "ok"}
+
+@api_router.get("/health/ready")
+async def health_ready(response: Response):
+    """Readiness: o Mongo responde ao ping dentro de MONGO_HEALTH_TIMEOUT_MS"""
+    mongo = await ping_mongo()
+    if not mongo["ok"]:
+        response.status_code = 503
+    return {"status": "ok" if mongo["ok"] else "indisponivel", "mongo": mongo, "pool": pool_status()}
+
+# Routes - Métricas
+@api_router.get("/metrics")
+async def get_metrics():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Routes - Eventos
+@api_router.get("/events")
+async def stream_events(last_event_id: Optional[str] = Header(None)):
+    """Stream SSE de alterações: transaction.*, client.*, dashboard e resync.
+
+    Eventos de transações e clientes trazem `atual` e/ou `anterior` (o documento
+    antes da alteração, para a interface ajustar totais locais); `dashboard`
+    traz os novos totais. Na reconexão, o navegador envia Last-Event-ID e
+    recebe o que perdeu, ou um `resync` se não estiver mais no histórico.
+    """
+    queue = events.subscribe(last_event_id)
+
+    async def stream():
+        try:
+            yield f"retry: {EVENTS_RETRY_MS}\n\n".encode()
+            while True:
+                try:
+                    frame = await asyncio.wait_for(queue.get(), EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # Comentário SSE: mantém proxies e a conexão vivos
+                    yield b": ping\n\n"
+                    continue
+                if frame is None:
+                    return
+                yield frame
+        finally:
+            events.unsubscribe(queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+# Routes - Administração
+@api_router.get("/admin/indexes")
+async def get_index_report():
+    """Relatório de índices faltantes, não declarados e sem uso"""
+    return await index_report()
+
+@api_router.get("/admin/rollups/verify")
+async def verify_rollups():
+    """Compara os rollups com as transações sem alterar nada"""
+    return await reconcile_rollups(fix=False)
+
+@api_router.post("/admin/rollups/rebuild")
+async def rebuild_rollups():
+    """Corrige as divergências entre rollups e transações"""
+    result = await reconcile_rollups(fix=True)
+    if result["corrigido"]:
+        await report_cache.clear()
+    return result
+
+@api_router.get("/admin/receivables/verify")
+async def verify_receivables():
+    """Compara o resumo de recebíveis com os clientes sem alterar nada"""
+    return await reconcile_receivables(fix=False)
+
+@api_router.post("/admin/receivables/rebuild")
+async def rebuild_receivables():
+    """Reescreve o resumo de recebíveis a partir dos clientes"""
+    result = await reconcile_receivables(fix=True)
+    if result["corrigido"]:
+        await report_cache.invalidate_prefix("dashboard:")
+    return result
+
+@api_router.get("/admin/client-values/verify")
+async def verify_client_values():
+    """Compara total gasto, compras e última compra dos clientes com as transações sem alterar nada"""
+    return await reconcile_client_values(fix=False)
+
+@api_router.post("/admin/client-values/rebuild")
+async def rebuild_client_values():
+    """Recalcula os valores divergentes dos clientes a partir das transações"""
+    return await reconcile_client_values(fix=True)
+
+@api_router.get("/admin/archive")
+async def list_archived_years():
+    """Anos fechados e o estado de cada arquivamento"""
+    years = await archive_catalog.refresh(force=True)
+    return [
+        {**archive_summary(record), "em_execucao": bool(archive_tasks.get(ano) and not archive_tasks[ano].done())}
+        for ano, record in sorted(years.items())
+    ]
+
+@api_router.post("/admin/archive/{ano}", status_code=202)
+async def start_archive(ano: int):
+    """Fecha o ano e move suas transações para transactions_<ano> em segundo plano.
+
+    Também retoma um arquivamento interrompido.
+    """
+    if ano >= date.today().year:
+        raise HTTPException(status_code=400, detail="Apenas anos já encerrados podem ser arquivados")
+    record = (await archive_catalog.refresh(force=True)).get(ano)
+    if record and record["estado"] == "arquivado":
+        raise HTTPException(status_code=409, detail=f"O ano {ano} já está arquivado")
+    started = schedule_archive(ano)
+    return {"ano": ano, "iniciado": started, "aguarda_segundos": ARCHIVE_GRACE_SECONDS if record is None else None}
+
+@api_router.get("/admin/admission")
+async def get_admission_status():
+    """Ocupação e fila de cada limitador do controle de admissão"""
+    return {"habilitado": ADMISSION_ENABLED, **admission.status()}
+
+@api_router.get("/admin/cache")
+async def get_cache_stats():
+    """Contadores do cache de relatórios e dos caches de documentos por id"""
+    return {
+        **report_cache.stats(),
+        "documentos": {"transactions": transaction_cache.stats(), "clients": client_cache.stats()},
+    }
+
+@api_router.delete("/admin/cache")
+async def clear_report_cache():
+    """Esvazia o cache de relatórios e os caches de documentos"""
+    await report_cache.clear()
+    await transaction_cache.clear()
+    await client_cache.clear()
+    return {"message": "Caches esvaziados"}
+
+@api_router.get("/admin/slow-queries")
+async def get_slow_queries():
+    """Consultas mais lentas que SLOW_QUERY_MS, da mais recente para a mais antiga"""
+    return {
+        "ativo": slow_queries.enabled,
+        "limiar_ms": slow_queries.threshold_ms,
+        "capacidade": slow_queries.entries.maxlen,
+        "amostras": slow_queries.samples(),
+    }
+
+@api_router.delete("/admin/slow-queries")
+async def clear_slow_queries():
+    """Esvazia o log de consultas lentas"""
+    slow_queries.clear()
+    return {"message": "Log de consultas lentas esvaziado"}
+
+# Fim das Rotas
+
+app.include_router(api_router)
+
+@app.on_event("startup")
+async def startup_db_client():
+    slow_queries.bind(asyncio.get_running_loop())
+    try:
+        opened = await warm_up_pool()
+        logger.info("Pool do Mongo aquecido com %d conexões", opened)
+    except PyMongoError as e:
+        logger.error("Não foi possível aquecer o pool do Mongo: %s", e)
+    try:
+        await ensure_indexes()
+    except PyMongoError as e:
+        logger.error("Não foi possível garantir os índices na inicialização: %s", e)
+    export_jobs.start()
+    # Migrações rodam em segundo plano, sem bloquear o início da API
+    asyncio.create_task(run_migrations())
+    if RECEIVABLES_RECONCILE_INTERVAL > 0:
+        asyncio.create_task(reconcile_receivables_periodically())
+    if EVENTS_SOURCE == "change_stream":
+        asyncio.create_task(watch_change_streams())
+
+@app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    events.close()
+    await export_jobs.stop()
+    client.close()
+
+# CLI de manutenção: python server.py <comando>
+cli = typer.Typer(help="Comandos de manutenção do banco do Painel Financeiro")
+
+@cli.command("ensure-indexes")
+def cli_ensure_indexes():
+    """Cria os índices declarados em INDEX_SPECS"""
+    asyncio.run(ensure_indexes())
+    typer.echo("Índices garantidos.")
+
+@cli.command("index-report")
+def cli_index_report():
+    """Lista índices faltantes, não declarados e sem uso"""
+    report = asyncio.run(index_report())
+    for collection_name, info in report.items():
+        typer.echo(f"[{collection_name}]")
+        typer.echo(f"  faltando: {', '.join(info['faltando']) or '-'}")
+        typer.echo(f"  não declarados: {', '.join(info['nao_declarados']) or '-'}")
+        typer.echo(f"  sem uso: {', '.join(info['sem_uso']) or '-'}")
+
+@cli.command("migrate")
+def cli_migrate(name: str = typer.Argument(None, help="Migração específica; todas se omitido")):
+    """Executa as migrações de formato de dados"""
+    if name and name not in MIGRATIONS:
+        typer.echo(f"Migração desconhecida: {name}. Disponíveis: {', '.join(MIGRATIONS)}")
+        raise typer.Exit(code=1)
+    async def run():
+        for migration_name in ([name] if name else list(MIGRATIONS)):
+            migrated = await MIGRATIONS[migration_name]()
+            typer.echo(f"{migration_name}: {migrated} documentos atualizados")
+    asyncio.run(run())
+
+@cli.command("rollups")
+def cli_rollups(rebuild: bool = typer.Option(False, "--rebuild", help="Corrige as divergências encontradas")):
+    """Verifica (ou reconstrói) os rollups diários de transações"""
+    result = asyncio.run(reconcile_rollups(fix=rebuild))
+    typer.echo(f"Linhas esperadas: {result['linhas_esperadas']} | armazenadas: {result['linhas_armazenadas']}")
+    for item in result["divergencias"]:
+        typer.echo(f"  {item['dia']} {item['categoria'] or '-'}: esperado {item['esperado']} | armazenado {item['armazenado']}")
+    typer.echo("Divergências corrigidas." if result["corrigido"] else f"{len(result['divergencias'])} divergências.")
+
+@cli.command("receivables")
+def cli_receivables(rebuild: bool = typer.Option(False, "--rebuild", help="Corrige as divergências encontradas")):
+    """Verifica (ou reconstrói) o resumo de recebíveis dos inadimplentes"""
+    result = asyncio.run(reconcile_receivables(fix=rebuild))
+    typer.echo(f"Dias esperados: {result['dias_esperados']} | armazenados: {result['dias_armazenados']}")
+    for item in result["divergencias"]:
+        typer.echo(f"  {item['dia']}: esperado {item['esperado']} | armazenado {item['armazenado']}")
+    typer.echo("Resumo corrigido." if result["corrigido"] else f"{len(result['divergencias'])} divergências.")
+
+@cli.command("client-values")
+def cli_client_values(rebuild: bool = typer.Option(False, "--rebuild", help="Corrige as divergências encontradas")):
+    """Verifica (ou recalcula) total gasto, compras e última compra dos clientes"""
+    result = asyncio.run(reconcile_client_values(fix=rebuild))
+    if result["arquivamento_em_andamento"]:
+        typer.echo("Há um ano em arquivamento; tente de novo quando ele terminar.")
+        raise typer.Exit(code=1)
+    typer.echo(f"Clientes conferidos: {result['clientes']}")
+    for item in result["divergencias"]:
+        typer.echo(f"  {item['cliente_id']}: esperado {item['esperado']} | armazenado {item['armazenado']}")
+    typer.echo("Divergências corrigidas." if result["corrigido"] else f"{len(result['divergencias'])} divergências.")
+
+@cli.command("archive")
+def cli_archive(
+    ano: int = typer.Argument(..., help="Ano encerrado a arquivar"),
+    grace: float = typer.Option(ARCHIVE_GRACE_SECONDS, help="Espera (s) para os workers enxergarem o ano fechado"),
+):
+    """Move as transações de um ano encerrado para a coleção arquivada do ano"""
+    try:
+        record = asyncio.run(archive_year(ano, grace))
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    typer.echo(f"Ano {ano} arquivado em {record['colecao']}: {record['transacoes']} transações.")
+
+@cli.command("bench-serialization")
+def cli_bench_serialization(
+    rows: int = typer.Option(1000, help="Documentos por página"),
+    repeat: int = typer.Option(20, help="Repetições de cada caminho"),
+):
+    """Compara a serialização com modelos Pydantic com a serialização rápida"""
+    from pydantic import TypeAdapter
+
+    categories = list(TransactionCategory)
+    transactions = [{
+        "id": str(uuid.uuid4()), "tipo": "entrada" if i % 3 else "saida",
+        "categoria": categories[i % len(categories)].value, "descricao": f"Venda {i}",
+        "valor": 100 + i * 0.37, "data": datetime(2024, 1 + i % 12, 1 + i % 28),
+        "cliente_nome": f"Cliente {i}", "cliente_id": str(uuid.uuid4()), "observacoes": None,
+        "created_at": datetime(2024, 1, 1, 12, 0, 0, 123000), "version": 1,
+    } for i in range(rows)]
+    clients = [{
+        "id": str(uuid.uuid4()), "nome": f"Cliente {i}", "email": f"cliente{i}@exemplo.com",
+        "telefone": "(11) 99999-0000", "endereco": "Rua A, 1", "status": "adimplente",
+        "valor_devido": 0.0, "data_ultimo_pagamento": "2024-03-01", "estado_civil": "casado",
+        "numero_filhos": i % 4, "escolaridade": "superior", "tem_cartao_credito": bool(i % 2),
+        "renda_bruta": 3500.0 + i, "idade": 20 + i % 50, "frequencia_compra": "regular",
+        "quantidade_compras": i % 10, "tipo_compra": "premium", "origem_cliente": "instagram",
+        "observacoes": None, "created_at": datetime(2024, 1, 1, 12, 0, 0, 123000), "version": 1,
+    } for i in range(rows)]
+
+    def model_path(model, prepare, docs):
+        # O que o FastAPI faz com response_model=List[...]: modelo por documento,
+        # revalidação contra o response_model e serialização JSON
+        adapter = TypeAdapter(List[model])
+        value = adapter.validate_python([model(**prepare(dict(doc))) for doc in docs])
+        return json.dumps(adapter.dump_python(value, mode="json"), **FAST_JSON_OPTIONS).encode("utf-8")
+
+    def fast_path(model, docs):
+        return fast_json_response(model, docs).body
+
+    for name, model, prepare, docs in (("transactions", Transaction, transaction_from_db, transactions),
+                                       ("clients", Client, lambda d: d, clients)):
+        assert model_path(model, prepare, docs) == fast_path(model, docs)
+        timings = {}
+        for label, run in (("modelos", lambda: model_path(model, prepare, docs)), ("rapida", lambda: fast_path(model, docs))):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                run()
+            timings[label] = (time.perf_counter() - start) / repeat * 1000
+        typer.echo(f"{name}: {rows} docs | modelos {timings['modelos']:.2f} ms | rápida {timings['rapida']:.2f} ms "
+                   f"| {timings['modelos'] / timings['rapida']:.1f}x")
+
+if __name__ == "__main__":
+    cli()
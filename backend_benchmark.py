@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+Local load and latency benchmark for the Financial Dashboard API.
+
+Runs the backend/server.py app in-process (httpx ASGI transport, no network
+hop) against a local MongoDB stand-in, seeds realistic volumes and drives
+concurrent load at every route. Results (throughput and p50/p95/p99 latency
+per endpoint) are written as JSON so runs can be diffed before and after a
+performance change.
+
+Examples:
+    # Local mongod, full volumes (1M transactions / 100k clients)
+    python backend_benchmark.py --mongo-url mongodb://localhost:27017 --output bench.json
+
+    # Quick smoke run with the in-memory mongomock stand-in
+    python backend_benchmark.py --mongo mock --transactions 5000 --clients 500 --requests 50
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import warnings
+from collections import Counter
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "backend"))
+warnings.filterwarnings("ignore", category=DeprecationWarning)
+
+import server  # noqa: E402
+
+FIRST_NAMES = ["João", "Maria", "José", "Ana", "Antônio", "Francisca", "Carlos", "Adriana",
+               "Paulo", "Juliana", "Lucas", "Márcia", "Luiz", "Fernanda", "Pedro", "Patrícia"]
+LAST_NAMES = ["Silva", "Santos", "Oliveira", "Souza", "Rodrigues", "Ferreira", "Alves",
+              "Pereira", "Lima", "Gomes", "Costa", "Ribeiro", "Martins", "Carvalho", "Araújo"]
+ENTRADA_CATEGORIES = [c for c in server.TransactionCategory if c.value.startswith(("venda", "servico", "outros_servicos"))]
+SAIDA_CATEGORIES = [c for c in server.TransactionCategory if c not in ENTRADA_CATEGORIES]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Scenario:
+    """One route under load: builds the request for the i-th call"""
+
+    def __init__(self, name: str, method: str, build: Callable[[int], dict],
+                 requests: Optional[int] = None, concurrency: Optional[int] = None):
+        self.name = name
+        self.method = method
+        self.build = build
+        self.requests = requests
+        self.concurrency = concurrency
+
+
+class FinancialDashboardBenchmark:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.transaction_ids: List[str] = []
+        self.client_ids: List[str] = []
+        self.created_transaction_ids: List[str] = []
+        self.created_client_ids: List[str] = []
+        self.cursors: Dict[str, str] = {}
+        self.export_job_ids: List[str] = []
+
+    # ------------------------------------------------------------------ setup
+    def connect(self):
+        """Point the app at the benchmark database"""
+        if self.args.mongo == "mock":
+            from mongomock_motor import AsyncMongoMockClient
+            server.client = AsyncMongoMockClient()
+        else:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            server.client = AsyncIOMotorClient(self.args.mongo_url)
+        server.db = server.client[self.args.db_name]
+        if self.args.no_cache:
+            server.report_cache = server.ReportCache(server.LRUCacheBackend(max_entries=0), ttl=0)
+
+    def random_name(self) -> str:
+        return f"{self.rng.choice(FIRST_NAMES)} {self.rng.choice(LAST_NAMES)} {self.rng.choice(LAST_NAMES)}"
+
+    def random_transaction(self, start: date, days: int) -> server.TransactionCreate:
+        tipo = server.TransactionType.ENTRADA if self.rng.random() < 0.7 else server.TransactionType.SAIDA
+        categories = ENTRADA_CATEGORIES if tipo == server.TransactionType.ENTRADA else SAIDA_CATEGORIES
+        cliente_id = self.rng.choice(self.client_ids) if self.client_ids and tipo == server.TransactionType.ENTRADA else None
+        return server.TransactionCreate(
+            tipo=tipo,
+            categoria=self.rng.choice(categories),
+            descricao="Lançamento de benchmark",
+            valor=round(self.rng.uniform(20, 2500), 2),
+            data=start + timedelta(days=self.rng.randrange(days)),
+            cliente_nome=self.random_name() if cliente_id else None,
+            cliente_id=cliente_id,
+        )
+
+    def random_client(self) -> server.ClientCreate:
+        inadimplente = self.rng.random() < 0.15
+        return server.ClientCreate(
+            nome=self.random_name(),
+            email=f"cliente{self.rng.randrange(10**9)}@exemplo.com",
+            telefone="(11) 90000-0000",
+            status=server.ClientStatus.INADIMPLENTE if inadimplente else server.ClientStatus.ADIMPLENTE,
+            valor_devido=round(self.rng.uniform(50, 3000), 2) if inadimplente else 0.0,
+            data_ultimo_pagamento=date.today() - timedelta(days=self.rng.randrange(365)),
+            estado_civil=self.rng.choice(list(server.EstadoCivil)),
+            numero_filhos=self.rng.randrange(5),
+            escolaridade=self.rng.choice(list(server.Escolaridade)),
+            tem_cartao_credito=self.rng.random() < 0.6,
+            renda_bruta=round(self.rng.uniform(1500, 25000), 2),
+            idade=self.rng.randrange(18, 85),
+            frequencia_compra=self.rng.choice(list(server.FrequenciaCompra)),
+            quantidade_compras=self.rng.randrange(30),
+            tipo_compra=self.rng.choice(list(server.TipoCompra)),
+            origem_cliente=self.rng.choice(list(server.OrigemCliente)),
+        )
+
+    async def seed_collection(self, collection, total: int, make_doc: Callable[[], dict], ids: List[str]):
+        batch_size = self.args.seed_batch
+        for offset in range(0, total, batch_size):
+            docs = [make_doc() for _ in range(min(batch_size, total - offset))]
+            ids.extend(doc["id"] for doc in docs)
+            await collection.insert_many(docs, ordered=False)
+            self.log(f"  {collection.name}: {offset + len(docs)}/{total}")
+
+    async def seed(self) -> dict:
+        """Drop the benchmark database and seed clients, transactions and derived data"""
+        await server.client.drop_database(self.args.db_name)
+        started = time.perf_counter()
+        start_day = date.today().replace(month=1, day=1) - timedelta(days=365 * (self.args.years - 1))
+        days = (date.today() - start_day).days + 1
+
+        await self.seed_collection(server.db.clients, self.args.clients,
+                                   lambda: server.build_client_doc(self.random_client())[1], self.client_ids)
+        await self.seed_collection(server.db.transactions, self.args.transactions,
+                                   lambda: server.build_transaction_doc(self.random_transaction(start_day, days))[1],
+                                   self.transaction_ids)
+        self.log("  índices e dados derivados...")
+        await server.ensure_indexes()
+        for name, migration in server.MIGRATIONS.items():
+            await migration()
+        await server.reconcile_rollups(fix=True)
+        if self.args.mongo == "mock":
+            # mongomock's $max cannot compare a date with null (the real server
+            # orders by BSON type); a missing field reads the same as null
+            await server.db.clients.update_many({"ultima_compra": None}, {"$unset": {"ultima_compra": ""}})
+        return {
+            "transactions": self.args.transactions,
+            "clients": self.args.clients,
+            "years": self.args.years,
+            "seconds": round(time.perf_counter() - started, 2),
+        }
+
+    # --------------------------------------------------------------- scenarios
+    def scenarios(self) -> List[Scenario]:
+        rng = self.rng
+        year = date.today().year
+        heavy = {"requests": self.args.heavy_requests, "concurrency": min(2, self.args.concurrency)}
+
+        def pick(ids: List[str]) -> str:
+            return rng.choice(ids)
+
+        def next_created(ids: List[str]) -> str:
+            return ids.pop() if ids else "inexistente"
+
+        def sample(ids: List[str], size: int = 20) -> str:
+            return ",".join(rng.sample(ids, min(size, len(ids))))
+
+        return [
+            Scenario("GET /api/", "GET", lambda i: {"url": "/"}),
+            Scenario("GET /api/health/live", "GET", lambda i: {"url": "/health/live"}),
+            Scenario("GET /api/health/ready", "GET", lambda i: {"url": "/health/ready"}),
+            Scenario("GET /api/metrics", "GET", lambda i: {"url": "/metrics"}),
+            Scenario("GET /api/transactions", "GET", lambda i: {"url": "/transactions"}),
+            Scenario("GET /api/transactions (deep cursor)", "GET",
+                     lambda i: {"url": "/transactions", "params": {"cursor": self.cursors.get("transactions", "")}}),
+            Scenario("GET /api/transactions (deep skip)", "GET",
+                     lambda i: {"url": "/transactions", "params": {"skip": self.args.deep_skip}}),
+            Scenario("GET /api/transactions?q=", "GET",
+                     lambda i: {"url": "/transactions", "params": {"q": rng.choice(FIRST_NAMES)[:3]}}),
+            Scenario("GET /api/transactions?data_inicio&data_fim", "GET",
+                     lambda i: {"url": "/transactions", "params": {"data_inicio": f"{year}-01-01", "data_fim": f"{year}-03-31"}}),
+            Scenario("GET /api/transactions/{id}", "GET", lambda i: {"url": f"/transactions/{pick(self.transaction_ids)}"}),
+            Scenario("GET /api/transactions?ids=", "GET",
+                     lambda i: {"url": "/transactions", "params": {"ids": sample(self.transaction_ids)}}),
+            Scenario("GET /api/clients", "GET", lambda i: {"url": "/clients"}),
+            Scenario("GET /api/clients/{id}", "GET", lambda i: {"url": f"/clients/{pick(self.client_ids)}"}),
+            Scenario("GET /api/clients?ids=", "GET",
+                     lambda i: {"url": "/clients", "params": {"ids": sample(self.client_ids)}}),
+            Scenario("GET /api/clients/{id}/transactions", "GET",
+                     lambda i: {"url": f"/clients/{pick(self.client_ids)}/transactions"}),
+            Scenario("GET /api/clients?status=inadimplente", "GET",
+                     lambda i: {"url": "/clients", "params": {"status": "inadimplente"}}),
+            Scenario("GET /api/clients?q=", "GET",
+                     lambda i: {"url": "/clients", "params": {"q": rng.choice(LAST_NAMES), "modo": "tokens"}}),
+            Scenario("GET /api/reports/dashboard", "GET", lambda i: {"url": "/reports/dashboard"}),
+            Scenario("GET /api/reports/monthly", "GET",
+                     lambda i: {"url": "/reports/monthly", "params": {"ano": year - rng.randrange(self.args.years)}}),
+            Scenario("GET /api/reports/bootstrap", "GET", lambda i: {"url": "/reports/bootstrap"}),
+            Scenario("GET /api/reports/series?granularidade=month&comparar", "GET",
+                     lambda i: {"url": "/reports/series", "params": {"granularidade": "month", "comparar": "true"}}),
+            Scenario("GET /api/reports/series?granularidade=week&agrupar_por=categoria", "GET", lambda i: {
+                "url": "/reports/series",
+                "params": {"inicio": f"{year - 1}-01-01", "granularidade": "week", "agrupar_por": "categoria"},
+            }),
+            Scenario("GET /api/reports/receivables", "GET", lambda i: {"url": "/reports/receivables"}),
+            Scenario("GET /api/reports/segments", "GET", lambda i: {"url": "/reports/segments"}),
+            Scenario("GET /api/clients/{id}/segment", "GET", lambda i: {"url": f"/clients/{pick(self.client_ids)}/segment"}),
+            Scenario("GET /api/export/dashboard", "GET", lambda i: {"url": "/export/dashboard"}),
+            Scenario("POST /api/transactions", "POST", lambda i: {
+                "url": "/transactions",
+                "json": self.random_transaction(date.today().replace(day=1), 28).model_dump(mode="json", exclude_none=True),
+            }),
+            Scenario("PUT /api/transactions/{id}", "PUT",
+                     lambda i: {"url": f"/transactions/{pick(self.transaction_ids)}", "json": {"valor": round(rng.uniform(20, 2500), 2)}}),
+            Scenario("DELETE /api/transactions/{id}", "DELETE",
+                     lambda i: {"url": f"/transactions/{next_created(self.created_transaction_ids)}"}),
+            Scenario("POST /api/transactions/bulk", "POST", lambda i: {
+                "url": "/transactions/bulk",
+                "json": [{"op": "create", "dados": self.random_transaction(date.today().replace(day=1), 28).model_dump(mode="json", exclude_none=True)}
+                         for _ in range(self.args.bulk_size)],
+            }),
+            Scenario("POST /api/clients", "POST",
+                     lambda i: {"url": "/clients", "json": self.random_client().model_dump(mode="json", exclude_none=True)}),
+            Scenario("PUT /api/clients/{id}", "PUT",
+                     lambda i: {"url": f"/clients/{pick(self.client_ids)}", "json": {"telefone": "(11) 91111-2222"}}),
+            Scenario("DELETE /api/clients/{id}", "DELETE",
+                     lambda i: {"url": f"/clients/{next_created(self.created_client_ids)}"}),
+            Scenario("POST /api/clients/bulk", "POST", lambda i: {
+                "url": "/clients/bulk",
+                "json": [{"op": "create", "dados": self.random_client().model_dump(mode="json", exclude_none=True)}
+                         for _ in range(self.args.bulk_size - 1)]
+                        + [{"op": "update", "id": pick(self.client_ids), "dados": {"telefone": "(11) 93333-4444"}}],
+            }),
+            Scenario("GET /api/export/transactions?format=ndjson", "GET",
+                     lambda i: {"url": "/export/transactions", "params": {"format": "ndjson"}}, **heavy),
+            Scenario("GET /api/export/clients?format=csv", "GET",
+                     lambda i: {"url": "/export/clients", "params": {"format": "csv"}}, **heavy),
+            Scenario("POST /api/export/jobs", "POST", lambda i: {
+                "url": "/export/jobs", "json": {"recurso": rng.choice(["transactions", "clients"]), "formato": "csv"},
+            }, **heavy),
+            Scenario("GET /api/export/jobs/{id}", "GET",
+                     lambda i: {"url": f"/export/jobs/{pick(self.export_job_ids or ['inexistente'])}"}),
+            Scenario("GET /api/export/jobs/{id}/download", "GET",
+                     lambda i: {"url": f"/export/jobs/{pick(self.export_job_ids or ['inexistente'])}/download"}),
+        ]
+
+    async def prepare_cursors(self, http: httpx.AsyncClient):
+        """Walk to a deep page once so the cursor scenario starts past deep_skip items"""
+        params = {"limit": self.args.deep_skip}
+        response = await http.get("/transactions", params=params)
+        self.cursors["transactions"] = response.headers.get("x-next-cursor", "")
+
+    async def prepare_segments(self):
+        """Fit the customer segmentation up front so the segment routes measure the served model"""
+        await server.segmentation.fit(server.segmentation.requested_k)
+
+    async def wait_export_jobs(self, http: httpx.AsyncClient):
+        """Let the submitted export jobs finish so status/download measure finished jobs"""
+        while True:
+            jobs = (await http.get("/export/jobs")).json()
+            if all(job["status"] not in ("pendente", "executando") for job in jobs):
+                return
+            await asyncio.sleep(0.2)
+
+    # ------------------------------------------------------------------- load
+    async def run_scenario(self, http: httpx.AsyncClient, scenario: Scenario) -> dict:
+        total = scenario.requests or self.args.requests
+        concurrency = scenario.concurrency or self.args.concurrency
+        latencies: List[float] = []
+        statuses: Counter = Counter()
+        counter = iter(range(total))
+
+        async def worker():
+            for i in counter:
+                request = scenario.build(i)
+                started = time.perf_counter()
+                try:
+                    response = await http.request(scenario.method, request["url"],
+                                                  params=request.get("params"), json=request.get("json"))
+                    statuses[response.status_code] += 1
+                    if scenario.method == "POST" and response.status_code == 200 and request["url"] == "/transactions":
+                        self.created_transaction_ids.append(response.json()["id"])
+                    if scenario.method == "POST" and response.status_code == 200 and request["url"] == "/clients":
+                        self.created_client_ids.append(response.json()["id"])
+                    if scenario.method == "POST" and response.status_code == 202 and request["url"] == "/export/jobs":
+                        self.export_job_ids.append(response.json()["id"])
+                except Exception as e:  # noqa: BLE001 - contabilizado como erro do cenário
+                    statuses[type(e).__name__] += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        errors = sum(count for status, count in statuses.items() if not (isinstance(status, int) and status < 400))
+        return {
+            "requests": total,
+            "concurrency": concurrency,
+            "errors": errors,
+            "statuses": {str(status): count for status, count in statuses.items()},
+            "throughput_rps": round(total / elapsed, 2) if elapsed else None,
+            "mean_ms": round(statistics.fmean(latencies), 3) if latencies else None,
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "max_ms": round(latencies[-1], 3) if latencies else None,
+        }
+
+    async def run(self) -> dict:
+        self.connect()
+        report = {
+            "started_at": datetime.utcnow().isoformat(),
+            "config": {key: value for key, value in vars(self.args).items() if key != "output"},
+        }
+        if self.args.skip_seed:
+            self.log("📦 Reusing existing data")
+            self.transaction_ids = [d["id"] async for d in server.db.transactions.find({}, {"id": 1}).limit(10000)]
+            self.client_ids = [d["id"] async for d in server.db.clients.find({}, {"id": 1}).limit(10000)]
+        else:
+            self.log(f"📦 Seeding {self.args.transactions} transactions / {self.args.clients} clients...")
+            report["seed"] = await self.seed()
+
+        only = set(self.args.only or [])
+        results = {}
+        # ASGITransport does not run the startup hooks
+        server.export_jobs.start()
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark/api", timeout=None) as http:
+            await self.prepare_cursors(http)
+            await self.prepare_segments()
+            for scenario in self.scenarios():
+                if only and not any(term in scenario.name for term in only):
+                    continue
+                if scenario.name.startswith("GET /api/export/jobs/"):
+                    await self.wait_export_jobs(http)
+                self.log(f"🔍 {scenario.name}")
+                results[scenario.name] = await self.run_scenario(http, scenario)
+                self.log(f"   p50 {results[scenario.name]['p50_ms']} ms | p99 {results[scenario.name]['p99_ms']} ms "
+                         f"| {results[scenario.name]['throughput_rps']} req/s")
+        report["results"] = results
+        await server.export_jobs.stop()
+
+        if not self.args.keep_data:
+            await server.client.drop_database(self.args.db_name)
+        return report
+
+    @staticmethod
+    def log(message: str):
+        print(message, file=sys.stderr, flush=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local load/latency benchmark for the Financial Dashboard API")
+    parser.add_argument("--mongo", choices=["server", "mock"], default="server",
+                        help="'server': local mongod at --mongo-url; 'mock': in-memory mongomock_motor")
+    parser.add_argument("--mongo-url", default=os.getenv("BENCH_MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default=os.getenv("BENCH_DB_NAME", "benchmark_painel_financeiro"))
+    parser.add_argument("--transactions", type=int, default=1_000_000)
+    parser.add_argument("--clients", type=int, default=100_000)
+    parser.add_argument("--years", type=int, default=3, help="Years of history spread over the seeded transactions")
+    parser.add_argument("--seed-batch", type=int, default=10_000)
+    parser.add_argument("--requests", type=int, default=500, help="Requests per route")
+    parser.add_argument("--heavy-requests", type=int, default=3, help="Requests per full-export route")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--bulk-size", type=int, default=100)
+    parser.add_argument("--deep-skip", type=int, default=5000, help="Depth used by the deep pagination scenarios")
+    parser.add_argument("--only", nargs="*", help="Run only scenarios whose name contains one of these terms")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the report cache")
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse data from a previous --keep-data run")
+    parser.add_argument("--keep-data", action="store_true", help="Do not drop the benchmark database at the end")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main():
+    """Main benchmark execution"""
+    args = parse_args()
+    report = asyncio.run(FinancialDashboardBenchmark(args).run())
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+        print(f"📊 Report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
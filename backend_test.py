@@ -324,19 +324,18 @@ class FinancialDashboardTester:
         """Clean up any remaining test data"""
         cleanup_count = 0
         
-        # Clean up transactions
-        for trans_id in self.created_items['transactions'][:]:
-            success, _ = self.make_request('DELETE', f'transactions/{trans_id}')
+        # One bulk request per collection instead of one DELETE per item
+        for kind in ('transactions', 'clients'):
+            ids = self.created_items[kind]
+            if not ids:
+                continue
+            operations = [{'op': 'delete', 'id': item_id} for item_id in ids]
+            success, response = self.make_request('POST', f'{kind}/bulk', operations)
             if success:
-                cleanup_count += 1
-                self.created_items['transactions'].remove(trans_id)
-
-        # Clean up clients
-        for client_id in self.created_items['clients'][:]:
-            success, _ = self.make_request('DELETE', f'clients/{client_id}')
-            if success:
-                cleanup_count += 1
-                self.created_items['clients'].remove(client_id)
+                for result in response.get('resultados', []):
+                    if result.get('sucesso'):
+                        cleanup_count += 1
+                        ids.remove(result['id'])
 
         if cleanup_count > 0:
             print(f"🧹 Cleaned up {cleanup_count} test items")
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import './App.css';
 import axios from 'axios';
 import { 
@@ -137,14 +137,26 @@ function App() {
     }
   };
 
-  // Carregar dados
+  // Carregar dados: a primeira tela vem inteira de /reports/bootstrap
   useEffect(() => {
-    loadDashboardData();
-    loadMonthlyReports();
-    loadTransactions(); // Carrega todas as transações (sem limite)
-    loadClients(); // Carrega todos os clientes
+    loadBootstrap();
   }, []);
 
+  const loadBootstrap = async () => {
+    try {
+      const currentYear = new Date().getFullYear();
+      const response = await axios.get(`${API}/reports/bootstrap?ano=${currentYear}`);
+      setDashboardData(response.data.dashboard);
+      setMonthlyData(fillMonthlyData(response.data.relatorio_mensal));
+      setTransactions(response.data.transacoes.itens);
+      setClients(response.data.clientes.itens);
+    } catch (error) {
+      console.error('Erro ao carregar dados iniciais:', error);
+    } finally {
+      setLoading(false);
+    }
+  };
+
   const loadDashboardData = async () => {
     try {
       const response = await axios.get(`${API}/reports/dashboard`);
@@ -154,31 +166,34 @@ function App() {
     }
   };
 
+  // Preencher meses vazios
+  const fillMonthlyData = (rows) => {
+    const monthNames = [
+      'Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun',
+      'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez'
+    ];
+    return monthNames.map((name, index) => {
+      const month = index + 1;
+      const existing = rows.find(item => item.mes === month);
+      return existing ? {
+        ...existing,
+        nome_mes: name
+      } : {
+        mes: month,
+        nome_mes: name,
+        total_entradas: 0,
+        total_saidas: 0,
+        faturamento_liquido: 0,
+        transacoes_count: 0
+      };
+    });
+  };
+
   const loadMonthlyReports = async () => {
     try {
       const currentYear = new Date().getFullYear();
       const response = await axios.get(`${API}/reports/monthly?ano=${currentYear}`);
-      // Preencher meses vazios
-      const monthNames = [
-        'Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun',
-        'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez'
-      ];
-      const completeData = monthNames.map((name, index) => {
-        const month = index + 1;
-        const existing = response.data.find(item => item.mes === month);
-        return existing ? {
-          ...existing,
-          nome_mes: name
-        } : {
-          mes: month,
-          nome_mes: name,
-          total_entradas: 0,
-          total_saidas: 0,
-          faturamento_liquido: 0,
-          transacoes_count: 0
-        };
-      });
-      setMonthlyData(completeData);
+      setMonthlyData(fillMonthlyData(response.data));
     } catch (error) {
       console.error('Erro ao carregar relatórios mensais:', error);
     }
@@ -214,6 +229,88 @@ function App() {
     }
   };
 
+  // Alterações de outros usuários chegam por /api/events (SSE) e são aplicadas
+  // localmente. As escritas do próprio usuário recarregam os dados em seguida,
+  // porque o evento pode sair de outro worker e nunca chegar a este stream; o
+  // eco delas no stream é ignorado para não contar a mesma alteração duas vezes.
+  // Numa criação o id só vem na resposta do POST, e o eco pode chegar antes dela:
+  // enquanto há criação própria em andamento, os eventos *.created esperam
+  const ownWrites = useRef(new Set());
+  const pendingCreates = useRef(0);
+  const heldCreates = useRef([]);
+  const latest = useRef({});
+  latest.current = { loadBootstrap, loadTransactions, loadClients, loadMonthlyReports, filtroCliente, filtroDataInicio, filtroDataFim, filtroNomeCliente };
+
+  useEffect(() => {
+    const source = new EventSource(`${API}/events`);
+    const on = (type, handler) => source.addEventListener(type, (event) => {
+      const payload = JSON.parse(event.data);
+      if (type.endsWith('.created') && pendingCreates.current > 0) heldCreates.current.push(() => handler(payload));
+      else handler(payload);
+    });
+    const upsert = (list, doc) => list.some(item => item.id === doc.id)
+      ? list.map(item => item.id === doc.id ? doc : item)
+      : [doc, ...list];
+    const applyMonthly = (anterior, atual) => {
+      const currentYear = new Date().getFullYear();
+      setMonthlyData(prev => prev.map(row => {
+        let { total_entradas, total_saidas, transacoes_count } = row;
+        [[anterior, -1], [atual, 1]].forEach(([doc, sign]) => {
+          if (!doc || !doc.data) return;
+          const [ano, mes] = doc.data.split('-').map(Number);
+          if (ano !== currentYear || mes !== row.mes) return;
+          if (doc.tipo === 'entrada') total_entradas += sign * doc.valor;
+          else total_saidas += sign * doc.valor;
+          transacoes_count += sign;
+        });
+        return { ...row, total_entradas, total_saidas, transacoes_count, faturamento_liquido: total_entradas - total_saidas };
+      }));
+    };
+    // Só os eventos *.deleted trazem `id`; os demais trazem o documento
+    const onTransaction = ({ atual, anterior, id = (atual || anterior).id }) => {
+      if (ownWrites.current.delete(id)) return;
+      const { filtroCliente, filtroDataInicio, filtroDataFim, loadTransactions, loadMonthlyReports } = latest.current;
+      if (filtroCliente || filtroDataInicio || filtroDataFim) loadTransactions();
+      else if (atual) setTransactions(prev => upsert(prev, atual));
+      else setTransactions(prev => prev.filter(item => item.id !== id));
+      // Sem o documento anterior (change streams sem pre-image) não há como ajustar o relatório
+      if (atual && anterior === null) loadMonthlyReports();
+      else applyMonthly(anterior, atual);
+    };
+    const onClient = ({ atual, anterior, id = (atual || anterior).id }) => {
+      if (ownWrites.current.delete(id)) return;
+      const { filtroNomeCliente, loadClients } = latest.current;
+      if (filtroNomeCliente) loadClients();
+      else if (atual) setClients(prev => upsert(prev, atual));
+      else setClients(prev => prev.filter(item => item.id !== id));
+    };
+
+    ['transaction.created', 'transaction.updated', 'transaction.deleted'].forEach(type => on(type, onTransaction));
+    ['client.created', 'client.updated', 'client.deleted'].forEach(type => on(type, onClient));
+    on('dashboard', setDashboardData);
+    on('resync', () => latest.current.loadBootstrap());
+    return () => source.close();
+  }, []);
+
+  const trackOwnWrite = (id) => {
+    ownWrites.current.add(id);
+    // Sem o eco (evento publicado em outro worker), a marca expira sozinha
+    setTimeout(() => ownWrites.current.delete(id), 30000);
+  };
+
+  const createOwn = async (url, data) => {
+    pendingCreates.current += 1;
+    try {
+      const response = await axios.post(url, data);
+      trackOwnWrite(response.data.id);
+      return response;
+    } finally {
+      // Com o id registrado, os eventos retidos passam pela supressão normal
+      pendingCreates.current -= 1;
+      if (pendingCreates.current === 0) heldCreates.current.splice(0).forEach(replay => replay());
+    }
+  };
+
   const handleTransactionSubmit = async (e) => {
     e.preventDefault();
     try {
@@ -222,11 +319,12 @@ function App() {
         valor: parseFloat(transactionForm.valor)
       };
       if (editingTransaction) {
+        trackOwnWrite(editingTransaction.id);
         await axios.put(`${API}/transactions/${editingTransaction.id}`, formData);
         setEditingTransaction(null);
         alert('Transação atualizada com sucesso!');
       } else {
-        await axios.post(`${API}/transactions`, formData);
+        await createOwn(`${API}/transactions`, formData);
         alert('Transação adicionada com sucesso!');
       }
       // Limpar formulário
@@ -271,11 +369,12 @@ function App() {
       };
 
       if (editingClient) {
+        trackOwnWrite(editingClient.id);
         await axios.put(`${API}/clients/${editingClient.id}`, formData);
         setEditingClient(null);
         alert('Cliente atualizado com sucesso!');
       } else {
-        await axios.post(`${API}/clients`, formData);
+        await createOwn(`${API}/clients`, formData);
         alert('Cliente adicionado com sucesso!');
       }
       // Limpar formulário
@@ -322,6 +421,7 @@ function App() {
   const handleDeleteTransaction = async (transactionId) => {
     if (window.confirm('Tem certeza que deseja deletar esta transação?')) {
       try {
+        trackOwnWrite(transactionId);
         await axios.delete(`${API}/transactions/${transactionId}`);
         alert('Transação deletada com sucesso!');
         // Recarregar dados
@@ -338,6 +438,7 @@ function App() {
   const handleDeleteClient = async (clientId) => {
     if (window.confirm('Tem certeza que deseja deletar este cliente?')) {
       try {
+        trackOwnWrite(clientId);
         await axios.delete(`${API}/clients/${clientId}`);
         alert('Cliente deletado com sucesso!');
         // Recarregar dados
@@ -0,0 +1,38 @@
+"""
+Shared test setup: puts backend/ on the import path so test modules can
+`import server`, and provides an in-memory Mongo (mongomock-motor) for the
+tests that go through the database. Tests that use `db` or `api` are skipped
+when mongomock-motor is not installed.
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """Fresh in-memory database installed as `server.db`"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    database = mongomock_motor.AsyncMongoMockClient()["painel_teste"]
+    monkeypatch.setattr(server, "db", database)
+    # Keeps the local event bus (and its debounce task) out of these requests
+    monkeypatch.setattr(server, "EVENTS_SOURCE", "change_stream")
+    monkeypatch.setattr(server, "archive_catalog", server.ArchiveCatalog())
+    # Caches are process-wide; a previous test must not answer for this one
+    for cache in (server.report_cache, server.transaction_cache, server.client_cache):
+        asyncio.run(cache.clear())
+    return database
+
+
+@pytest.fixture
+def api(db):
+    """TestClient for the app, backed by the `db` fixture (startup hooks do not run)"""
+    return TestClient(server.app)
@@ -0,0 +1,91 @@
+"""
+Tests for admission control: FIFO queueing up to the class limit, fast 429
+when the queue is full, 503 after the maximum wait, and the middleware
+routing requests to the right limiter.
+"""
+
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import server
+
+
+def make_limiter(concurrency=1, queue_size=1, timeout=1.0):
+    return server.AdmissionLimiter("teste", concurrency, queue_size, timeout, server.MetricsRegistry())
+
+
+def test_queue_hands_slot_over_and_rejects_when_full():
+    async def scenario():
+        limiter = make_limiter()
+        await limiter.acquire()
+        queued = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert (limiter.active, limiter.waiting) == (1, 1)
+
+        try:
+            await limiter.acquire()
+        except server.AdmissionRejected as rejected:
+            assert (rejected.status_code, rejected.reason) == (429, "fila_cheia")
+            assert rejected.retry_after >= 1
+        else:
+            raise AssertionError("expected a rejection")
+
+        limiter.release(0.5)
+        await queued
+        assert (limiter.active, limiter.waiting) == (1, 0)
+        limiter.release(0.5)
+        assert limiter.active == 0
+        assert limiter.registry.value("admission_rejected_total", (("limiter", "teste"), ("reason", "fila_cheia"))) == 1
+
+    asyncio.run(scenario())
+
+
+def test_waiting_too_long_returns_503():
+    async def scenario():
+        limiter = make_limiter(timeout=0.01)
+        await limiter.acquire()
+        try:
+            await limiter.acquire()
+        except server.AdmissionRejected as rejected:
+            assert rejected.status_code == 503
+        else:
+            raise AssertionError("expected a rejection")
+        assert limiter.waiting == 0
+        limiter.release()
+        assert limiter.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_middleware_classifies_routes(monkeypatch):
+    controller = server.AdmissionController(server.MetricsRegistry())
+    controller.classes["pesada"].concurrency = 0
+    controller.classes["pesada"].queue_size = 0
+    app = FastAPI()
+    app.add_middleware(server.AdmissionMiddleware, controller=controller)
+
+    @app.get("/api/reports/series")
+    async def series():
+        return []
+
+    @app.get("/api/reports/monthly")
+    async def monthly():
+        return []
+
+    @app.post("/api/transactions")
+    async def create():
+        return {}
+
+    monkeypatch.setattr(server, "app", app)
+    client = TestClient(app)
+
+    rejected = client.get("/api/reports/series")
+    assert rejected.status_code == 429
+    assert "retry-after" in rejected.headers
+    assert client.get("/api/reports/monthly").status_code == 200
+    assert controller.classes["interativa"].admitted == 1
+    assert client.post("/api/transactions").status_code == 200
+    assert controller.classes["critica"].admitted == 1
+    assert controller.classes["critica"].active == 0
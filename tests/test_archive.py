@@ -0,0 +1,94 @@
+"""
+Tests for the year-partitioned transaction archive: which partitions a date
+range reads, the order listings read them in, and how closed years refuse
+writes.
+"""
+
+import asyncio
+from datetime import date, datetime
+
+import server
+
+
+def make_catalog(**states):
+    catalog = server.ArchiveCatalog()
+    catalog.years = {int(ano[1:]): {"_id": int(ano[1:]), "estado": estado} for ano, estado in states.items()}
+    return catalog
+
+
+def names(collections):
+    return [collection.name for collection in collections]
+
+
+def test_partitions_follow_the_requested_range():
+    catalog = make_catalog(y2021="arquivado", y2022="arquivado", y2023="arquivando")
+
+    assert names(catalog.partitions()) == ["transactions", "transactions_2023", "transactions_2022", "transactions_2021"]
+    assert names(catalog.partitions(date(2022, 1, 1), date(2022, 12, 31))) == ["transactions_2022"]
+    assert names(catalog.partitions(date(2021, 6, 1), date(2022, 6, 1))) == ["transactions_2022", "transactions_2021"]
+    # Year still being archived: documents may be in either collection
+    assert names(catalog.partitions(date(2023, 1, 1), date(2023, 12, 31))) == ["transactions", "transactions_2023"]
+    assert names(catalog.partitions(date(2024, 1, 1), None)) == ["transactions"]
+
+
+def test_segments_read_hot_ranges_and_archives_newest_first():
+    catalog = make_catalog(y2020="arquivado", y2021="arquivado", y2023="arquivando")
+
+    segments = [[(collection.name, extra) for collection, extra in segment] for segment in catalog.segments()]
+
+    assert segments == [
+        [("transactions", {"data": {"$gte": datetime(2024, 1, 1)}})],
+        # Year being archived: both collections, merged without duplicates
+        [("transactions", {"data": {"$gte": datetime(2023, 1, 1), "$lt": datetime(2024, 1, 1)}}), ("transactions_2023", {})],
+        [("transactions", {"data": {"$gte": datetime(2022, 1, 1), "$lt": datetime(2023, 1, 1)}})],
+        [("transactions_2021", {})],
+        [("transactions_2020", {})],
+        # Missing dates come last in descending order, with the oldest hot years
+        [("transactions", {"$or": [{"data": {"$lt": datetime(2020, 1, 1)}}, {"data": None}]})],
+    ]
+    assert [[c.name for c, _ in segment] for segment in catalog.segments(date(2021, 1, 1), date(2022, 6, 1))] == [
+        ["transactions"], ["transactions_2021"],
+    ]
+
+
+def test_closed_years_refuse_writes():
+    catalog = make_catalog(y2022="arquivando")
+
+    assert catalog.closed_year_error({"ano": 2022}) == "O ano 2022 está arquivado e não aceita alterações"
+    assert catalog.closed_year_error({"ano": 2024}) is None
+    assert catalog.closed_year_error(None) is None
+    assert catalog.closed_filter() == {"ano": {"$nin": [2022]}}
+    assert catalog.archived(2022) is None
+
+
+def test_sort_key_orders_missing_dates_last_when_descending():
+    docs = [
+        {"id": "b", "data": None},
+        {"id": "a", "data": datetime(2022, 1, 1)},
+        {"id": "c", "data": datetime(2024, 1, 1)},
+        {"id": "d", "data": datetime(2024, 1, 1)},
+    ]
+
+    ordered = sorted(docs, key=server.keyset_sort_key("data"), reverse=True)
+
+    assert [doc["id"] for doc in ordered] == ["d", "c", "a", "b"]
+
+
+def test_bootstrap_page_continues_into_archived_years(api, db):
+    def sale(doc_id, day):
+        return {"id": doc_id, "tipo": "entrada", "categoria": "venda_oculos", "descricao": "Venda",
+                "valor": 100.0, "data": day, "ano": day.year, "mes": day.month}
+
+    async def scenario():
+        await db.transactions.insert_many([sale("quente-1", datetime(2024, 5, 2)), sale("quente-2", datetime(2024, 5, 1))])
+        await db.transactions_2022.insert_many([sale(f"arquivada-{i}", datetime(2022, 3, 10 - i)) for i in range(3)])
+        await db.transaction_archives.insert_one({"_id": 2022, "estado": "arquivado"})
+
+    asyncio.run(scenario())
+
+    page = api.get("/api/reports/bootstrap", params={"limit_transacoes": 4}).json()["transacoes"]
+    listing = api.get("/api/transactions", params={"limit": 4})
+
+    assert [item["id"] for item in page["itens"]] == ["quente-1", "quente-2", "arquivada-0", "arquivada-1"]
+    assert [item["id"] for item in listing.json()] == [item["id"] for item in page["itens"]]
+    assert page["next_cursor"] == listing.headers["X-Next-Cursor"]
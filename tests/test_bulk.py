@@ -0,0 +1,48 @@
+"""
+Tests for the bulk routes: a batch mixing valid and invalid operations applies
+the valid ones and reports each item with the status its single-item route
+would have answered.
+"""
+
+import asyncio
+
+SALE = {"tipo": "entrada", "categoria": "venda_oculos", "descricao": "Venda", "valor": 100, "data": "2024-03-05"}
+
+
+def test_mixed_batch_reports_each_item(api, db):
+    kept = api.post("/api/transactions", json=SALE).json()["id"]
+    removed = api.post("/api/transactions", json={**SALE, "valor": 40}).json()["id"]
+
+    response = api.post("/api/transactions/bulk", json=[
+        {"op": "create", "dados": {**SALE, "valor": 70}},
+        {"op": "create", "dados": {**SALE, "valor": "muito"}},
+        {"op": "update", "id": kept, "dados": {"valor": 150}},
+        {"op": "update", "dados": {"valor": 1}},
+        {"op": "delete", "id": "inexistente"},
+        {"op": "delete", "id": removed},
+        {"op": "update", "id": removed, "dados": {"valor": 1}},
+        {"op": "update", "id": kept, "dados": {}},
+    ])
+
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["sucesso"], body["falhas"]) == (3, 5)
+    outcome = [(item["indice"], item["sucesso"], item["status"]) for item in body["resultados"]]
+    assert outcome == [
+        (0, True, None),
+        (1, False, 422),
+        (2, True, None),
+        (3, False, 400),   # no id
+        (4, False, 404),
+        (5, True, None),
+        (6, False, 400),   # same id twice in the batch
+        (7, False, 400),   # nothing to update
+    ]
+    created = body["resultados"][0]["id"]
+
+    stored = {doc["id"]: doc["valor"] for doc in asyncio.run(db.transactions.find().to_list(None))}
+    assert stored == {kept: 150, created: 70}
+    # Only the applied items reach the rollups
+    march = next(row for row in api.get("/api/reports/monthly", params={"ano": 2024}).json() if row["mes"] == 3)
+    assert (march["total_entradas"], march["transacoes_count"]) == (220, 2)
+
@@ -0,0 +1,45 @@
+"""
+Tests for the client value fields kept by transaction writes: total spent,
+purchase count and last purchase follow updates, moves between clients,
+type changes and deletes, and agree with a full recount afterwards.
+"""
+
+import asyncio
+from datetime import datetime
+
+
+def sale(cliente_id, valor, data):
+    return {"tipo": "entrada", "categoria": "venda_oculos", "descricao": "Venda", "valor": valor,
+            "data": data, "cliente_id": cliente_id}
+
+
+def values(db, cliente_id):
+    doc = asyncio.run(db.clients.find_one({"id": cliente_id}))
+    return doc["total_gasto"], doc["compras_registradas"], doc["ultima_compra"]
+
+
+def test_client_totals_follow_transaction_updates_and_deletes(api, db):
+    # Without `ultima_compra`, like clients stored before the field existed
+    asyncio.run(db.clients.insert_many([{"id": "ana", "nome": "Ana"}, {"id": "bia", "nome": "Bia"}]))
+    first, second, third = (
+        api.post("/api/transactions", json=sale("ana", valor, data)).json()["id"]
+        for valor, data in ((100, "2024-03-01"), (50, "2024-03-05"), (30, "2024-03-10"))
+    )
+    assert values(db, "ana") == (180, 3, datetime(2024, 3, 10))
+
+    assert api.put(f"/api/transactions/{second}", json={"valor": 80}).status_code == 200
+    assert values(db, "ana") == (210, 3, datetime(2024, 3, 10))
+
+    # Moving the latest purchase to another client brings the last purchase back
+    assert api.put(f"/api/transactions/{third}", json={"cliente_id": "bia"}).status_code == 200
+    assert values(db, "ana") == (180, 2, datetime(2024, 3, 5))
+    assert values(db, "bia") == (30, 1, datetime(2024, 3, 10))
+
+    # An expense is not a purchase
+    assert api.put(f"/api/transactions/{first}", json={"tipo": "saida"}).status_code == 200
+    assert values(db, "ana") == (80, 1, datetime(2024, 3, 5))
+
+    assert api.delete(f"/api/transactions/{second}").status_code == 200
+    assert values(db, "ana") == (0, 0, None)
+
+    assert api.get("/api/admin/client-values/verify").json()["divergencias"] == []
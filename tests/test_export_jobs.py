@@ -0,0 +1,175 @@
+"""
+Tests for the export jobs: Range parsing on the download route, a job going
+from submission to a resumable download, the bounded queue answering 429, and
+the collection of expired jobs and their files.
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+
+SALES = [
+    {"id": f"venda-{i}", "tipo": "entrada", "categoria": "venda_oculos", "descricao": f"Venda {i}",
+     "valor": 100.0 + i, "data": datetime(2024, 3, i + 1)}
+    for i in range(20)
+]
+
+
+@pytest.fixture
+def jobs(db, tmp_path, monkeypatch):
+    manager = server.ExportJobManager(directory=str(tmp_path), workers=1, queue_size=2, ttl=60)
+    monkeypatch.setattr(server, "export_jobs", manager)
+    return manager
+
+
+def run_job(manager, request):
+    async def scenario():
+        manager.start()
+        try:
+            job = await manager.submit(request)
+            while (job := await manager.get(job.id)).status in (server.ExportJobStatus.PENDENTE,
+                                                                 server.ExportJobStatus.EXECUTANDO):
+                await asyncio.sleep(0.01)
+            return job
+        finally:
+            await manager.stop()
+    return asyncio.run(scenario())
+
+
+def test_parse_range_forms():
+    assert server.parse_range(None, 100) is None
+    assert server.parse_range("bytes=0-9", 100) == (0, 9)
+    assert server.parse_range("bytes=90-", 100) == (90, 99)
+    assert server.parse_range("bytes=-10", 100) == (90, 99)
+    assert server.parse_range("bytes=50-500", 100) == (50, 99)
+    # Unsupported forms fall back to the whole file
+    assert server.parse_range("bytes=0-1,5-9", 100) is None
+    assert server.parse_range("items=0-9", 100) is None
+    assert server.parse_range("bytes=a-b", 100) is None
+
+
+def test_parse_range_past_the_end_is_unsatisfiable():
+    with pytest.raises(server.HTTPException) as error:
+        server.parse_range("bytes=100-", 100)
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == "bytes */100"
+
+
+def test_job_runs_to_a_resumable_download(api, db, jobs):
+    asyncio.run(db.transactions.insert_many([dict(doc) for doc in SALES]))
+
+    job = run_job(jobs, server.ExportJobCreate(recurso="transactions", formato="ndjson"))
+
+    assert job.status == server.ExportJobStatus.CONCLUIDO
+    assert (job.progresso, job.linhas_processadas) == (100.0, 20)
+    assert [item["id"] for item in api.get("/api/export/jobs").json()] == [job.id]
+
+    full = api.get(job.download_url)
+    assert full.status_code == 200
+    assert len(full.content) == job.tamanho_bytes
+    assert full.content.decode().count("\n") == 20
+
+    tail = api.get(job.download_url, headers={"Range": "bytes=10-"})
+    assert tail.status_code == 206
+    assert tail.headers["Content-Range"] == f"bytes 10-{job.tamanho_bytes - 1}/{job.tamanho_bytes}"
+    assert tail.content == full.content[10:]
+
+    past_end = api.get(job.download_url, headers={"Range": f"bytes={job.tamanho_bytes}-"})
+    assert past_end.status_code == 416
+
+    # A stale If-Range gets the whole file instead of a piece of another one
+    stale = api.get(job.download_url, headers={"Range": "bytes=10-", "If-Range": '"outro"'})
+    assert (stale.status_code, stale.content) == (200, full.content)
+
+    assert api.delete(f"/api/export/jobs/{job.id}").status_code == 200
+    assert not os.path.exists(jobs.path(job))
+    assert api.get(f"/api/export/jobs/{job.id}").status_code == 404
+
+
+class SlowInsert:
+    """Collection wrapper whose insert yields first, so two submits overlap"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def insert_one(self, doc):
+        await asyncio.sleep(0)
+        return await self.collection.insert_one(doc)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+class SlowInsertManager(server.ExportJobManager):
+    @property
+    def collection(self):
+        return SlowInsert(server.db[self.collection_name])
+
+
+def test_full_queue_answers_429_and_keeps_no_record(db, tmp_path):
+    # No workers: the queue only drains when the test says so. Both submits
+    # see a free slot before inserting; the second one loses it meanwhile
+    manager = SlowInsertManager(directory=str(tmp_path), workers=0, queue_size=1)
+    request = server.ExportJobCreate(recurso="clients")
+
+    async def scenario():
+        manager.start()
+        try:
+            return await asyncio.gather(manager.submit(request), manager.submit(request), return_exceptions=True)
+        finally:
+            manager._queue = None  # nothing left to fail: drop the queued job before stop()
+            manager.jobs.clear()
+            await manager.stop()
+
+    accepted, refused = sorted(asyncio.run(scenario()), key=lambda item: isinstance(item, Exception))
+
+    assert isinstance(accepted, server.ExportJob)
+    assert refused.status_code == 429
+    assert refused.headers["Retry-After"] == "30"
+    assert [doc["_id"] for doc in asyncio.run(db.export_jobs.find().to_list(None))] == [accepted.id]
+
+
+def test_submit_before_start_is_unavailable(db, tmp_path):
+    manager = server.ExportJobManager(directory=str(tmp_path))
+
+    with pytest.raises(server.HTTPException) as error:
+        asyncio.run(manager.submit(server.ExportJobCreate(recurso="clients")))
+
+    assert error.value.status_code == 503
+
+
+def test_collect_expired_removes_old_jobs_and_orphan_files(db, tmp_path):
+    manager = server.ExportJobManager(directory=str(tmp_path), ttl=60, stale_seconds=30)
+    now = datetime.utcnow()
+
+    def stored_job(expira_em):
+        job = server.ExportJob(recurso="clients", status=server.ExportJobStatus.CONCLUIDO,
+                               concluido_em=now, expira_em=expira_em)
+        asyncio.run(db.export_jobs.insert_one({**job.dict(), "_id": job.id, "remover_em": expira_em}))
+        open(manager.path(job), "w").close()
+        return job
+
+    expired = stored_job(now - timedelta(seconds=1))
+    valid = stored_job(now + timedelta(seconds=60))
+    orphan = tmp_path / f"{uuid.uuid4()}.csv"
+    orphan_partial = tmp_path / f"{uuid.uuid4()}.csv.part"
+    recent_partial = tmp_path / f"{uuid.uuid4()}.csv.part"
+    for path in (orphan, orphan_partial, recent_partial):
+        path.touch()
+    old = time.time() - 120
+    os.utime(orphan, (old, old))
+    os.utime(orphan_partial, (old, old))
+
+    assert asyncio.run(manager.collect_expired()) == 1
+
+    assert not os.path.exists(manager.path(expired))
+    assert os.path.exists(manager.path(valid))
+    assert not orphan.exists() and not orphan_partial.exists()
+    assert recent_partial.exists()
+    assert [doc["_id"] for doc in asyncio.run(db.export_jobs.find().to_list(None))] == [valid.id]
@@ -0,0 +1,110 @@
+"""
+Contract test for the fast serialization path: raw Mongo documents encoded by
+`fast_json_response` must produce exactly the same bytes as the
+`response_model=List[...]` path built from Pydantic models.
+"""
+
+import json
+from datetime import datetime
+from typing import List
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import server
+
+TRANSACTION_DOCS = [
+    {
+        "id": "t-1", "tipo": "entrada", "categoria": "venda_oculos", "descricao": "Armação + lentes",
+        "valor": 1250.9, "data": datetime(2024, 3, 15), "cliente_nome": "João da Silva",
+        "cliente_id": "c-1", "observacoes": "Pagamento em 3x \"sem juros\"",
+        "created_at": datetime(2024, 3, 15, 14, 30, 5, 123000), "version": 3,
+    },
+    # Legacy document: integer valor, ISO string data, no version
+    {
+        "id": "t-2", "tipo": "saida", "categoria": "aluguel", "valor": 3000, "data": "2023-12-01",
+        "created_at": datetime(2023, 12, 1, 9, 0),
+    },
+    # Missing and null fields
+    {"id": "t-3", "tipo": None, "valor": None, "data": None, "created_at": datetime(2024, 1, 1)},
+    # Floats printed in exponent notation force the plain json fallback
+    {"id": "t-4", "tipo": "entrada", "valor": 1e16, "data": datetime(2024, 1, 2), "created_at": datetime(2024, 1, 2)},
+    {"id": "t-5", "tipo": "entrada", "valor": 0.00001, "data": datetime(2024, 1, 3), "created_at": datetime(2024, 1, 3)},
+]
+
+CLIENT_DOCS = [
+    {
+        "id": "c-1", "nome": "Ângela Conceição", "email": "angela@example.com", "telefone": "(11) 98888-7777",
+        "endereco": "Rua São João, 10", "status": "inadimplente", "valor_devido": 349.99,
+        "data_ultimo_pagamento": "2024-02-10", "estado_civil": "casado", "numero_filhos": 2,
+        "escolaridade": "superior", "tem_cartao_credito": True, "renda_bruta": 5200.5, "idade": 41,
+        "frequencia_compra": "regular", "quantidade_compras": 7, "tipo_compra": "premium",
+        "origem_cliente": "instagram", "observacoes": None,
+        "created_at": datetime(2024, 1, 5, 10, 0, 0, 1000), "version": 2,
+    },
+    # Minimal document: model defaults (status, valor_devido...) must show up
+    {"id": "c-2", "nome": "Bruno", "created_at": datetime(2024, 1, 6)},
+    # Stored values whose type differs from the model
+    {"id": "c-3", "nome": "Carla", "valor_devido": 10, "renda_bruta": 2500, "status": None,
+     "tem_cartao_credito": False, "created_at": datetime(2024, 1, 7)},
+]
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/models/transactions", response_model=List[server.Transaction])
+    async def model_transactions():
+        return [server.Transaction(**server.transaction_from_db(dict(doc))) for doc in TRANSACTION_DOCS]
+
+    @app.get("/models/clients", response_model=List[server.Client])
+    async def model_clients():
+        return [server.Client(**doc) for doc in CLIENT_DOCS]
+
+    @app.get("/fast/transactions", response_model=List[server.Transaction])
+    async def fast_transactions():
+        return server.fast_json_response(server.Transaction, TRANSACTION_DOCS)
+
+    @app.get("/fast/clients", response_model=List[server.Client])
+    async def fast_clients():
+        return server.fast_json_response(server.Client, CLIENT_DOCS)
+
+    return app
+
+
+@pytest.fixture(params=["orjson", "json"])
+def client(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(server, "orjson", None)
+    elif server.orjson is None:
+        pytest.skip("orjson is not installed")
+    return TestClient(build_app())
+
+
+@pytest.mark.parametrize("resource", ["transactions", "clients"])
+def test_fast_path_is_byte_equivalent(client, resource):
+    expected = client.get(f"/models/{resource}")
+    actual = client.get(f"/fast/{resource}")
+
+    assert expected.status_code == actual.status_code == 200
+    assert actual.headers["content-type"] == expected.headers["content-type"]
+    assert actual.content == expected.content
+
+
+@pytest.mark.parametrize("model, docs", [
+    (server.Transaction, TRANSACTION_DOCS[:3]),
+    (server.Client, CLIENT_DOCS),
+])
+def test_single_documents_match_model_dump(model, docs):
+    for doc in docs:
+        prepared = server.transaction_from_db(dict(doc)) if model is server.Transaction else doc
+        encoded = json.loads(server.encode_documents_json(model, [doc]))[0]
+        assert encoded == model(**prepared).model_dump(mode="json")
+
+
+def test_projection_covers_response_fields():
+    projection = server.fast_projection(server.Client)
+
+    assert projection.pop("_id") == 0
+    assert set(projection) == set(server.Client.model_fields)
@@ -0,0 +1,72 @@
+"""
+Tests for Idempotency-Key on POST /transactions: replays return the original
+response, a different body with the same key is refused, and a claim left
+behind by an interrupted attempt is recovered.
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import server
+
+BODY = {"tipo": "saida", "categoria": "aluguel", "descricao": "Aluguel da loja", "valor": 3000, "data": "2024-03-05"}
+
+
+def post(api, body=BODY, key="chave-1"):
+    return api.post("/api/transactions", json=body, headers={"Idempotency-Key": key})
+
+
+def stale_claim(resource_id):
+    now = datetime.utcnow()
+    return {
+        "_id": "transactions:chave-1", "status": "em_andamento", "recurso_id": resource_id,
+        "hash": server.request_fingerprint(server.TransactionCreate(**BODY)),
+        "criado_em": now - timedelta(minutes=5), "bloqueado_ate": now - timedelta(minutes=4),
+        "expira_em": now + timedelta(days=1),
+    }
+
+
+def test_replay_returns_the_original_transaction(api):
+    first = post(api)
+    replay = post(api)
+
+    assert first.status_code == replay.status_code == 200
+    assert replay.json() == first.json()
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert replay.headers["ETag"] == first.headers["ETag"]
+    assert "Idempotent-Replayed" not in first.headers
+    assert [t["id"] for t in api.get("/api/transactions").json()] == [first.json()["id"]]
+
+
+def test_same_key_with_another_body_is_rejected(api):
+    post(api)
+
+    response = post(api, {**BODY, "valor": 3500})
+
+    assert response.status_code == 422
+    assert len(api.get("/api/transactions").json()) == 1
+
+
+def test_stale_claim_without_document_is_taken_over(api, db):
+    asyncio.run(db.idempotency_keys.insert_one(stale_claim("nunca-gravado")))
+
+    response = post(api)
+
+    assert response.status_code == 200
+    assert "Idempotent-Replayed" not in response.headers
+    record = asyncio.run(db.idempotency_keys.find_one({"_id": "transactions:chave-1"}))
+    assert record["status"] == "concluida"
+    assert record["recurso_id"] == response.json()["id"]
+
+
+def test_stale_claim_with_document_is_completed_with_it(api, db):
+    _, doc = server.build_transaction_doc(server.TransactionCreate(**BODY))
+    asyncio.run(db.transactions.insert_one(dict(doc)))
+    asyncio.run(db.idempotency_keys.insert_one(stale_claim(doc["id"])))
+
+    response = post(api)
+
+    assert response.status_code == 200
+    assert response.headers["Idempotent-Replayed"] == "true"
+    assert response.json()["id"] == doc["id"]
+    assert len(api.get("/api/transactions").json()) == 1
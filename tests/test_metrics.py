@@ -0,0 +1,68 @@
+"""
+Tests for the in-memory metrics registry and the HTTP metrics middleware:
+Prometheus text output and route-template labels, plus the bounded plan cache
+of the slow query log.
+"""
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import server
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = server.MetricsRegistry(buckets=(0.1, 1.0))
+    registry.describe("latency_seconds", "histogram", "Latency")
+    for value in (0.05, 0.5, 0.5, 3.0):
+        registry.observe("latency_seconds", (("route", "/a"),), value)
+
+    lines = registry.render().splitlines()
+
+    assert lines[:2] == ["# HELP latency_seconds Latency", "# TYPE latency_seconds histogram"]
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{route="/a",le="1.0"} 3' in lines
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 4' in lines
+    assert 'latency_seconds_count{route="/a"} 4' in lines
+    assert 'latency_seconds_sum{route="/a"} 4.05' in lines
+
+
+def test_label_values_are_escaped():
+    registry = server.MetricsRegistry()
+    registry.inc("errors_total", (("reason", 'say "hi"\n'),))
+
+    assert 'errors_total{reason="say \\"hi\\"\\n"} 1' in registry.render()
+
+
+def test_middleware_labels_requests_by_route_template(monkeypatch):
+    registry = server.MetricsRegistry()
+    app = FastAPI()
+    app.add_middleware(server.MetricsMiddleware, registry=registry)
+
+    @app.get("/api/items/{item_id}")
+    async def get_item(item_id: str):
+        return {"id": item_id}
+
+    # resolve_route_template looks routes up on the module-level app
+    monkeypatch.setattr(server, "app", app)
+    client = TestClient(app)
+    client.get("/api/items/1")
+    client.get("/api/items/2")
+    client.get("/missing")
+
+    labels = (("method", "GET"), ("route", "/api/items/{item_id}"))
+    assert registry.value("http_requests_total", labels + (("status", "200"),)) == 2
+    assert registry.value("http_requests_in_flight", labels) == 0
+    assert registry.value("http_requests_total", (("method", "GET"), ("route", "desconhecida"), ("status", "404"))) == 1
+
+
+def test_slow_query_plan_cache_is_bounded():
+    log = server.SlowQueryLog(threshold_ms=10, explain_interval=60, max_plans=2)
+    log._store_plan("a", {})
+    log._store_plan("b", {})
+    log._plans.move_to_end("a")  # cache hit
+    log._store_plan("c", {})
+    assert list(log._plans) == ["a", "c"]
+
+    log.explain_interval = 0  # everything stored so far is past its TTL
+    log._store_plan("d", {})
+    assert list(log._plans) == ["d"]
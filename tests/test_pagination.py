@@ -0,0 +1,43 @@
+"""
+Tests for cursor pagination: walking every page with X-Next-Cursor returns
+each document exactly once, in order, even with ties and missing sort keys.
+"""
+
+import asyncio
+from datetime import datetime
+
+
+def walk(api, url, limit=3):
+    ids, cursor = [], None
+    while True:
+        params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+        response = api.get(url, params=params)
+        assert response.status_code == 200
+        ids += [item["id"] for item in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return ids
+
+
+def test_transaction_walk_with_missing_dates(api, db):
+    def sale(doc_id, data):
+        return {"id": doc_id, "tipo": "entrada", "categoria": "venda_oculos", "descricao": "Venda",
+                "valor": 10.0, "data": data}
+
+    same_day = datetime(2024, 3, 5)
+    docs = [
+        sale("t1", datetime(2024, 3, 9)), sale("t2", same_day), sale("t3", same_day), sale("t4", same_day),
+        sale("t5", None), sale("t6", datetime(2023, 1, 1)), sale("t7", None), sale("t8", None),
+    ]
+    asyncio.run(db.transactions.insert_many(docs))
+
+    # Newest first, ties by id descending, missing dates last
+    assert walk(api, "/api/transactions") == ["t1", "t4", "t3", "t2", "t6", "t8", "t7", "t5"]
+
+
+def test_client_walk_with_missing_names(api, db):
+    clients = [{"id": f"c{i}", "nome": nome} for i, nome in enumerate(["Bia", None, "Ana", None, "Bia", "Caio", None])]
+    asyncio.run(db.clients.insert_many(clients))
+
+    # Ascending: missing names first, then by name, ties by id
+    assert walk(api, "/api/clients", limit=2) == ["c1", "c3", "c6", "c2", "c0", "c4", "c5"]
@@ -0,0 +1,66 @@
+"""
+Tests for the vectorized customer segmentation: k-means on separable data and
+incremental reassignment keeping the segment profiles consistent.
+"""
+
+import numpy as np
+
+import server
+
+
+def make_clients(count, renda, idade, tipo_compra, prefix):
+    return [
+        {"id": f"{prefix}-{i}", "renda_bruta": renda + i, "idade": idade, "numero_filhos": 0,
+         "tem_cartao_credito": tipo_compra == "luxo", "tipo_compra": tipo_compra}
+        for i in range(count)
+    ]
+
+
+CLIENTS = (
+    make_clients(60, 2000, 25, "economico", "a")
+    + make_clients(30, 30000, 60, "luxo", "b")
+)
+
+
+def fit(clients, k=2):
+    return server.SegmentationModel.fit([c["id"] for c in clients], server.segment_rows(clients), k)
+
+
+def test_kmeans_separates_distinct_profiles():
+    model = fit(CLIENTS)
+    profiles = model.profiles()
+
+    # Segments are numbered from largest to smallest
+    assert [p["clientes"] for p in profiles] == [60, 30]
+    assert profiles[0]["predominante"]["tipo_compra"] == "economico"
+    assert profiles[1]["predominante"]["tipo_compra"] == "luxo"
+    assert profiles[1]["percentual_cartao_credito"] == 100.0
+    assert {model.segment_of(f"a-{i}") for i in range(60)} == {0}
+
+
+def test_missing_fields_are_imputed():
+    rows = server.segment_rows([{"id": "x"}, {"id": "y", "escolaridade": "superior", "idade": 40}])
+
+    assert np.isnan(rows[0, server.SEGMENT_COLUMNS["idade"].start])
+    assert rows[1, server.SEGMENT_COLUMNS["escolaridade"]].tolist() == [0, 0, 0, 1, 0]
+    model = server.SegmentationModel.fit(["x", "y"], rows, 2)
+    assert not np.isnan(model.centers).any()
+
+
+def test_incremental_changes_match_a_fresh_assignment():
+    model = fit(CLIENTS)
+    moved = dict(CLIENTS[0], renda_bruta=31000, idade=58, tipo_compra="luxo", tem_cartao_credito=True)
+    created = {"id": "novo", "renda_bruta": 1900, "idade": 22, "tipo_compra": "economico"}
+
+    model.apply_change(CLIENTS[0], moved)
+    model.apply_change(None, created)
+    model.apply_change(CLIENTS[1], None)
+
+    assert model.segment_of("a-0") == 1
+    assert model.segment_of("novo") == 0
+    assert model.segment_of("a-1") is None
+    assert model.changes == 3
+    profiles = model.profiles()
+    assert [p["clientes"] for p in profiles] == [59, 31]
+    expected = np.mean([c["renda_bruta"] for c in CLIENTS[1:] if c["id"] != "a-1" and c["id"].startswith("b")] + [31000])
+    assert profiles[1]["renda_bruta_media"] == round(expected, 2)
@@ -0,0 +1,71 @@
+"""
+Tests for /reports/series: bucket boundaries and labels for weeks and
+quarters, and how the previous-year window lines up with the requested one.
+"""
+
+import asyncio
+from datetime import date, datetime
+
+import pytest
+
+import server
+
+WEEK = server.SeriesGranularity.SEMANA
+MONTH = server.SeriesGranularity.MES
+QUARTER = server.SeriesGranularity.TRIMESTRE
+
+
+def test_weeks_start_on_monday_and_use_iso_labels():
+    # 2024-12-30 is a Monday that belongs to ISO week 1 of 2025
+    assert server.series_bucket_start(date(2025, 1, 1), WEEK) == date(2024, 12, 30)
+    assert server.series_bucket_start(date(2024, 12, 29), WEEK) == date(2024, 12, 23)
+    assert server.series_label(date(2024, 12, 30), WEEK) == "2025-W01"
+    assert server.series_label(date(2020, 12, 28), WEEK) == "2020-W53"
+
+    buckets = server.series_buckets(date(2024, 12, 25), date(2025, 1, 6), WEEK)
+
+    assert buckets == [date(2024, 12, 23), date(2024, 12, 30), date(2025, 1, 6)]
+
+
+def test_quarters_roll_over_the_year():
+    assert server.series_bucket_start(date(2024, 3, 31), QUARTER) == date(2024, 1, 1)
+    assert server.series_bucket_start(date(2024, 4, 1), QUARTER) == date(2024, 4, 1)
+    assert server.series_next_bucket(date(2024, 10, 1), QUARTER) == date(2025, 1, 1)
+    assert server.series_label(date(2024, 10, 1), QUARTER) == "2024-T4"
+
+    buckets = server.series_buckets(date(2024, 11, 15), date(2025, 2, 1), QUARTER)
+
+    assert [server.series_label(start, QUARTER) for start in buckets] == ["2024-T4", "2025-T1"]
+
+
+def test_too_many_points_is_rejected():
+    with pytest.raises(server.HTTPException) as error:
+        server.series_buckets(date(2000, 1, 1), date(2024, 1, 1), server.SeriesGranularity.DIA)
+    assert error.value.status_code == 400
+
+
+def test_previous_year_is_aligned_with_the_requested_window(db):
+
+    def rollup(day, entradas=0.0, saidas=0.0):
+        return {"dia": datetime(day.year, day.month, day.day), "ano": day.year, "mes": day.month,
+                "categoria": "venda_oculos", "entradas": entradas, "saidas": saidas, "count": 1}
+
+    async def scenario():
+        await db.transaction_rollups.insert_many([
+            rollup(date(2024, 2, 29), entradas=100),  # current, leap day
+            rollup(date(2024, 3, 10), saidas=40),     # current
+            rollup(date(2023, 2, 28), entradas=80),   # previous year, lands in February
+            rollup(date(2023, 3, 31), entradas=20),   # previous year, last day of the window
+            rollup(date(2023, 4, 1), entradas=999),   # between the windows: ignored
+        ])
+        return await server.compute_series(date(2024, 2, 1), date(2024, 3, 31), MONTH, None, compare=True)
+
+    result = asyncio.run(scenario())
+
+    assert result["periodo_anterior"] == {"inicio": "2023-02-01", "fim": "2023-03-31"}
+    february, march = result["pontos"]
+    assert (february["periodo"], february["entradas"], february["ano_anterior"]["entradas"]) == ("2024-02", 100, 80)
+    assert february["ano_anterior"]["variacao_faturamento"] == 25.0
+    assert (march["periodo"], march["saidas"], march["ano_anterior"]["entradas"]) == ("2024-03", 40, 20)
+    assert result["totais"]["faturamento_liquido"] == 60
+    assert result["totais_ano_anterior"]["entradas"] == 100
@@ -0,0 +1,43 @@
+"""
+Tests for optimistic concurrency: PUT and DELETE with If-Match apply only
+while the version is current, answer 409 once another write moved it on,
+and keep 404 for documents that do not exist.
+"""
+
+SALE = {"tipo": "entrada", "categoria": "venda_oculos", "descricao": "Venda", "valor": 100, "data": "2024-03-05"}
+
+
+def test_stale_if_match_on_update_is_a_conflict(api):
+    created = api.post("/api/transactions", json=SALE)
+    url = f"/api/transactions/{created.json()['id']}"
+    assert created.headers["ETag"] == '"1"'
+
+    first = api.put(url, json={"valor": 120}, headers={"If-Match": created.headers["ETag"]})
+    assert (first.status_code, first.headers["ETag"]) == (200, '"2"')
+
+    # A second writer still holding version 1 must not overwrite the first one
+    stale = api.put(url, json={"valor": 130}, headers={"If-Match": created.headers["ETag"]})
+    assert stale.status_code == 409
+    assert stale.json()["detail"] == "Conflito de versão: versão atual é 2"
+
+    current = api.get(url)
+    assert (current.json()["valor"], current.headers["ETag"]) == (120, '"2"')
+
+
+def test_stale_if_match_on_delete_is_a_conflict(api):
+    created = api.post("/api/clients", json={"nome": "Ana Souza"}).json()
+    url = f"/api/clients/{created['id']}"
+    assert api.put(url, json={"telefone": "11999990000"}).status_code == 200
+
+    assert api.delete(url, headers={"If-Match": '"1"'}).status_code == 409
+    assert api.get(url).status_code == 200
+
+    # Weak tags and lists are accepted; any listed version that is current wins
+    assert api.delete(url, headers={"If-Match": 'W/"1", "2"'}).status_code == 200
+    assert api.get(url).status_code == 404
+
+
+def test_if_match_on_a_missing_document_is_not_found(api):
+    response = api.put("/api/transactions/inexistente", json={"valor": 10}, headers={"If-Match": '"1"'})
+
+    assert response.status_code == 404